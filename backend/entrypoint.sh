@@ -1,5 +1,25 @@
 #!/bin/bash
 
+# Wait for PostgreSQL when it is the configured database
+if [ "$DB_ENGINE" = "postgres" ]; then
+    until pg_isready -q -h "${POSTGRES_HOST:-db}" -p "${POSTGRES_PORT:-5432}"; do
+        sleep 1
+    done
+fi
+
 python manage.py migrate
 
-gunicorn --bind 0.0.0.0:8000 filemanager.wsgi:application
\ No newline at end of file
+# Workers write metrics to per-process files here; /api/metrics/ sums them
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Background jobs (blob deletion, preview generation)
+python manage.py runworker &
+
+# SERVER_MODE=asgi serves the app from uvicorn workers so slow downloads and
+# uploads hold a coroutine instead of a whole worker process
+if [ "$SERVER_MODE" = "asgi" ]; then
+    gunicorn --bind 0.0.0.0:8000 -k uvicorn_worker.UvicornWorker filemanager.asgi:application
+else
+    gunicorn --bind 0.0.0.0:8000 filemanager.wsgi:application
+fi
\ No newline at end of file
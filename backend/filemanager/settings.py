@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -62,6 +63,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'filemanagerapp.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -96,12 +98,63 @@ WSGI_APPLICATION = 'filemanager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres switches to PostgreSQL configured from the POSTGRES_*
+# variables; the default is the SQLite file below.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+# Persistent connections are off by default under ASGI, where Django doesn't
+# reuse them between requests; use DB_POOL=1 with PostgreSQL there instead
+DB_CONN_MAX_AGE = int(os.environ.get(
+    'DB_CONN_MAX_AGE', 0 if os.environ.get('SERVER_MODE') == 'asgi' else 60))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'filemanager'),
+            'USER': os.environ.get('POSTGRES_USER', 'filemanager'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get('DB_POOL', '0') == '1':
+        # psycopg's pool is shared by all threads of a worker process
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            }
+        }
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Keep connections (and their pragmas) across requests
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # WAL lets readers run alongside the single writer, and
+                # NORMAL sync is safe with WAL. Writers wait up to
+                # ``timeout`` seconds for the lock instead of failing, and
+                # IMMEDIATE transactions take it up front so two writers
+                # can't deadlock upgrading.
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=134217728;'
+                    'PRAGMA temp_store=MEMORY'
+                ),
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 5,
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -153,6 +206,7 @@ CORS_ALLOW_METHODS = [
     'DELETE',
     'GET',
     'POST',
+    'PUT',
 ]
 
 CORS_ALLOW_HEADERS = [
@@ -164,24 +218,85 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'range',
+    'if-range',
 ]
 
 # Configure media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Password hashing cost. Each bcrypt round doubles the work of a login;
+# `manage.py bench_password_hashers` shows logins/second/core per setting.
+# Hashes made at another cost are upgraded on the user's next login.
+PASSWORD_BCRYPT_ROUNDS = int(os.environ.get('PASSWORD_BCRYPT_ROUNDS', 12))
+PASSWORD_PBKDF2_ITERATIONS = int(
+    os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 1_000_000))
+
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
-    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'filemanagerapp.hashers.TunedBCryptSHA256PasswordHasher',
+    'filemanagerapp.hashers.TunedPBKDF2PasswordHasher',
     'django.contrib.auth.hashers.Argon2PasswordHasher',
     'django.contrib.auth.hashers.BCryptPasswordHasher',
 ]
 
+# Share links stream the decrypted file; the legacy ?format=json response
+# is only served for files up to this size
+SHARE_JSON_MAX_BYTES = 10 * 1024 * 1024
+
+# Unknown share tokens are remembered for this many seconds so repeated
+# lookups of the same bad token don't reach the database
+SHARE_LINK_MISS_TTL = 30
+
+# Encrypted preview renditions made at upload time (see previews.py)
+PREVIEWS_ENABLED = True
+PREVIEW_IMAGE_SIZE = 256
+PREVIEW_TEXT_BYTES = 16 * 1024
+PREVIEW_MAX_SOURCE_BYTES = 50 * 1024 * 1024
+
+# /api/metrics/ needs a token, sent by scrapers as "Authorization: Bearer
+# <token>"; without one it is only served when DEBUG is on. Set PROMETHEUS_MULTIPROC_DIR to aggregate
+# metrics across gunicorn workers (the entrypoint does this).
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Background jobs (filemanagerapp/jobs.py), run by `manage.py runworker`.
+# JOBS_RUN_INLINE=1 runs each job as soon as it is queued, for development
+# without a worker.
+JOBS_RUN_INLINE = os.environ.get('JOBS_RUN_INLINE', '0') == '1'
+JOBS_WORKER_PROCESSES = 2
+JOBS_VISIBILITY_TIMEOUT = 300
+JOBS_RETRY_BASE_DELAY = 5
+JOBS_RETENTION = 24 * 60 * 60
+
+# Default per-user storage quota in bytes (unset means unlimited). A user's
+# own StorageUsage.quota_bytes overrides it.
+STORAGE_QUOTA_BYTES = (int(os.environ['STORAGE_QUOTA_BYTES'])
+                       if os.environ.get('STORAGE_QUOTA_BYTES') else None)
+
+# Resumable uploads: idle sessions expire after UPLOAD_SESSION_TTL seconds
+# and a single part may not exceed UPLOAD_PART_MAX_BYTES
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+UPLOAD_PART_MAX_BYTES = 64 * 1024 * 1024
+
 # JWT settings
 JWT_SECRET_KEY = 'JWTSECRET@123'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_DELTA = timedelta(days=1)
 
+# When enabled, download_file only authorizes the request and lets nginx
+# send the blob from its internal DOWNLOAD_ACCEL_PREFIX location (see
+# frontend/nginx.conf). Leave off when running without nginx.
+DOWNLOAD_ACCEL_REDIRECT = os.environ.get('DOWNLOAD_ACCEL_REDIRECT', '0') == '1'
+DOWNLOAD_ACCEL_PREFIX = '/protected-uploads/'
+
+# SERVER_MODE=asgi (set in entrypoint.sh) runs uvicorn workers and routes
+# downloads, upload parts and share links to the async views
+ASYNC_VIEWS = os.environ.get('SERVER_MODE', 'wsgi') == 'asgi'
+
+# Per-process cache of authenticated users used by jwt_token_required
+AUTH_CACHE_TTL = 30
+AUTH_CACHE_MAX_ENTRIES = 1024
+
 # Cookie settings
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
@@ -1,32 +1,232 @@
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
-import ast
+import asyncio
+import base64
+import json
 import math
+import time
+
+from .metrics import DECRYPT_BYTES, DECRYPT_SECONDS
+
+# Size of the ciphertext blocks fed to the decryptor when streaming.
+DECRYPT_CHUNK_SIZE = 64 * 1024
+
+# AES-256-GCM parameter sizes, in bytes
+IV_SIZE = 12
+KEY_SIZE = 32
+TAG_SIZE = 16
 
 
 def import_key(exported_key):
+    """Return the raw bytes of a stored IV, key or auth tag"""
     try:
-        byte_list = ast.literal_eval(exported_key)
-        byte_array = bytes(byte_list)
-        return byte_array
+        return bytes(exported_key)
     except Exception as error:
         print("Key import error:", error)
         raise
 
 
+def parse_key_material(value, length=None):
+    """
+    Convert an IV, key or auth tag sent by a client into raw bytes.
+
+    Accepts base64 as well as the JSON byte list ("[12, 255, ...]") older
+    clients send. Returns None for a missing value. Raises ValueError if
+    ``length`` is given and the value is not exactly that many bytes.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.startswith('['):
+        raw = bytes(json.loads(value))
+    else:
+        raw = base64.b64decode(value, validate=True)
+    if length is not None and len(raw) != length:
+        raise ValueError(f"Expected {length} bytes, got {len(raw)}")
+    return raw
+
+
+def encode_key_material(value):
+    """Base64-encode stored key material for response headers"""
+    if value is None:
+        return ''
+    return base64.b64encode(bytes(value)).decode('ascii')
+
+
 def decrypt_file(encrypted_buffer, iv, key, tag):
+    started = time.perf_counter()
     try:
         cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag=tag),
                         backend=default_backend())
         decryptor = cipher.decryptor()
         decrypted_content = decryptor.update(
             encrypted_buffer) + decryptor.finalize()
+        DECRYPT_SECONDS.observe(time.perf_counter() - started)
+        DECRYPT_BYTES.inc(len(encrypted_buffer))
         return decrypted_content
     except Exception as error:
         print("Decryption error:", error)
         raise
 
 
+def decrypt_file_stream(encrypted_file, iv, key, tag, chunk_size=DECRYPT_CHUNK_SIZE):
+    """
+    Decrypt an open file object block by block, yielding plaintext chunks.
+
+    The GCM tag can only be checked once the last block has been read, so
+    the last chunk is held back until ``finalize()`` has verified it: a
+    tampered file raises before the end of the body is sent and the client
+    sees a truncated response rather than a complete-looking one. The file
+    object is closed when the generator ends.
+    """
+    try:
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag=tag),
+                        backend=default_backend())
+        decryptor = cipher.decryptor()
+        pending = b''
+        while True:
+            chunk = encrypted_file.read(chunk_size)
+            if not chunk:
+                break
+            if pending:
+                yield pending
+            pending = decryptor.update(chunk)
+        decryptor.finalize()
+        if pending:
+            yield pending
+    except Exception as error:
+        print("Decryption error:", error)
+        raise
+    finally:
+        encrypted_file.close()
+
+
+def parse_range_header(header, size):
+    """
+    Parse an HTTP ``Range`` header against a resource of ``size`` bytes.
+
+    Returns None when the header is absent or not a byte range (the caller
+    should then send the whole file), an empty list when no requested range
+    is satisfiable, and otherwise a list of inclusive ``(start, end)`` pairs.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if start == '':
+                # Suffix range: the last N bytes
+                length = int(end)
+                if length <= 0:
+                    continue
+                start, end = max(size - length, 0), size - 1
+            else:
+                start = int(start)
+                end = int(end) if end else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and start > end):
+            return None
+        if start >= size:
+            continue
+        if end is None:
+            end = size - 1
+        ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+def merge_ranges(ranges):
+    """
+    Sort ``(start, end)`` ranges and coalesce any that overlap or touch, so
+    no byte is sent twice.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def read_file_range(f, start, end, chunk_size=DECRYPT_CHUNK_SIZE):
+    """Yield the bytes of open file ``f`` between ``start`` and ``end`` inclusive"""
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = f.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def aread_file_range(f, start, end, chunk_size=DECRYPT_CHUNK_SIZE):
+    """
+    Async counterpart of read_file_range for ASGI responses.
+
+    Disk reads run in a worker thread so a slow client never blocks the
+    event loop.
+    """
+    await asyncio.to_thread(f.seek, start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+async def adecrypt_file_stream(encrypted_file, iv, key, tag, chunk_size=DECRYPT_CHUNK_SIZE):
+    """
+    Async counterpart of decrypt_file_stream; reads run in a worker thread.
+
+    The last chunk is likewise held back until the tag has been verified.
+    """
+    try:
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag=tag),
+                        backend=default_backend())
+        decryptor = cipher.decryptor()
+        pending = b''
+        while True:
+            chunk = await asyncio.to_thread(encrypted_file.read, chunk_size)
+            if not chunk:
+                break
+            if pending:
+                yield pending
+            pending = decryptor.update(chunk)
+        decryptor.finalize()
+        if pending:
+            yield pending
+    except Exception as error:
+        print("Decryption error:", error)
+        raise
+    finally:
+        await asyncio.to_thread(encrypted_file.close)
+
+
+async def aiterate(iterator):
+    """
+    Drive a blocking iterator from a worker thread, one item at a time.
+
+    Lets a sync streaming body be served under ASGI without Django reading
+    the whole of it into memory first.
+    """
+    done = object()
+    try:
+        while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await asyncio.to_thread(close)
+
+
 def format_bytes(bytes):
     if bytes == 0:
         return "0 Bytes"
@@ -0,0 +1,99 @@
+"""
+ZIP archives of several encrypted files, built while they are sent.
+
+The archive holds each file's ciphertext exactly as stored plus a
+``manifest.json`` with the IV, key and tag needed to decrypt it, so the
+client decrypts entries the same way as single downloads. Entries are
+written with data descriptors into a small buffer that is drained after
+every block, so memory use does not depend on the archive size. ZIP64
+records are added where an entry, the archive or the entry count needs
+them.
+"""
+import json
+import os
+import zipfile
+
+from .storage import encrypted_storage
+from .Util import encode_key_material
+
+ARCHIVE_CHUNK_SIZE = 256 * 1024
+MANIFEST_NAME = 'manifest.json'
+
+
+class ZipStreamBuffer:
+    """Write-only, unseekable file object that hands back what was written"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Yield everything written since the last drain, if anything"""
+        if self.chunks:
+            data = b''.join(self.chunks)
+            self.chunks = []
+            yield data
+
+
+def entry_name(db_file):
+    """Archive path for a file's ciphertext, unique and free of directories"""
+    name = os.path.basename(db_file.original_filename.replace('\\', '/'))
+    return f"files/{db_file.id}-{name or 'file'}.enc"
+
+
+def build_manifest(db_files):
+    return {
+        'version': 1,
+        'cipher': 'AES-256-GCM',
+        'files': [
+            {
+                'path': entry_name(db_file),
+                'file_id': db_file.id,
+                'filename': db_file.original_filename,
+                'file_type': db_file.file_type,
+                'file_size': db_file.file_size,
+                'format_version': db_file.format_version,
+                'uploaded_at': db_file.uploaded_at.isoformat(),
+                'iv': encode_key_material(db_file.encryption_iv),
+                'key': encode_key_material(db_file.encryption_key),
+                'authTag': encode_key_material(db_file.authTag),
+            }
+            for db_file in db_files
+        ],
+    }
+
+
+def archive_stream(db_files):
+    """Yield a ZIP of the manifest and every file's blob, block by block"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        archive.writestr(MANIFEST_NAME, json.dumps(build_manifest(db_files), indent=2))
+        yield from buffer.drain()
+
+        for db_file in db_files:
+            with encrypted_storage.open_blob(db_file.stored_filename) as source:
+                info = zipfile.ZipInfo(
+                    entry_name(db_file),
+                    date_time=max(db_file.uploaded_at.timetuple()[:6],
+                                  (1980, 1, 1, 0, 0, 0)))
+                # Known up front, so zipfile adds ZIP64 fields when needed
+                info.file_size = os.fstat(source.fileno()).st_size
+                with archive.open(info, 'w') as entry:
+                    while chunk := source.read(ARCHIVE_CHUNK_SIZE):
+                        entry.write(chunk)
+                        yield from buffer.drain()
+            yield from buffer.drain()
+
+    # Central directory, written when the archive closes
+    yield from buffer.drain()
@@ -0,0 +1,232 @@
+"""
+Async versions of the views that move file bytes.
+
+Used instead of their sync counterparts when the app runs under ASGI
+(SERVER_MODE=asgi, see filemanagerapp/urls.py). Database access goes
+through the async ORM or sync_to_async and disk I/O through worker threads,
+so a slow client only costs a suspended coroutine instead of a whole worker.
+"""
+import os
+import uuid
+import base64
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+
+from .decorators import jwt_token_required
+from .models import EncryptedFile
+from .storage import encrypted_storage
+from .segmented import FORMAT_SEGMENTED, SegmentedReader
+from .Util import (
+    aiterate, aread_file_range, adecrypt_file_stream, decrypt_file, format_bytes,
+    import_key
+)
+from .views import (
+    accel_redirect_response, check_upload_part,
+    find_share_link, get_upload_session, not_modified_response, requested_ranges,
+    segmented_plaintext_response, set_encryption_headers, set_validators,
+    store_upload_part
+)
+
+
+async def afile_range_stream(f, start, end):
+    """Yield one byte range of an open file, closing it afterwards"""
+    try:
+        async for chunk in aread_file_range(f, start, end):
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def amultipart_range_stream(f, ranges, size, content_type, boundary):
+    """Yield a multipart/byteranges body for several ranges of one file"""
+    try:
+        for start, end in ranges:
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            async for chunk in aread_file_range(f, start, end):
+                yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode()
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def read_and_close(f):
+    with f:
+        return f.read()
+
+
+def read_segmented_and_close(f, key, iv):
+    with f:
+        return b''.join(SegmentedReader(f, key, iv))
+
+
+@csrf_exempt
+@jwt_token_required
+async def download_file_async(request, file_id):
+    """Async download_file, with the same Range and X-Accel-Redirect handling"""
+    try:
+        db_file = await EncryptedFile.objects.aget(id=file_id)
+
+        not_modified = not_modified_response(request, db_file)
+        if not_modified is not None:
+            return not_modified
+
+        if settings.DOWNLOAD_ACCEL_REDIRECT:
+            return await asyncio.to_thread(accel_redirect_response, db_file)
+
+        try:
+            file = await asyncio.to_thread(
+                encrypted_storage.open_blob, db_file.stored_filename)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'File not found on server'}, status=404)
+
+        size = os.fstat(file.fileno()).st_size
+        content_type = db_file.file_type or 'application/octet-stream'
+        ranges = requested_ranges(request, size, db_file)
+
+        if ranges is None:
+            response = StreamingHttpResponse(
+                afile_range_stream(file, 0, size - 1),
+                content_type=content_type
+            )
+            response['Content-Length'] = size
+            response['Content-Disposition'] = content_disposition_header(
+                True, db_file.original_filename)
+        elif not ranges:
+            await asyncio.to_thread(file.close)
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(
+                afile_range_stream(file, start, end),
+                status=206,
+                content_type=content_type
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            response = StreamingHttpResponse(
+                amultipart_range_stream(
+                    file, ranges, size, content_type, boundary),
+                status=206,
+                content_type=f"multipart/byteranges; boundary={boundary}"
+            )
+
+        set_validators(response, db_file)
+        return set_encryption_headers(response, db_file)
+
+    except EncryptedFile.DoesNotExist:
+        return JsonResponse({'error': 'File record not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_token_required
+async def upload_part_async(request, upload_id, part_number):
+    """
+    Async upload_part; the part is copied to disk from a worker thread.
+
+    Django's ASGI handler receives the whole request body (spooled to a
+    temporary file) before any view runs, so unlike the WSGI view this
+    does not stream, and an oversized body is only refused after it has
+    arrived.
+    """
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    session = await sync_to_async(get_upload_session)(request, upload_id)
+    error = check_upload_part(request, session, part_number)
+    if error is not None:
+        return error
+
+    try:
+        size = await asyncio.to_thread(
+            store_upload_part, request, upload_id, part_number)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+    await sync_to_async(session.touch)()
+
+    return JsonResponse({
+        'upload_id': upload_id,
+        'part_number': part_number,
+        'size': size
+    }, status=200)
+
+
+@csrf_exempt
+async def access_async(request, share_token):
+    """Async access: streams the decrypted shared file"""
+    try:
+        share_link = await sync_to_async(find_share_link)(share_token)
+        if share_link is None:
+            return JsonResponse({'error': 'Invalid or expired share link'}, status=404)
+
+        file = share_link.file
+        iv = import_key(file.encryption_iv)
+        key = import_key(file.encryption_key)
+        # Segmented files carry a tag per segment instead
+        tag = (None if file.format_version == FORMAT_SEGMENTED
+               else import_key(file.authTag))
+
+        try:
+            encrypted_file = await asyncio.to_thread(
+                encrypted_storage.open_blob, file.stored_filename)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'File not found on server'}, status=404)
+
+        if request.GET.get('format') == 'json':
+            if file.file_size > settings.SHARE_JSON_MAX_BYTES:
+                await asyncio.to_thread(encrypted_file.close)
+                return JsonResponse({
+                    'error': 'File too large for JSON response, download it instead'
+                }, status=413)
+
+            if file.format_version == FORMAT_SEGMENTED:
+                decrypted_data = await asyncio.to_thread(
+                    read_segmented_and_close, encrypted_file, key, iv)
+            else:
+                encrypted_data = await asyncio.to_thread(read_and_close, encrypted_file)
+                decrypted_data = decrypt_file(encrypted_data, iv, key, tag)
+
+            return JsonResponse({
+                'filename': file.original_filename,
+                'file_type': file.file_type,
+                'file_size': format_bytes(file.file_size),
+                'file_content': base64.b64encode(decrypted_data).decode('utf-8')
+            })
+
+        if file.format_version == FORMAT_SEGMENTED:
+            # Reads the container header, so off the event loop
+            return await asyncio.to_thread(
+                segmented_plaintext_response, request, file, encrypted_file,
+                key, iv, aiterate)
+
+        # GCM plaintext is the same length as the ciphertext on disk
+        size = os.fstat(encrypted_file.fileno()).st_size
+        response = StreamingHttpResponse(
+            adecrypt_file_stream(encrypted_file, iv, key, tag),
+            content_type=file.file_type or 'application/octet-stream'
+        )
+        response['Content-Length'] = size
+        response['Content-Disposition'] = content_disposition_header(
+            True, file.original_filename)
+
+        return response
+
+    except EncryptedFile.DoesNotExist:
+        return JsonResponse({'error': 'File record not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
@@ -1,26 +1,137 @@
 from functools import wraps
+from asgiref.sync import sync_to_async
+import asyncio
+from collections import OrderedDict
+import threading
+import time
 from django.http import JsonResponse
 import jwt
 from django.conf import settings
 from .models import User
 
 
+class AuthCache:
+    """
+    Bounded, per-process LRU cache of JWT -> authenticated User.
+
+    Entries live for ``ttl`` seconds or until the token itself expires,
+    whichever comes first. Each worker process has its own cache, so a
+    change made through another worker is picked up here at most ``ttl``
+    seconds later; changes made in this process are evicted immediately
+    through the User model signals.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self.entries[token]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, token, user, token_exp):
+        now = time.monotonic()
+        expires = now + min(self.ttl, max(token_exp - time.time(), 0))
+        with self.lock:
+            self.entries[token] = (user, expires)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            stale = [token for token, (user, _) in self.entries.items()
+                     if user.id == user_id]
+            for token in stale:
+                del self.entries[token]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+auth_cache = AuthCache(
+    max_entries=getattr(settings, 'AUTH_CACHE_MAX_ENTRIES', 1024),
+    ttl=getattr(settings, 'AUTH_CACHE_TTL', 30),
+)
+
+
+def load_token_user(token):
+    """
+    Decode a JWT and load its User, caching the result.
+
+    Returns (user, None) on success or (None, error response).
+    """
+    try:
+        payload = jwt.decode(
+            token, settings.SECRET_KEY, algorithms=['HS256'])
+        user = User.objects.get(id=payload['user_id'])
+    except jwt.ExpiredSignatureError:
+        return None, JsonResponse({'error': 'Token has expired'}, status=401)
+    except (jwt.DecodeError, User.DoesNotExist):
+        return None, JsonResponse({'error': 'Invalid token'}, status=401)
+    auth_cache.set(token, user, payload['exp'])
+    return user, None
+
+
 def jwt_token_required(view_func):
+    """Authenticate the request from its jwt_token cookie; works on sync and async views"""
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapped_view(request, *args, **kwargs):
+            token = request.COOKIES.get('jwt_token')
+            if not token:
+                return JsonResponse({'error': 'No token provided'}, status=401)
+
+            user = auth_cache.get(token)
+            if user is None:
+                user, error = await sync_to_async(load_token_user)(token)
+                if error is not None:
+                    return error
+            request.user = user
+
+            return await view_func(request, *args, **kwargs)
+
+        return async_wrapped_view
+
     @wraps(view_func)
     def wrapped_view(request, *args, **kwargs):
         token = request.COOKIES.get('jwt_token')
         if not token:
             return JsonResponse({'error': 'No token provided'}, status=401)
 
-        try:
-            payload = jwt.decode(
-                token, settings.SECRET_KEY, algorithms=['HS256'])
-            user = User.objects.get(id=payload['user_id'])
-            request.user = user
-        except jwt.ExpiredSignatureError:
-            return JsonResponse({'error': 'Token has expired'}, status=401)
-        except (jwt.DecodeError, User.DoesNotExist):
-            return JsonResponse({'error': 'Invalid token'}, status=401)
+        user = auth_cache.get(token)
+        if user is None:
+            user, error = load_token_user(token)
+            if error is not None:
+                return error
+        request.user = user
 
         return view_func(request, *args, **kwargs)
 
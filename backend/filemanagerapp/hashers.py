@@ -0,0 +1,19 @@
+"""
+Password hashers whose cost comes from settings.
+
+They keep Django's algorithm names, so existing hashes still verify. A hash
+made at a different cost is rewritten with the current one the next time its
+user logs in (see User.check_password).
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    BCryptSHA256PasswordHasher, PBKDF2PasswordHasher
+)
+
+
+class TunedBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    rounds = settings.PASSWORD_BCRYPT_ROUNDS
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    iterations = settings.PASSWORD_PBKDF2_ITERATIONS
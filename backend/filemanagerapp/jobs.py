@@ -0,0 +1,169 @@
+"""
+A small background job queue stored in the application database.
+
+Work is registered with ``@task`` and queued with ``enqueue()`` (or the
+task's ``.delay()``). ``manage.py runworker`` claims due jobs and runs them
+in a process pool. A claimed job is invisible to other workers until its
+visibility timeout passes, so a job whose worker died is retried. Failed
+jobs are retried with exponential backoff up to ``max_attempts``.
+
+No broker is needed: claiming is a conditional UPDATE on the jobs table.
+"""
+import traceback
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+
+
+def task(name=None, max_attempts=3):
+    """Register a function as a job; adds ``.delay(**payload)`` to it"""
+    def register(func):
+        task_name = name or func.__name__
+        TASKS[task_name] = func
+
+        def delay(delay_seconds=0, **payload):
+            return enqueue(task_name, payload, delay_seconds=delay_seconds,
+                           max_attempts=max_attempts)
+
+        func.delay = delay
+        func.task_name = task_name
+        return func
+
+    return register
+
+
+def enqueue(name, payload=None, delay_seconds=0, max_attempts=3):
+    """
+    Queue a job and return it.
+
+    With JOBS_RUN_INLINE the job runs in this process instead, which is
+    handy for development and tests where no worker is running. It still
+    waits for the surrounding transaction to commit, as a worker would
+    have to, so a rolled-back caller never has its job run.
+    """
+    if name not in TASKS:
+        raise ValueError(f"Unknown task: {name}")
+
+    job = Job.objects.create(
+        name=name,
+        payload=payload or {},
+        max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay_seconds)
+    )
+    if settings.JOBS_RUN_INLINE:
+        transaction.on_commit(lambda: run_inline(job.id))
+    return job
+
+
+def run_inline(job_id):
+    Job.objects.filter(id=job_id).update(
+        status='running', attempts=1, started_at=timezone.now())
+    run_job(job_id)
+
+
+def fail_expired_jobs():
+    """Give up on running jobs that timed out on their last attempt"""
+    return Job.objects.filter(
+        status='running',
+        locked_until__lte=timezone.now(),
+        attempts__gte=F('max_attempts')
+    ).update(status='failed', finished_at=timezone.now(),
+             last_error='Visibility timeout exceeded')
+
+
+def claim_jobs(limit, visibility_timeout):
+    """
+    Claim up to ``limit`` due jobs for this worker and return their ids.
+
+    A job is due when it is queued and its run_after has passed, or when
+    it is running but its lock expired. The conditional update means two
+    workers can never claim the same job.
+    """
+    now = timezone.now()
+    due = Q(status='queued', run_after__lte=now) | Q(
+        status='running', locked_until__lte=now,
+        attempts__lt=F('max_attempts'))
+    candidates = list(
+        Job.objects.filter(due).order_by('run_after', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+    claimed = []
+    for job_id in candidates:
+        won = Job.objects.filter(due, id=job_id).update(
+            status='running',
+            attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=visibility_timeout),
+            started_at=now
+        )
+        if won:
+            claimed.append(job_id)
+    return claimed
+
+
+def run_job(job_id):
+    """Execute one claimed job and record the outcome. Runs in pool workers."""
+    close_old_connections()
+    job = Job.objects.get(id=job_id)
+    func = TASKS.get(job.name)
+    try:
+        if func is None:
+            raise ValueError(f"Unknown task: {job.name}")
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(id=job_id).update(
+                status='failed', finished_at=timezone.now(), last_error=error)
+        else:
+            backoff = min(2 ** job.attempts * settings.JOBS_RETRY_BASE_DELAY, 3600)
+            Job.objects.filter(id=job_id).update(
+                status='queued', locked_until=None, last_error=error,
+                run_after=timezone.now() + timedelta(seconds=backoff))
+        return False
+
+    Job.objects.filter(id=job_id).update(
+        status='done', finished_at=timezone.now(), locked_until=None)
+    return True
+
+
+def prune_finished_jobs(older_than_seconds):
+    """Delete done jobs older than the retention window"""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    deleted, _ = Job.objects.filter(status='done', finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def queue_stats(sample_size=100):
+    """Queue depth per status plus wait and run latency of recent jobs"""
+    depth = {row['status']: row['count'] for row in
+             Job.objects.values('status').annotate(count=Count('id'))}
+
+    oldest = Job.objects.filter(status='queued').order_by(
+        'created_at').values_list('created_at', flat=True).first()
+
+    recent = list(
+        Job.objects.filter(status='done').order_by('-finished_at')
+        .values_list('created_at', 'started_at', 'finished_at')[:sample_size]
+    )
+    waits = [(started - created).total_seconds()
+             for created, started, _ in recent if started]
+    runs = [(finished - started).total_seconds()
+            for _, started, finished in recent if started and finished]
+
+    return {
+        'depth': {status: depth.get(status, 0)
+                  for status in ('queued', 'running', 'done', 'failed')},
+        'oldest_queued_age': (
+            (timezone.now() - oldest).total_seconds() if oldest else None),
+        'recent_jobs': len(recent),
+        'avg_wait_seconds': sum(waits) / len(waits) if waits else None,
+        'max_wait_seconds': max(waits) if waits else None,
+        'avg_run_seconds': sum(runs) / len(runs) if runs else None,
+    }
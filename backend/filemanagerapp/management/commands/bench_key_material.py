@@ -0,0 +1,57 @@
+import ast
+import base64
+import json
+import os
+import timeit
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.Util import import_key, encode_key_material
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the per-request cost of decoding IV/key/tag stored as a '
+        'text byte list (the old format) against raw binary columns'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        iv, key, tag = os.urandom(12), os.urandom(32), os.urandom(16)
+        legacy = [str(list(value)) for value in (iv, key, tag)]
+        binary = [iv, key, tag]
+
+        def legacy_share_access():
+            # access(): ast.literal_eval on every field
+            return [bytes(ast.literal_eval(value)) for value in legacy]
+
+        def binary_share_access():
+            return [import_key(value) for value in binary]
+
+        def legacy_download():
+            # download_file() sends the text as-is; the client JSON-parses it
+            return [bytes(json.loads(value)) for value in legacy]
+
+        def binary_download():
+            headers = [encode_key_material(value) for value in binary]
+            return [base64.b64decode(value) for value in headers]
+
+        cases = [
+            ('share access, text byte list', legacy_share_access),
+            ('share access, binary', binary_share_access),
+            ('download headers, text byte list', legacy_download),
+            ('download headers, base64 of binary', binary_download),
+        ]
+        for label, func in cases:
+            seconds = min(timeit.repeat(func, number=iterations, repeat=3))
+            self.stdout.write(
+                f'{label:<38} {seconds / iterations * 1e6:8.2f} us/request')
+
+        self.stdout.write(
+            f'{"stored bytes per row, text byte list":<38} '
+            f'{sum(len(value) for value in legacy):8d}')
+        self.stdout.write(
+            f'{"stored bytes per row, binary":<38} '
+            f'{sum(len(value) for value in binary):8d}')
@@ -0,0 +1,59 @@
+import time
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Time password verification for each configured hasher and report '
+        'logins per second per core. --bcrypt-rounds and --pbkdf2-iterations '
+        'add rows for other costs to compare against.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=2.0,
+                            help='Minimum time spent measuring each hasher')
+        parser.add_argument('--bcrypt-rounds', type=int, nargs='*', default=[])
+        parser.add_argument('--pbkdf2-iterations', type=int, nargs='*', default=[])
+
+    def handle(self, *args, **options):
+        candidates = []
+        for hasher in get_hashers():
+            candidates.append((hasher, 'configured'))
+            if hasattr(hasher, 'rounds'):
+                for rounds in options['bcrypt_rounds']:
+                    candidates.append(
+                        (self.with_cost(hasher, rounds=rounds), 'candidate'))
+            if hasattr(hasher, 'iterations'):
+                for iterations in options['pbkdf2_iterations']:
+                    candidates.append(
+                        (self.with_cost(hasher, iterations=iterations), 'candidate'))
+
+        self.stdout.write(
+            f'{"hasher":<16} {"cost":>10} {"ms/login":>10} {"logins/s/core":>14}')
+        for hasher, kind in candidates:
+            try:
+                encoded = hasher.encode('correct horse battery staple', hasher.salt())
+            except (ImportError, ValueError) as e:
+                self.stdout.write(f'{hasher.algorithm:<16} skipped: {e}')
+                continue
+            seconds = self.time_verify(hasher, encoded, options['seconds'])
+            cost = getattr(hasher, 'rounds', None) or getattr(hasher, 'iterations', '-')
+            marker = '' if kind == 'configured' else '  (candidate)'
+            self.stdout.write(
+                f'{hasher.algorithm:<16} {cost:>10} {seconds * 1000:10.1f} '
+                f'{1 / seconds:14.1f}{marker}')
+
+    def with_cost(self, hasher, **cost):
+        return type(type(hasher).__name__, (type(hasher),), cost)()
+
+    def time_verify(self, hasher, encoded, budget):
+        """CPU seconds per verify; a single thread keeps it to one core"""
+        count = 0
+        started = time.process_time()
+        while True:
+            hasher.verify('correct horse battery staple', encoded)
+            count += 1
+            elapsed = time.process_time() - started
+            if elapsed >= budget and count >= 3:
+                return elapsed / count
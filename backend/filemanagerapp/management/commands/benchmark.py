@@ -0,0 +1,440 @@
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import time
+import uuid
+from datetime import timedelta
+import django
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from filemanagerapp.models import EncryptedFile, ShareableLink, User, UserPermissions
+from filemanagerapp.segmented import SegmentedReader, encrypt_segmented
+from filemanagerapp.storage import encrypted_storage
+from filemanagerapp.Util import decrypt_file, encode_key_material, format_bytes, import_key
+from filemanagerapp.views import generate_jwt_token
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+BENCH_PASSWORD = 'benchmark-password'
+BENCH_PREFIX = 'bench-'
+BULK_BATCH_SIZE = 5000
+WRITE_CHUNK_SIZE = 1024 * 1024
+# Util.decrypt_file needs the whole ciphertext in memory
+MAX_DECRYPT_FILE_SIZE = 256 * 1024 * 1024
+# Calls per sample for the sub-microsecond utility functions
+MICRO_CALLS = 1000
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    if value[-1:] in SIZE_UNITS:
+        return int(value[:-1]) * SIZE_UNITS[value[-1]]
+    return int(value)
+
+
+def size_label(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API endpoints through the Django test client, and the '
+        'crypto utilities on their own, against generated fixtures in a '
+        'separate database. Results can be saved as JSON and compared with '
+        'an earlier run to spot regressions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--files', type=int, default=200000,
+                            help='EncryptedFile rows to generate')
+        parser.add_argument('--permissions', type=int, default=200000,
+                            help='UserPermissions rows to generate')
+        parser.add_argument('--blob-sizes', default='1K,1M,64M',
+                            help='Comma separated blob sizes, e.g. 1K,1M,1G')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Samples per case; fewer for large blobs')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the benchmark database and its rows '
+                                 'between runs')
+        parser.add_argument('--output', help='Write the results as JSON here')
+        parser.add_argument('--compare',
+                            help='JSON results of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Median slowdown reported as a regression '
+                                 '(0.10 = 10%%)')
+
+    def handle(self, *args, **options):
+        try:
+            blob_sizes = [parse_size(value)
+                          for value in options['blob_sizes'].split(',') if value]
+        except ValueError:
+            raise CommandError('Invalid --blob-sizes')
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        setup_test_environment(debug=False)
+        if connection.vendor == 'sqlite':
+            # Benchmark against a file, like production, not :memory:
+            connection.settings_dict['TEST']['NAME'] = str(
+                settings.BASE_DIR / 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            started = time.monotonic()
+            fixtures = self.create_fixtures(options, blob_sizes)
+            self.stdout.write(
+                f"Fixtures ready in {time.monotonic() - started:.1f}s: "
+                f"{fixtures['counts']}")
+            self.results = {}
+            self.bench_endpoints(fixtures, options)
+            self.bench_utilities(fixtures, options)
+        finally:
+            self.remove_blobs()
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'async_views': settings.ASYNC_VIEWS,
+                'fixtures': fixtures['counts'],
+                'blob_sizes': [size_label(size) for size in blob_sizes],
+            },
+            'results': self.results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            self.compare(baseline, report, options['threshold'])
+
+    # Fixtures
+
+    def create_fixtures(self, options, blob_sizes):
+        password = make_password(BENCH_PASSWORD)
+        existing = User.objects.count()
+        self.bulk_create(User, (
+            User(name=f"{BENCH_PREFIX}{i}", email=f"{BENCH_PREFIX}{i}@example.com",
+                 role='admin' if i == 0 else 'user', password=password)
+            for i in range(existing, options['users'])
+        ))
+        user_ids = list(User.objects.values_list('id', flat=True))
+        owner = User.objects.order_by('id').first()
+
+        existing = EncryptedFile.objects.count()
+        self.bulk_create(EncryptedFile, (
+            EncryptedFile(
+                original_filename=f"document-{i}.pdf",
+                stored_filename=str(uuid.uuid4()),
+                file_size=random.randint(1024, 50 * 1024 * 1024),
+                encryption_iv=os.urandom(12),
+                encryption_key=os.urandom(32),
+                authTag=os.urandom(16),
+                file_type=random.choice(
+                    ['application/pdf', 'image/png', 'text/plain']),
+                # The benchmark user gets enough files to page through
+                user_id=owner.id if i % 100 == 0 else random.choice(user_ids))
+            for i in range(existing, options['files'])
+        ))
+        first_file = EncryptedFile.objects.order_by('id').values_list(
+            'id', flat=True).first()
+        last_file = EncryptedFile.objects.order_by('-id').values_list(
+            'id', flat=True).first()
+
+        existing = UserPermissions.objects.count()
+        self.bulk_create(UserPermissions, (
+            UserPermissions(
+                file_id=random.randint(first_file, last_file),
+                file_assigned_id=random.choice(user_ids),
+                permission_Type=random.choice(['view', 'edit']))
+            for _ in range(existing, options['permissions'])
+        ))
+
+        blobs = {}
+        for size in blob_sizes:
+            blob = self.create_blob(owner, size)
+            link = ShareableLink.objects.create(
+                file=blob, share_token=secrets.token_hex(16),
+                expires_at=timezone.now() + timedelta(hours=1))
+            blobs[size] = (blob, link.share_token)
+
+        return {
+            'owner': owner,
+            'user_ids': user_ids,
+            'blobs': blobs,
+            'counts': {
+                'users': len(user_ids),
+                'files': EncryptedFile.objects.count(),
+                'permissions': UserPermissions.objects.count(),
+            },
+        }
+
+    def bulk_create(self, model, objects):
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) == BULK_BATCH_SIZE:
+                model.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+
+    def create_blob(self, owner, size):
+        """Write an encrypted blob of ``size`` bytes and its EncryptedFile row"""
+        key, iv = os.urandom(32), os.urandom(12)
+        encryptor = Cipher(algorithms.AES(key), modes.GCM(iv)).encryptor()
+        name = encrypted_storage.generate_name()
+        plaintext = os.urandom(min(size, WRITE_CHUNK_SIZE))
+        with open(encrypted_storage.prepare_path(name), 'wb') as destination:
+            remaining = size
+            while remaining:
+                piece = plaintext[:remaining]
+                destination.write(encryptor.update(piece))
+                remaining -= len(piece)
+            encryptor.finalize()
+        return EncryptedFile.objects.create(
+            original_filename=f"{BENCH_PREFIX}{size_label(size)}.bin",
+            stored_filename=name,
+            file_size=size,
+            encryption_iv=iv,
+            encryption_key=key,
+            authTag=encryptor.tag,
+            file_type='application/octet-stream',
+            user_id=owner.id
+        )
+
+    def remove_blobs(self):
+        """Delete the blobs written by fixtures and upload cases"""
+        created = EncryptedFile.objects.filter(
+            original_filename__startswith=BENCH_PREFIX)
+        for name in created.values_list('stored_filename', flat=True):
+            encrypted_storage.delete(name)
+        created.delete()
+
+    # Measurement
+
+    def measure(self, name, func, iterations, nbytes=None, calls=1):
+        """Time ``func`` and record per-call statistics under ``name``"""
+        func()  # warm up
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - started) / calls)
+        samples.sort()
+        median = statistics.median(samples)
+        result = {
+            'iterations': iterations,
+            'min_ms': samples[0] * 1000,
+            'median_ms': median * 1000,
+            'mean_ms': statistics.fmean(samples) * 1000,
+            'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            'max_ms': samples[-1] * 1000,
+        }
+        if nbytes:
+            result['bytes'] = nbytes
+            result['mb_per_s'] = nbytes / median / 1024 ** 2 if median else None
+        self.results[name] = result
+
+        throughput = (f"{result['mb_per_s']:10.1f} MB/s"
+                      if result.get('mb_per_s') else '')
+        self.stdout.write(
+            f"{name:<44} {result['median_ms']:12.3f} ms "
+            f"{result['p95_ms']:12.3f} ms p95 {throughput}")
+
+    def iterations_for(self, options, size):
+        """Fewer samples for big transfers, at least three"""
+        return max(3, min(options['iterations'],
+                          options['iterations'] * 16 * 1024 ** 2 // max(size, 1)))
+
+    def request(self, client, method, path, expected=(200,), **kwargs):
+        response = getattr(client, method)(path, **kwargs)
+        if response.status_code not in expected:
+            raise CommandError(
+                f"{method.upper()} {path} returned {response.status_code}")
+        if response.streaming:
+            body = 0
+            for chunk in response.streaming_content:
+                body += len(chunk)
+            return response, body
+        return response, len(response.content)
+
+    def bench_endpoints(self, fixtures, options):
+        owner = fixtures['owner']
+        client = Client()
+        client.cookies['jwt_token'] = generate_jwt_token(owner)
+        iterations = options['iterations']
+
+        login = json.dumps({'email': owner.email, 'password': BENCH_PASSWORD})
+        self.measure('login_user', lambda: self.request(
+            client, 'post', '/api/login/', data=login,
+            content_type='application/json'), iterations)
+
+        files_path = f"/api/files/{owner.id}/"
+        self.measure('list_files first page', lambda: self.request(
+            client, 'get', files_path), iterations)
+        cursor = client.get(files_path).json().get('next_cursor')
+        if cursor:
+            self.measure('list_files second page', lambda: self.request(
+                client, 'get', files_path, data={'cursor': cursor}), iterations)
+        self.measure('list_files filename prefix', lambda: self.request(
+            client, 'get', files_path, data={'q': 'document-1'}), iterations)
+
+        # Every fixture name contains "document"; "-N." names exactly one
+        # of the benchmark user's files; "zzz" matches nothing
+        rare = f"-{options['files'] // 200 * 100}."
+        for label, query in (('common term', 'document'), ('rare term', rare),
+                             ('no match', 'zzz')):
+            self.measure(f"search_files {label}", lambda: self.request(
+                client, 'get', '/api/files/search/', data={'q': query}),
+                iterations)
+
+        self.measure('list_users first page', lambda: self.request(
+            client, 'get', '/api/users/'), iterations)
+        etag = client.get('/api/users/')['ETag']
+        self.measure('list_users revalidated', lambda: self.request(
+            client, 'get', '/api/users/', expected=(304,),
+            headers={'If-None-Match': etag}), iterations)
+        self.measure('list_users name prefix', lambda: self.request(
+            client, 'get', '/api/users/', data={'q': f"{BENCH_PREFIX}12"}),
+            iterations)
+        lookup_ids = ','.join(map(str, fixtures['user_ids'][::50][:50]))
+        self.measure('lookup_users 50 ids', lambda: self.request(
+            client, 'get', '/api/users/lookup/', data={'ids': lookup_ids}),
+            iterations)
+
+        shared_file = UserPermissions.objects.values_list(
+            'file_id', flat=True).first()
+        self.measure('list_permission', lambda: self.request(
+            client, 'get', f"/api/permissions/{shared_file}/"), iterations)
+
+        acl = json.dumps({
+            'fileId': shared_file,
+            'permissions': [{'userId': user_id, 'accessType': 'view'}
+                            for user_id in fixtures['user_ids'][:10]]
+        })
+        self.measure('upload_permissions 10 users', lambda: self.request(
+            client, 'post', '/api/uploadpermissions/', data=acl,
+            content_type='application/json'), iterations)
+
+        some_blob = next(iter(fixtures['blobs'].values()))[0]
+        share = json.dumps({'file_id': some_blob.id, 'expiration': 3600})
+        self.measure('generate_share_link', lambda: self.request(
+            client, 'post', '/api/generate/', data=share,
+            content_type='application/json'), iterations)
+
+        for size in (1024, 1024 ** 2):
+            ciphertext = os.urandom(size)
+            # upload_file checks each value's length, so send real-sized ones
+            material = {
+                'key': encode_key_material(os.urandom(32)),
+                'iv': encode_key_material(os.urandom(12)),
+                'authTag': encode_key_material(os.urandom(16)),
+            }
+
+            def upload():
+                return self.request(client, 'post', '/api/upload/', data={
+                    'user_id': owner.id,
+                    'file': SimpleUploadedFile(
+                        f"{BENCH_PREFIX}upload.bin", ciphertext),
+                    **material,
+                })
+
+            self.measure(f"upload_file {size_label(size)}", upload,
+                         self.iterations_for(options, size), nbytes=size)
+
+        for size, (blob, share_token) in fixtures['blobs'].items():
+            label = size_label(size)
+            count = self.iterations_for(options, size)
+            self.measure(f"download_file {label}", lambda: self.request(
+                client, 'get', f"/api/download/{blob.id}/"), count, nbytes=size)
+            self.measure(f"download_file {label} range 64K", lambda: self.request(
+                client, 'get', f"/api/download/{blob.id}/", expected=(206,),
+                HTTP_RANGE=f"bytes=0-{min(size, 65536) - 1}"), iterations)
+            self.measure(f"access {label}", lambda: self.request(
+                Client(), 'get', f"/api/access/{share_token}/"), count, nbytes=size)
+
+    def bench_utilities(self, fixtures, options):
+        iterations = options['iterations']
+
+        for size, (blob, _) in fixtures['blobs'].items():
+            if size > MAX_DECRYPT_FILE_SIZE:
+                continue
+            with encrypted_storage.open_blob(blob.stored_filename) as f:
+                ciphertext = f.read()
+            iv, key, tag = (import_key(blob.encryption_iv),
+                            import_key(blob.encryption_key),
+                            import_key(blob.authTag))
+            self.measure(f"Util.decrypt_file {size_label(size)}",
+                         lambda: decrypt_file(ciphertext, iv, key, tag),
+                         self.iterations_for(options, size), nbytes=size)
+
+            # Same size as a segmented container: read 64K from the middle
+            container = io.BytesIO(encrypt_segmented(os.urandom(size), key, iv))
+            start = size // 2
+            self.measure(
+                f"SegmentedReader {size_label(size)} range 64K",
+                lambda: SegmentedReader(container, key, iv).read_range(
+                    start, start + 65535), iterations)
+
+        stored = os.urandom(32)
+
+        def import_keys():
+            for _ in range(MICRO_CALLS):
+                import_key(stored)
+
+        def format_sizes():
+            for value in range(MICRO_CALLS):
+                format_bytes(value * 7919)
+
+        self.measure('Util.import_key', import_keys, iterations, calls=MICRO_CALLS)
+        self.measure('Util.format_bytes', format_sizes, iterations,
+                     calls=MICRO_CALLS)
+
+    # Comparison
+
+    def compare(self, baseline, report, threshold):
+        self.stdout.write('')
+        self.stdout.write(f"Compared with run from {baseline['meta']['timestamp']}:")
+        regressions = []
+        for name, result in report['results'].items():
+            before = baseline['results'].get(name)
+            if not before or not before['median_ms']:
+                continue
+            change = result['median_ms'] / before['median_ms'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append(name)
+            self.stdout.write(
+                f"{name:<44} {before['median_ms']:12.3f} -> "
+                f"{result['median_ms']:12.3f} ms {change:+8.1%}{flag}")
+
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} case(s) slower by more than "
+                f"{threshold:.0%}: {', '.join(regressions)}")
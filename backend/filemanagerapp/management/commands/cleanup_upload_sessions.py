@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.views import purge_expired_upload_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete expired resumable upload sessions and their staged parts'
+
+    def handle(self, *args, **options):
+        purged = purge_expired_upload_sessions()
+        self.stdout.write(f'Removed {purged} expired upload session(s)')
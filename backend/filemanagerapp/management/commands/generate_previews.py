@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.models import EncryptedFile
+from filemanagerapp.previews import generate_preview
+
+
+class Command(BaseCommand):
+    help = 'Create preview renditions for files uploaded before previews existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate previews that already exist')
+
+    def handle(self, *args, **options):
+        files = EncryptedFile.objects.order_by('id')
+        if not options['force']:
+            files = files.filter(preview_type__isnull=True)
+
+        created = 0
+        for db_file in files.iterator(chunk_size=200):
+            if generate_preview(db_file):
+                created += 1
+        self.stdout.write(f'Created {created} preview(s)')
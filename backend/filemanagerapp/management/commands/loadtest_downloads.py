@@ -0,0 +1,109 @@
+import asyncio
+import time
+from django.core.management.base import BaseCommand, CommandError
+
+from filemanagerapp.models import User
+from filemanagerapp.views import generate_jwt_token
+
+
+class Command(BaseCommand):
+    help = (
+        'Open many concurrent, deliberately slow downloads against a running '
+        'server and report how many it keeps streaming, plus the latency of '
+        'a normal request made while they are held open. Point it at a file '
+        'large enough that no client finishes within --duration.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_id', type=int)
+        parser.add_argument('--user-id', type=int, required=True,
+                            help='User whose JWT authenticates the requests')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--connections', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=30.0,
+                            help='Seconds each slow client stays connected')
+        parser.add_argument('--read-bytes', type=int, default=1024,
+                            help='Bytes read per tick by a slow client')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds between reads of a slow client')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(id=options['user_id'])
+        except User.DoesNotExist:
+            raise CommandError('User not found')
+        token = generate_jwt_token(user)
+        stats = asyncio.run(self.run(token, options))
+
+        self.stdout.write(f"Slow clients requested:  {options['connections']}")
+        self.stdout.write(f"Started streaming:       {stats['streaming']}")
+        self.stdout.write(f"Held for full duration:  {stats['held']}")
+        self.stdout.write(f"Finished early:          {stats['finished_early']}")
+        self.stdout.write(f"Failed or refused:       {stats['failed']}")
+        if stats['probe_latency'] is None:
+            self.stdout.write('Probe request:           failed')
+        else:
+            self.stdout.write(
+                f"Probe request latency:   {stats['probe_latency'] * 1000:.1f} ms")
+
+    def request_bytes(self, options, token, extra_headers=''):
+        return (
+            f"GET /api/download/{options['file_id']}/ HTTP/1.1\r\n"
+            f"Host: {options['host']}\r\n"
+            f"Cookie: jwt_token={token}\r\n"
+            f"{extra_headers}"
+            f"Connection: close\r\n\r\n"
+        ).encode()
+
+    async def slow_client(self, token, options, stats):
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(
+                options['host'], options['port'])
+            writer.write(self.request_bytes(options, token))
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout=30)
+            if b' 200 ' not in status_line:
+                stats['failed'] += 1
+                return
+            stats['streaming'] += 1
+
+            deadline = time.monotonic() + options['duration']
+            while time.monotonic() < deadline:
+                if not await reader.read(options['read_bytes']):
+                    stats['finished_early'] += 1
+                    return
+                await asyncio.sleep(options['interval'])
+            stats['held'] += 1
+        except (OSError, asyncio.TimeoutError):
+            stats['failed'] += 1
+        finally:
+            if writer is not None:
+                writer.close()
+
+    async def probe(self, token, options):
+        """Time a one-byte ranged download while the slow clients are connected"""
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.open_connection(
+                options['host'], options['port'])
+            writer.write(self.request_bytes(options, token, 'Range: bytes=0-0\r\n'))
+            await writer.drain()
+            await asyncio.wait_for(reader.read(), timeout=30)
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            return None
+        return time.monotonic() - started
+
+    async def run(self, token, options):
+        stats = {'streaming': 0, 'held': 0, 'finished_early': 0, 'failed': 0}
+        clients = [
+            asyncio.create_task(self.slow_client(token, options, stats))
+            for _ in range(options['connections'])
+        ]
+        # Give the slow clients time to connect before probing
+        await asyncio.sleep(min(5.0, options['duration'] / 2))
+        stats['probe_latency'] = await self.probe(token, options)
+        await asyncio.gather(*clients)
+        return stats
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.models import ShareableLink
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired share links in bounded batches. With --interval it '
+        'keeps running and reaps periodically.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Links deleted per statement')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--interval', type=float, default=0.0,
+                            help='Repeat every N seconds instead of exiting')
+
+    def reap(self, batch_size, pause):
+        total = 0
+        while True:
+            deleted = ShareableLink.delete_expired(batch_size=batch_size)
+            total += deleted
+            if deleted < batch_size:
+                return total
+            if pause:
+                time.sleep(pause)
+
+    def handle(self, *args, **options):
+        while True:
+            total = self.reap(options['batch_size'], options['sleep'])
+            self.stdout.write(f'Deleted {total} expired share link(s)')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
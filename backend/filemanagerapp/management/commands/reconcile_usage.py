@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from filemanagerapp.models import EncryptedFile, StorageUsage
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount every user\'s stored bytes and files from EncryptedFile and '
+        'correct StorageUsage counters that have drifted. Quotas are left '
+        'untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        user_ids = set(EncryptedFile.objects.exclude(user_id=None)
+                       .values_list('user_id', flat=True).distinct())
+        user_ids |= set(StorageUsage.objects.values_list('user_id', flat=True))
+
+        drifted = 0
+        for user_id in sorted(user_ids):
+            # Recount and fix under a row lock, so uploads and deletes
+            # running meanwhile are not lost
+            with transaction.atomic():
+                usage, _ = (StorageUsage.objects.select_for_update()
+                            .get_or_create(user_id=user_id))
+                actual = EncryptedFile.objects.filter(user_id=user_id).aggregate(
+                    bytes_used=Sum('file_size'), file_count=Count('id'))
+                bytes_used = actual['bytes_used'] or 0
+                file_count = actual['file_count']
+                if (usage.bytes_used, usage.file_count) == (bytes_used, file_count):
+                    continue
+
+                drifted += 1
+                self.stdout.write(
+                    f"User {user_id}: counted {usage.bytes_used} bytes in "
+                    f"{usage.file_count} files, actual {bytes_used} bytes in "
+                    f"{file_count} files")
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+                    continue
+                StorageUsage.objects.filter(id=usage.id).update(
+                    bytes_used=bytes_used, file_count=file_count)
+
+        summary = f"{drifted} of {len(user_ids)} users had drifted counters"
+        if options['dry_run']:
+            summary += ' (dry run, nothing changed)'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,79 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def init_worker():
+    # Pool processes are spawned fresh, so Django has to be set up again
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def execute_job(job_id):
+    from filemanagerapp.jobs import run_job
+    return run_job(job_id)
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=settings.JOBS_WORKER_PROCESSES)
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when there is nothing to do')
+        parser.add_argument('--visibility-timeout', type=int,
+                            default=settings.JOBS_VISIBILITY_TIMEOUT,
+                            help='Seconds a claimed job stays hidden from other workers')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        from filemanagerapp import jobs
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processes = options['processes']
+        poll_interval = options['poll_interval']
+        last_prune = 0.0
+        self.stdout.write(f'Worker started with {processes} process(es)')
+
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                 initializer=init_worker) as pool:
+            in_flight = set()
+            while not self.stopping:
+                jobs.fail_expired_jobs()
+
+                claimed = []
+                free = processes - len(in_flight)
+                if free > 0:
+                    claimed = jobs.claim_jobs(free, options['visibility_timeout'])
+                    for job_id in claimed:
+                        in_flight.add(pool.submit(execute_job, job_id))
+
+                if in_flight:
+                    done, in_flight = wait(in_flight, timeout=poll_interval,
+                                           return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            self.stderr.write(f'Job crashed: {future.exception()}')
+                elif options['burst'] and not claimed:
+                    break
+                else:
+                    time.sleep(poll_interval)
+
+                if time.monotonic() - last_prune > 3600:
+                    jobs.prune_finished_jobs(settings.JOBS_RETENTION)
+                    last_prune = time.monotonic()
+
+        self.stdout.write('Worker stopped')
+
+    def stop(self, signum, frame):
+        self.stopping = True
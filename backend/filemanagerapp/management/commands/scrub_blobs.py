@@ -0,0 +1,117 @@
+import hashlib
+import os
+import time
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.models import EncryptedFile
+from filemanagerapp.storage import encrypted_storage, read_checkpoint, write_checkpoint
+
+CHECKPOINT = 'scrub'
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Re-hash stored blobs and compare them with the SHA-256 and size '
+        'recorded at upload, reporting missing, truncated and corrupted '
+        'files. Each run reads at most --max-bytes at --rate MB/s and '
+        'carries on from where the previous run stopped, so it can run '
+        'from cron. Blobs uploaded before hashes were recorded get theirs '
+        'filled in.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, default=10 * 1024 ** 3,
+                            help='Stop after reading this many bytes')
+        parser.add_argument('--rate', type=float, default=50.0,
+                            help='Read rate limit in MB/s (0 for none)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows to fetch per query')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and start from the first row')
+
+    def handle(self, *args, **options):
+        last_id = 0 if options['restart'] else read_checkpoint(CHECKPOINT)
+        self.rate = options['rate'] * 1024 ** 2
+        self.bytes_read = 0
+        self.started = time.monotonic()
+        counts = {'ok': 0, 'hashed': 0, 'missing': 0, 'mismatch': 0}
+        finished_pass = False
+
+        while self.bytes_read < options['max_bytes']:
+            batch = list(
+                EncryptedFile.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'stored_filename', 'file_size', 'sha256')
+                [:options['batch_size']]
+            )
+            if not batch:
+                finished_pass = True
+                break
+
+            for file_id, name, file_size, expected in batch:
+                counts[self.check_blob(file_id, name, file_size, expected)] += 1
+                last_id = file_id
+                if self.bytes_read >= options['max_bytes']:
+                    break
+            write_checkpoint(CHECKPOINT, last_id)
+
+        if finished_pass:
+            # Next run starts a new pass from the beginning
+            write_checkpoint(CHECKPOINT, 0)
+
+        elapsed = time.monotonic() - self.started
+        summary = (
+            f"Checked up to file id {last_id}: {counts['ok']} ok, "
+            f"{counts['hashed']} newly hashed, {counts['missing']} missing, "
+            f"{counts['mismatch']} corrupt; read "
+            f"{self.bytes_read / 1024 ** 2:.1f} MB in {elapsed:.1f}s"
+            f"{' (pass complete)' if finished_pass else ''}"
+        )
+        if counts['missing'] or counts['mismatch']:
+            self.stdout.write(self.style.ERROR(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def check_blob(self, file_id, name, file_size, expected):
+        path = encrypted_storage.locate(name)
+        if path is None:
+            self.stderr.write(f"Missing blob for file {file_id}: {name}")
+            return 'missing'
+
+        size = os.path.getsize(path)
+        if size != file_size:
+            self.stderr.write(
+                f"Size mismatch for file {file_id}: {name} is {size} bytes, "
+                f"expected {file_size}")
+            return 'mismatch'
+
+        digest = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                while chunk := f.read(READ_CHUNK_SIZE):
+                    digest.update(chunk)
+                    self.throttle(len(chunk))
+        except FileNotFoundError:
+            # Deleted while we were reading it
+            return 'ok'
+
+        actual = digest.hexdigest()
+        if expected is None:
+            EncryptedFile.objects.filter(id=file_id, sha256__isnull=True).update(
+                sha256=actual)
+            return 'hashed'
+        if actual != expected:
+            self.stderr.write(
+                f"Checksum mismatch for file {file_id}: {name} hashes to "
+                f"{actual}, expected {expected}")
+            return 'mismatch'
+        return 'ok'
+
+    def throttle(self, count):
+        """Sleep as needed to keep the average read rate under --rate"""
+        self.bytes_read += count
+        if self.rate <= 0:
+            return
+        ahead = self.bytes_read / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
@@ -0,0 +1,72 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+
+from filemanagerapp.models import EncryptedFile
+from filemanagerapp.storage import encrypted_storage, read_checkpoint, write_checkpoint
+
+CHECKPOINT = 'shard'
+
+
+class Command(BaseCommand):
+    help = (
+        'Move blobs from the flat uploads directory into the sharded '
+        'ab/cd/<name> layout. Safe to run while the service is serving and '
+        'resumes from its last checkpoint when interrupted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows to process per batch')
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and start from the first row')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would move without touching files')
+
+    def handle(self, *args, **options):
+        last_id = 0 if options['restart'] else read_checkpoint(CHECKPOINT)
+        moved = skipped = missing = vanished = 0
+
+        while True:
+            batch = list(
+                EncryptedFile.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'stored_filename')[:options['batch_size']]
+            )
+            if not batch:
+                break
+
+            for file_id, name in batch:
+                legacy_path = encrypted_storage.legacy_path(name)
+                sharded_path = encrypted_storage.path(name)
+                if os.path.exists(sharded_path):
+                    skipped += 1
+                elif not os.path.exists(legacy_path):
+                    missing += 1
+                    self.stderr.write(f'Missing blob for file {file_id}: {name}')
+                else:
+                    if not options['dry_run']:
+                        encrypted_storage.prepare_path(name)
+                        try:
+                            # rename is atomic, so readers see either path
+                            os.replace(legacy_path, sharded_path)
+                        except FileNotFoundError:
+                            # Deleted since the exists() check above
+                            vanished += 1
+                            continue
+                    moved += 1
+
+            last_id = batch[-1][0]
+            if not options['dry_run']:
+                write_checkpoint(CHECKPOINT, last_id)
+            self.stdout.write(f'Processed up to file id {last_id}')
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved}, already sharded {skipped}, missing {missing}, '
+            f'deleted while running {vanished}'
+        ))
@@ -0,0 +1,103 @@
+"""
+Prometheus metrics, exported at /api/metrics/.
+
+Under gunicorn each worker is its own process, so the entrypoint points
+PROMETHEUS_MULTIPROC_DIR at a shared directory. prometheus_client then keeps
+every metric in per-process mmapped files there and the metrics view sums
+them, whichever worker happens to serve the scrape. Without the variable
+(runserver, a single worker) metrics live in process memory.
+"""
+import os
+import time
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY,
+    generate_latest, multiprocess
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 300)
+
+REQUEST_LATENCY = Histogram(
+    'filemanager_http_request_duration_seconds',
+    'Time from request to the last response byte, per view',
+    ['view', 'method'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter(
+    'filemanager_http_requests_total',
+    'Requests handled, per view and status code',
+    ['view', 'method', 'status'])
+REQUEST_BYTES = Counter(
+    'filemanager_http_request_bytes_total',
+    'Request body bytes received, per view', ['view'])
+RESPONSE_BYTES = Counter(
+    'filemanager_http_response_bytes_total',
+    'Response body bytes sent, per view', ['view'])
+
+TRANSFER_BYTES = Counter(
+    'filemanager_file_transfer_bytes_total',
+    'File bytes moved by upload and download views', ['direction'])
+TRANSFER_SECONDS = Counter(
+    'filemanager_file_transfer_seconds_total',
+    'Time spent in upload and download views; '
+    'rate(bytes) / rate(seconds) is the throughput', ['direction'])
+
+DECRYPT_SECONDS = Histogram(
+    'filemanager_decrypt_seconds',
+    'Time spent in Util.decrypt_file',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+DECRYPT_BYTES = Counter(
+    'filemanager_decrypt_bytes_total',
+    'Ciphertext bytes decrypted by Util.decrypt_file')
+
+DB_QUERIES = Histogram(
+    'filemanager_db_queries_per_request',
+    'Database queries made while handling a request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_SECONDS = Histogram(
+    'filemanager_db_seconds_per_request',
+    'Time spent in database queries while handling a request', ['view'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+# View names whose request or response body is a file
+TRANSFER_VIEWS = {
+    'upload_file': 'upload',
+    'upload_part': 'upload',
+    'download_file': 'download',
+    'download_archive': 'download',
+    'access': 'download',
+    'preview_file': 'download',
+}
+
+# Query count and time for the request being handled. A context variable
+# rather than a thread local so async views, whose queries run in
+# sync_to_async threads, still count towards their request.
+request_db_stats = ContextVar('request_db_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper installed on every connection"""
+    stats = request_db_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['queries'] += 1
+        stats['seconds'] += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def export():
+    """Return (body, content type) of the current metrics"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
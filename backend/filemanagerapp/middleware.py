@@ -0,0 +1,111 @@
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import (
+    DB_QUERIES, DB_SECONDS, REQUESTS, REQUEST_BYTES, REQUEST_LATENCY,
+    RESPONSE_BYTES, TRANSFER_BYTES, TRANSFER_SECONDS, TRANSFER_VIEWS,
+    request_db_stats
+)
+
+
+def counted_stream(content, sent):
+    for chunk in content:
+        sent['bytes'] += len(chunk)
+        yield chunk
+
+
+async def acounted_stream(content, sent):
+    async for chunk in content:
+        sent['bytes'] += len(chunk)
+        yield chunk
+
+
+class RequestMetricsMiddleware:
+    """
+    Record latency, body sizes, transfer throughput and database usage per
+    view (see metrics.py).
+
+    Observations are made when the server closes the response, so streamed
+    downloads are timed to their last byte. Works in both WSGI and ASGI mode
+    without forcing async views through a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        db_stats = {'queries': 0, 'seconds': 0.0}
+        token = request_db_stats.set(db_stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_db_stats.reset(token)
+        return self.track(request, response, started, db_stats)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        db_stats = {'queries': 0, 'seconds': 0.0}
+        token = request_db_stats.set(db_stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_db_stats.reset(token)
+        return self.track(request, response, started, db_stats)
+
+    def track(self, request, response, started, db_stats):
+        match = request.resolver_match
+        view = match.url_name if match and match.url_name else 'unmatched'
+        sent = {'bytes': 0}
+
+        if not response.streaming:
+            sent['bytes'] = len(response.content)
+        elif getattr(response, 'file_to_stream', None) is not None:
+            # Leave FileResponse alone so the server can still sendfile() it
+            sent['bytes'] = int(response.get('Content-Length') or 0)
+        elif response.is_async:
+            response.streaming_content = acounted_stream(
+                response.streaming_content, sent)
+        else:
+            response.streaming_content = counted_stream(
+                response.streaming_content, sent)
+
+        observed = False
+
+        def observe():
+            nonlocal observed
+            if observed:
+                return
+            observed = True
+            elapsed = time.perf_counter() - started
+            received = int(request.META.get('CONTENT_LENGTH') or 0)
+            REQUEST_LATENCY.labels(view, request.method).observe(elapsed)
+            REQUESTS.labels(view, request.method, response.status_code).inc()
+            REQUEST_BYTES.labels(view).inc(received)
+            RESPONSE_BYTES.labels(view).inc(sent['bytes'])
+            DB_QUERIES.labels(view).observe(db_stats['queries'])
+            DB_SECONDS.labels(view).observe(db_stats['seconds'])
+
+            direction = TRANSFER_VIEWS.get(view)
+            if direction is not None and response.status_code < 400:
+                moved = received if direction == 'upload' else sent['bytes']
+                TRANSFER_BYTES.labels(direction).inc(moved)
+                TRANSFER_SECONDS.labels(direction).inc(elapsed)
+
+        close = response.close
+
+        def close_and_observe():
+            try:
+                close()
+            finally:
+                observe()
+
+        # The server calls close() once the body has been sent
+        response.close = close_and_observe
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0016_alter_totpdevice_secret_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upload_id', models.CharField(max_length=36, unique=True)),
+                ('user_id', models.IntegerField()),
+                ('original_filename', models.CharField(max_length=255)),
+                ('encryption_iv', models.TextField(null=True)),
+                ('encryption_key', models.TextField(null=True)),
+                ('authTag', models.TextField(null=True)),
+                ('status', models.CharField(default='open', max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0017_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user_id', '-uploaded_at', '-id'], name='encfile_user_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='encfile_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpermissions',
+            index=models.Index(fields=['file_assigned_id', 'file_id'], name='perm_assigned_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpermissions',
+            index=models.Index(fields=['file_id'], name='perm_file_idx'),
+        ),
+    ]
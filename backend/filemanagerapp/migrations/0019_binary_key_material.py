@@ -0,0 +1,100 @@
+import json
+
+from django.db import migrations, models
+
+
+def text_to_bytes(value):
+    if value is None:
+        return None
+    return bytes(json.loads(value))
+
+
+def bytes_to_text(value):
+    if value is None:
+        return None
+    return str(list(bytes(value)))
+
+
+def convert(apps, from_field, to_field, convert_value):
+    EncryptedFile = apps.get_model('filemanagerapp', 'EncryptedFile')
+    fields = ('encryption_iv', 'encryption_key', 'authTag')
+    batch = []
+    for row in EncryptedFile.objects.only(
+            *(from_field(name) for name in fields)).iterator(chunk_size=1000):
+        for name in fields:
+            setattr(row, to_field(name),
+                    convert_value(getattr(row, from_field(name))))
+        batch.append(row)
+        if len(batch) >= 1000:
+            EncryptedFile.objects.bulk_update(
+                batch, [to_field(name) for name in fields])
+            batch = []
+    if batch:
+        EncryptedFile.objects.bulk_update(
+            batch, [to_field(name) for name in fields])
+
+
+def forwards(apps, schema_editor):
+    convert(apps, lambda name: name, lambda name: f'{name}_raw', text_to_bytes)
+
+
+def backwards(apps, schema_editor):
+    convert(apps, lambda name: f'{name}_raw', lambda name: name, bytes_to_text)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0018_list_files_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='encryption_iv_raw',
+            field=models.BinaryField(max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='encryption_key_raw',
+            field=models.BinaryField(max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='authTag_raw',
+            field=models.BinaryField(max_length=16, null=True),
+        ),
+        migrations.RunPython(forwards, backwards),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='encryption_iv',
+        ),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='encryption_key',
+        ),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='authTag',
+        ),
+        migrations.RenameField(
+            model_name='encryptedfile',
+            old_name='encryption_iv_raw',
+            new_name='encryption_iv',
+        ),
+        migrations.RenameField(
+            model_name='encryptedfile',
+            old_name='encryption_key_raw',
+            new_name='encryption_key',
+        ),
+        migrations.RenameField(
+            model_name='encryptedfile',
+            old_name='authTag_raw',
+            new_name='authTag',
+        ),
+        migrations.AlterField(
+            model_name='encryptedfile',
+            name='encryption_iv',
+            field=models.BinaryField(max_length=12),
+        ),
+    ]
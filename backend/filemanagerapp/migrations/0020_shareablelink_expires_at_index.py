@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0019_binary_key_material'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shareablelink',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
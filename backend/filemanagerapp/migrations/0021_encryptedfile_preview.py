@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0020_shareablelink_expires_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='preview_authTag',
+            field=models.BinaryField(max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='preview_iv',
+            field=models.BinaryField(max_length=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='preview_size',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='encryptedfile',
+            name='preview_type',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
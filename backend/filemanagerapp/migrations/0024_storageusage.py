@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:22
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill(apps, schema_editor):
+    EncryptedFile = apps.get_model('filemanagerapp', 'EncryptedFile')
+    StorageUsage = apps.get_model('filemanagerapp', 'StorageUsage')
+    # Files without an owner have no counter to charge
+    totals = (EncryptedFile.objects.exclude(user_id=None).values('user_id')
+              .annotate(bytes_used=Sum('file_size'), file_count=Count('id')))
+    StorageUsage.objects.bulk_create([
+        StorageUsage(user_id=row['user_id'], bytes_used=row['bytes_used'] or 0,
+                     file_count=row['file_count'])
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0023_encryptedfile_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(unique=True)),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+                ('quota_bytes', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
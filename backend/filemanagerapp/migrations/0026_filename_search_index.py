@@ -0,0 +1,66 @@
+from django.db import migrations
+
+
+# Kept here rather than imported from filemanagerapp.search, so that later
+# changes to the live index code don't alter what this migration does
+SQLITE_CREATE = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS encrypted_files_fts USING fts5(
+        original_filename, content='encrypted_files', content_rowid='id',
+        tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS encrypted_files_fts_insert
+        AFTER INSERT ON encrypted_files BEGIN
+            INSERT INTO encrypted_files_fts(rowid, original_filename)
+            VALUES (new.id, new.original_filename);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS encrypted_files_fts_delete
+        AFTER DELETE ON encrypted_files BEGIN
+            INSERT INTO encrypted_files_fts(encrypted_files_fts, rowid, original_filename)
+            VALUES ('delete', old.id, old.original_filename);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS encrypted_files_fts_update
+        AFTER UPDATE OF original_filename ON encrypted_files BEGIN
+            INSERT INTO encrypted_files_fts(encrypted_files_fts, rowid, original_filename)
+            VALUES ('delete', old.id, old.original_filename);
+            INSERT INTO encrypted_files_fts(rowid, original_filename)
+            VALUES (new.id, new.original_filename);
+        END""",
+    "INSERT INTO encrypted_files_fts(encrypted_files_fts) VALUES ('rebuild')",
+)
+SQLITE_DROP = (
+    "DROP TRIGGER IF EXISTS encrypted_files_fts_insert",
+    "DROP TRIGGER IF EXISTS encrypted_files_fts_delete",
+    "DROP TRIGGER IF EXISTS encrypted_files_fts_update",
+    "DROP TABLE IF EXISTS encrypted_files_fts",
+)
+POSTGRES_CREATE = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS encfile_filename_trgm_idx ON encrypted_files
+        USING gin (UPPER(original_filename) gin_trgm_ops)""",
+)
+POSTGRES_DROP = (
+    "DROP INDEX IF EXISTS encfile_filename_trgm_idx",
+)
+
+
+def run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, ()):
+        schema_editor.execute(statement)
+
+
+def forwards(apps, schema_editor):
+    run(schema_editor, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE})
+
+
+def backwards(apps, schema_editor):
+    run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0025_encryptedfile_format_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+# The user directory's prefix ranges compare LOWER(name) and LOWER(email)
+# under the "C" collation on PostgreSQL (see views.prefix_key). SQLite is
+# served by the indexes from 0027.
+POSTGRES_INDEXES = {
+    'user_name_lower_c_idx': 'LOWER(name) COLLATE "C"',
+    'user_email_lower_c_idx': 'LOWER(email) COLLATE "C"',
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in POSTGRES_INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON filemanagerapp_user (({expression}))')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in POSTGRES_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filemanagerapp', '0027_user_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -2,8 +2,9 @@ import uuid
 import hashlib
 import secrets
 from django.utils import timezone
-from django.db import models
-import os
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
 from django.conf import settings
 from django.contrib.auth.hashers import make_password, check_password
 import json
@@ -18,31 +19,48 @@ class EncryptedFile(models.Model):
     stored_filename = models.CharField(max_length=255, unique=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file_size = models.BigIntegerField()
-    encryption_iv = models.TextField()  # Store IV as JSON string
+    encryption_iv = models.BinaryField(max_length=12)  # Raw 12-byte GCM IV
     file_type = models.CharField(max_length=100, blank=True, null=True)
     user_id = models.IntegerField(null=True, blank=True)
-    encryption_key = models.TextField(null=True)
-    authTag = models.TextField(null=True)
+    encryption_key = models.BinaryField(max_length=32, null=True)
+    authTag = models.BinaryField(max_length=16, null=True)
+    # 1: one AES-GCM stream, tag in authTag. 2: segmented container, see
+    # filemanagerapp/segmented.py
+    format_version = models.PositiveSmallIntegerField(default=1)
+    # Hex SHA-256 of the stored ciphertext; download ETag and scrub reference
+    sha256 = models.CharField(max_length=64, blank=True, null=True)
+    # Encrypted preview rendition stored beside the blob, if one was made
+    preview_type = models.CharField(max_length=100, blank=True, null=True)
+    preview_size = models.IntegerField(null=True, blank=True)
+    preview_iv = models.BinaryField(max_length=12, null=True)
+    preview_authTag = models.BinaryField(max_length=16, null=True)
 
     class Meta:
         app_label = 'filemanagerapp'  # Ensure this matches the app name
         db_table = 'encrypted_files'
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['user_id', '-uploaded_at', '-id'],
+                         name='encfile_user_uploaded_idx'),
+            models.Index(fields=['-uploaded_at', '-id'],
+                         name='encfile_uploaded_idx'),
+        ]
 
     def __str__(self):
         return self.original_filename
 
     def delete(self, *args, **kwargs):
         """Override delete to remove physical file"""
-        # Remove the actual file from storage
-        file_path = os.path.join(
-            os.path.join(settings.BASE_DIR, 'uploads'), self.stored_filename
-        )
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        from .tasks import delete_blob
+        from .usage import release_storage
+
+        with transaction.atomic():
+            # Remove the actual file from storage in the background
+            delete_blob.delay(stored_filename=self.stored_filename)
+            release_storage(self.user_id, self.file_size)
 
-        # Call parent delete method
-        super().delete(*args, **kwargs)
+            # Call parent delete method
+            return super().delete(*args, **kwargs)
 
 
 class UserPermissions(models.Model):
@@ -51,6 +69,13 @@ class UserPermissions(models.Model):
     file_assigned_id = models.IntegerField(null=True, blank=True)
     permission_Type = models.CharField(max_length=255, default="view")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['file_assigned_id', 'file_id'],
+                         name='perm_assigned_file_idx'),
+            models.Index(fields=['file_id'], name='perm_file_idx'),
+        ]
+
 
 class User(models.Model):
     name = models.CharField(max_length=255)
@@ -58,18 +83,31 @@ class User(models.Model):
     email = models.EmailField(unique=True, default="default")
     password = models.CharField(max_length=255, default="default")
 
+    class Meta:
+        indexes = [
+            # The user directory is ordered by name and searched by name
+            # or email prefix, both case-insensitively
+            models.Index(Lower('name'), F('id'), name='user_name_lower_idx'),
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
+
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
 
     def check_password(self, raw_password):
-        return check_password(raw_password, self.password)
+        def upgrade(raw_password):
+            # Rehash with the current hasher and cost after a successful check
+            self.set_password(raw_password)
+            self.save(update_fields=['password'])
+
+        return check_password(raw_password, self.password, upgrade)
 
 
 class ShareableLink(models.Model):
 
     file = models.ForeignKey('EncryptedFile', on_delete=models.CASCADE)
     share_token = models.CharField(max_length=64, unique=True)
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
 
     def generate_share_token(self):
         token_components = [
@@ -98,10 +136,102 @@ class ShareableLink(models.Model):
             expires_at=timezone.now() + timezone.timedelta(seconds=expiration_seconds)
         )
 
+    @classmethod
+    def get_active(cls, share_token):
+        """Fetch an unexpired link and its file in one query, or None"""
+        return cls.objects.select_related('file').filter(
+            share_token=share_token,
+            expires_at__gt=timezone.now()
+        ).first()
+
+    @classmethod
+    def delete_expired(cls, batch_size=1000):
+        """Delete up to batch_size expired links and return how many went"""
+        expired_ids = list(
+            cls.objects.filter(expires_at__lte=timezone.now())
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if expired_ids:
+            cls.objects.filter(id__in=expired_ids).delete()
+        return len(expired_ids)
+
     def get_share_url(self):
         return f"{'http://localhost:8000/api'.rstrip('/')}/access/{self.share_token}"
 
 
+class UploadSession(models.Model):
+    """A resumable upload whose parts are staged on disk until commit"""
+    upload_id = models.CharField(max_length=36, unique=True)
+    user_id = models.IntegerField()
+    original_filename = models.CharField(max_length=255)
+    encryption_iv = models.TextField(null=True)
+    encryption_key = models.TextField(null=True)
+    authTag = models.TextField(null=True)
+    status = models.CharField(max_length=16, default='open')  # open, committing
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def save(self, *args, **kwargs):
+        if not self.upload_id:
+            self.upload_id = str(uuid.uuid4())
+
+        if not self.expires_at:
+            self.expires_at = timezone.now() + timezone.timedelta(
+                seconds=settings.UPLOAD_SESSION_TTL)
+
+        super().save(*args, **kwargs)
+
+    def is_valid(self):
+        return timezone.now() < self.expires_at
+
+    def touch(self):
+        """Push the expiry forward after activity on the session"""
+        self.expires_at = timezone.now() + timezone.timedelta(
+            seconds=settings.UPLOAD_SESSION_TTL)
+        UploadSession.objects.filter(id=self.id).update(
+            expires_at=self.expires_at)
+
+
+class Job(models.Model):
+    """A unit of background work picked up by ``manage.py runworker``"""
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, default='queued')  # queued, running, done, failed
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+            models.Index(fields=['status', 'locked_until'], name='job_status_locked_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name}#{self.id} ({self.status})"
+
+
+class StorageUsage(models.Model):
+    """
+    Running totals of what a user stores, kept in step with EncryptedFile
+    by filemanagerapp/usage.py so quotas need no aggregate per upload.
+    """
+    user_id = models.IntegerField(unique=True)
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    # Per-user quota; null falls back to settings.STORAGE_QUOTA_BYTES
+    quota_bytes = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"user {self.user_id}: {self.bytes_used} bytes in {self.file_count} files"
+
+
 class TOTPDevice(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     secret_key = models.CharField(max_length=32, null=True, blank=True)
@@ -0,0 +1,146 @@
+"""
+Small encrypted preview renditions of uploaded files.
+
+A rendition is an image thumbnail, the first page of a PDF rendered as an
+image, or the first PREVIEW_TEXT_BYTES of a text file. It is encrypted with
+the file's own key under a fresh IV and written beside the blob, so the
+file list and preview dialog only need to fetch a few kilobytes.
+
+PDF renditions are rendered with PyMuPDF, which requirements.txt installs;
+where it is missing PDFs simply get no preview.
+"""
+import io
+import logging
+import os
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+from PIL import Image
+
+from .segmented import FORMAT_SEGMENTED, SegmentedReader, segmented_stream
+from .storage import encrypted_storage
+from .Util import decrypt_file_stream, import_key
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+PREVIEW_TEXT_TYPES = ('text/', 'application/json')
+
+
+def can_preview(file_type):
+    if not file_type:
+        return False
+    if file_type.startswith('image/'):
+        return True
+    if file_type == 'application/pdf':
+        return fitz is not None
+    return file_type.startswith(PREVIEW_TEXT_TYPES)
+
+
+def segmented_reader(db_file):
+    return SegmentedReader(
+        encrypted_storage.open_blob(db_file.stored_filename),
+        import_key(db_file.encryption_key),
+        import_key(db_file.encryption_iv)
+    )
+
+
+def decrypted_chunks(db_file):
+    if db_file.format_version == FORMAT_SEGMENTED:
+        return segmented_stream(segmented_reader(db_file))
+    return decrypt_file_stream(
+        encrypted_storage.open_blob(db_file.stored_filename),
+        import_key(db_file.encryption_iv),
+        import_key(db_file.encryption_key),
+        import_key(db_file.authTag)
+    )
+
+
+def thumbnail(image):
+    size = settings.PREVIEW_IMAGE_SIZE
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffered = io.BytesIO()
+    image.save(buffered, format='JPEG', quality=80)
+    return buffered.getvalue()
+
+
+def render_preview(db_file):
+    """Return (content_type, plaintext rendition) or None"""
+    file_type = db_file.file_type or ''
+
+    if file_type.startswith(PREVIEW_TEXT_TYPES):
+        if db_file.format_version == FORMAT_SEGMENTED:
+            # Only the leading segments need reading and authenticating
+            return 'text/plain', b''.join(segmented_stream(
+                segmented_reader(db_file), 0, settings.PREVIEW_TEXT_BYTES - 1))
+
+        # Read to the end so the GCM tag is still verified
+        head = bytearray()
+        for chunk in decrypted_chunks(db_file):
+            if len(head) < settings.PREVIEW_TEXT_BYTES:
+                head.extend(chunk)
+        return 'text/plain', bytes(head[:settings.PREVIEW_TEXT_BYTES])
+
+    plaintext = b''.join(decrypted_chunks(db_file))
+
+    if file_type.startswith('image/'):
+        with Image.open(io.BytesIO(plaintext)) as image:
+            return 'image/jpeg', thumbnail(image)
+
+    if file_type == 'application/pdf':
+        with fitz.open(stream=plaintext, filetype='pdf') as document:
+            if document.page_count == 0:
+                return None
+            pixmap = document[0].get_pixmap()
+            image = Image.open(io.BytesIO(pixmap.tobytes('png')))
+            return 'image/jpeg', thumbnail(image)
+
+    return None
+
+
+def generate_preview(db_file):
+    """
+    Create and store the preview rendition for ``db_file``.
+
+    Returns True if a rendition was written. Files that are too large or of
+    an unsupported type are skipped; errors are logged and swallowed so a
+    bad preview never fails the upload.
+    """
+    if not settings.PREVIEWS_ENABLED or not can_preview(db_file.file_type):
+        return False
+    if db_file.file_size > settings.PREVIEW_MAX_SOURCE_BYTES:
+        return False
+
+    try:
+        rendered = render_preview(db_file)
+        if rendered is None:
+            return False
+        preview_type, rendition = rendered
+
+        iv = os.urandom(12)
+        sealed = AESGCM(import_key(db_file.encryption_key)).encrypt(
+            iv, rendition, None)
+        ciphertext, tag = sealed[:-16], sealed[-16:]
+
+        path = encrypted_storage.preview_path(db_file.stored_filename)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as destination:
+            destination.write(ciphertext)
+        os.replace(temp_path, path)
+
+        db_file.preview_type = preview_type
+        db_file.preview_size = len(ciphertext)
+        db_file.preview_iv = iv
+        db_file.preview_authTag = tag
+        db_file.save(update_fields=[
+            'preview_type', 'preview_size', 'preview_iv', 'preview_authTag'])
+        return True
+    except Exception:
+        logger.exception("Preview generation failed for file %s", db_file.id)
+        return False
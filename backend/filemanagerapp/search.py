@@ -0,0 +1,161 @@
+"""
+Filename search over the files a user can see.
+
+On SQLite ``original_filename`` is indexed by an FTS5 table using the
+trigram tokenizer, ``encrypted_files_fts``. It stores no copy of the names
+(it reads them from ``encrypted_files``) and triggers on that table keep it
+current however rows are inserted, renamed or deleted, bulk operations
+included. On PostgreSQL a pg_trgm GIN index on ``UPPER(original_filename)``
+serves Django's case-insensitive lookups directly.
+
+Trigrams are no help for terms under three characters and are slowest for
+terms found in a large share of all filenames. So each search first checks
+the newest SEARCH_SCAN_ROWS files the user can see: a common term fills the
+page from there and a small collection is searched completely. Only
+otherwise does it go to the index.
+"""
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+
+SEARCH_MODES = ('tokens', 'prefix', 'substring')
+SEARCH_SCAN_ROWS = 1000
+NEWEST_FIRST = ('-uploaded_at', '-id')
+MIN_TRIGRAM_LENGTH = 3
+
+FTS_TABLE = 'encrypted_files_fts'
+
+SQLITE_TABLE = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        original_filename, content='encrypted_files', content_rowid='id',
+        tokenize='trigram')"""
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': f"""
+        CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON encrypted_files BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, original_filename)
+            VALUES (new.id, new.original_filename);
+        END""",
+    f'{FTS_TABLE}_delete': f"""
+        CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON encrypted_files BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_filename)
+            VALUES ('delete', old.id, old.original_filename);
+        END""",
+    f'{FTS_TABLE}_update': f"""
+        CREATE TRIGGER {FTS_TABLE}_update
+        AFTER UPDATE OF original_filename ON encrypted_files BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, original_filename)
+            VALUES ('delete', old.id, old.original_filename);
+            INSERT INTO {FTS_TABLE}(rowid, original_filename)
+            VALUES (new.id, new.original_filename);
+        END""",
+}
+POSTGRES_INDEX = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS encfile_filename_trgm_idx ON encrypted_files
+        USING gin (UPPER(original_filename) gin_trgm_ops)""",
+)
+
+
+def ensure_search_index(using_connection=None):
+    """
+    Create the filename index if it or any of its triggers is missing.
+
+    Django rebuilds SQLite tables for some schema changes, which drops their
+    triggers; this runs after every migrate to put them back. A SQLite index
+    that had to be repaired is rebuilt from encrypted_files.
+    """
+    conn = using_connection or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for statement in POSTGRES_INDEX:
+                cursor.execute(statement)
+            return
+        if conn.vendor != 'sqlite':
+            return
+
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name = %s OR "
+            "(type = 'trigger' AND tbl_name = 'encrypted_files')", [FTS_TABLE])
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        if FTS_TABLE in existing and not missing:
+            return
+        cursor.execute(SQLITE_TABLE)
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(using_connection=None):
+    conn = using_connection or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS encfile_filename_trgm_idx")
+        elif conn.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def search_terms(query, mode):
+    """Split a query into the terms every match must contain"""
+    if mode == 'tokens':
+        return query.split()
+    return [query.strip()]
+
+
+def match_filter(query, mode):
+    """Exact, case-insensitive condition for ``query`` in ``mode``"""
+    if mode == 'prefix':
+        return Q(original_filename__istartswith=query.strip())
+    condition = Q()
+    for term in search_terms(query, mode):
+        condition &= Q(original_filename__icontains=term)
+    return condition
+
+
+def index_filter(query, mode, using='default'):
+    """
+    Narrow candidates through the FTS5 index, or Q() where it can't help.
+
+    ``using`` is the alias of the database the query will run on. Only
+    terms of at least three characters have trigrams to look up; the exact
+    match_filter still applies on top.
+    """
+    if connections[using].vendor != 'sqlite':
+        return Q()
+    terms = [term for term in search_terms(query, mode)
+             if len(term) >= MIN_TRIGRAM_LENGTH]
+    if not terms:
+        return Q()
+    fts_query = ' AND '.join('"%s"' % term.replace('"', '""') for term in terms)
+    return Q(id__in=RawSQL(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+        [fts_query]))
+
+
+def search_rows(queryset, query, mode, columns, limit):
+    """
+    Up to ``limit`` rows of ``queryset`` whose filename matches, newest
+    first, as ``values_list(*columns)``.
+    """
+    match = match_filter(query, mode)
+    ordered = queryset.order_by(*NEWEST_FIRST)
+
+    # The oldest of the newest SEARCH_SCAN_ROWS files, if there are that many
+    edge = next(iter(ordered.values_list('uploaded_at', 'id')
+                     [SEARCH_SCAN_ROWS - 1:SEARCH_SCAN_ROWS]), None)
+    if edge is None:
+        return list(ordered.filter(match).values_list(*columns)[:limit])
+
+    uploaded_at, file_id = edge
+    recent = Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gte=file_id)
+    rows = list(ordered.filter(match, recent).values_list(*columns)[:limit])
+    if len(rows) == limit:
+        return rows
+
+    return list(
+        ordered.filter(match, index_filter(query, mode, queryset.db))
+        .values_list(*columns)[:limit]
+    )
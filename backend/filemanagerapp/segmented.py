@@ -0,0 +1,161 @@
+"""
+Segmented AES-GCM container (format version 2).
+
+Format 1 is a single AES-GCM stream over the whole file with its tag kept
+in ``EncryptedFile.authTag``; nothing can be authenticated until every
+byte has been read. Format 2 blobs start with a header and then hold the
+plaintext split into fixed-size segments, each sealed on its own::
+
+    header   magic "FMSG" | version (1 byte) | 3 zero bytes |
+             segment size (uint32 BE) | plaintext size (uint64 BE)
+    segment  ciphertext | 16-byte tag, repeated
+
+Segment ``i`` is encrypted under the file key with the nonce
+``iv[:8] || uint32 BE i`` and the header as associated data, so segments
+cannot be reordered, moved between files or have their header altered.
+The plaintext size in the header fixes the segment count, which catches
+truncation. An empty file still has one (empty) segment.
+
+Any plaintext byte range can be decrypted by reading only the segments
+that cover it. The browser writes this format (``encryptFile`` in
+frontend/src/Utils/Util.js); ``encrypt_segmented`` is the Python
+equivalent.
+"""
+import os
+import struct
+from collections import namedtuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+FORMAT_SINGLE_STREAM = 1
+FORMAT_SEGMENTED = 2
+FORMAT_VERSIONS = (FORMAT_SINGLE_STREAM, FORMAT_SEGMENTED)
+
+MAGIC = b'FMSG'
+HEADER = struct.Struct('>4sB3xIQ')
+TAG_SIZE = 16
+SEGMENT_SIZE = 64 * 1024
+MAX_SEGMENT_SIZE = 16 * 1024 * 1024
+
+ContainerHeader = namedtuple('ContainerHeader', 'segment_size plaintext_size')
+
+
+class InvalidContainer(ValueError):
+    pass
+
+
+def pack_header(segment_size, plaintext_size):
+    return HEADER.pack(MAGIC, FORMAT_SEGMENTED, segment_size, plaintext_size)
+
+
+def parse_header(data):
+    """Return the ContainerHeader of a format 2 blob's first HEADER.size bytes"""
+    if len(data) < HEADER.size:
+        raise InvalidContainer('Container header is truncated')
+    magic, version, segment_size, plaintext_size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_SEGMENTED:
+        raise InvalidContainer('Not a segmented container')
+    if not 0 < segment_size <= MAX_SEGMENT_SIZE:
+        raise InvalidContainer('Invalid segment size')
+    return ContainerHeader(segment_size, plaintext_size)
+
+
+def segment_count(header):
+    return max(-(-header.plaintext_size // header.segment_size), 1)
+
+
+def container_size(header):
+    """Size in bytes of the blob a header describes"""
+    return HEADER.size + header.plaintext_size + segment_count(header) * TAG_SIZE
+
+
+def segment_nonce(iv, index):
+    return bytes(iv[:8]) + struct.pack('>I', index)
+
+
+def read_container_header(path):
+    """
+    Check that the blob at ``path`` is a complete format 2 container and
+    return its header. Raises InvalidContainer otherwise.
+    """
+    with open(path, 'rb') as f:
+        header = parse_header(f.read(HEADER.size))
+        size = os.fstat(f.fileno()).st_size
+    if size != container_size(header):
+        raise InvalidContainer('Container size does not match its header')
+    return header
+
+
+def encrypt_segmented(plaintext, key, iv, segment_size=SEGMENT_SIZE):
+    """Encrypt ``plaintext`` into a format 2 container"""
+    header_bytes = pack_header(segment_size, len(plaintext))
+    aead = AESGCM(key)
+    parts = [header_bytes]
+    for index in range(segment_count(parse_header(header_bytes))):
+        segment = plaintext[index * segment_size:(index + 1) * segment_size]
+        parts.append(aead.encrypt(segment_nonce(iv, index), segment, header_bytes))
+    return b''.join(parts)
+
+
+class SegmentedReader:
+    """
+    Random-access decryption of a format 2 container.
+
+    ``f`` is an open, seekable binary file positioned anywhere. Every
+    segment read is authenticated before any of its plaintext is returned;
+    a tampered segment raises cryptography's InvalidTag.
+    """
+
+    def __init__(self, f, key, iv):
+        self.f = f
+        self.iv = iv
+        self.aead = AESGCM(key)
+        f.seek(0)
+        self.header_bytes = f.read(HEADER.size)
+        self.header = parse_header(self.header_bytes)
+        self.segment_size = self.header.segment_size
+        self.size = self.header.plaintext_size
+        self.segments = segment_count(self.header)
+
+    def read_segment(self, index):
+        """Plaintext of segment ``index``"""
+        length = min(self.segment_size, self.size - index * self.segment_size)
+        self.f.seek(HEADER.size + index * (self.segment_size + TAG_SIZE))
+        sealed = self.f.read(max(length, 0) + TAG_SIZE)
+        if len(sealed) < TAG_SIZE:
+            raise InvalidContainer(f'Segment {index} is missing')
+        return self.aead.decrypt(segment_nonce(self.iv, index), sealed,
+                                 self.header_bytes)
+
+    def iter_range(self, start, end):
+        """Yield the plaintext between ``start`` and ``end`` inclusive"""
+        if self.size == 0 or start > end:
+            return
+        end = min(end, self.size - 1)
+        first, last = start // self.segment_size, end // self.segment_size
+        for index in range(first, last + 1):
+            offset = index * self.segment_size
+            plaintext = self.read_segment(index)
+            yield plaintext[max(start - offset, 0):end - offset + 1]
+
+    def read_range(self, start, end):
+        return b''.join(self.iter_range(start, end))
+
+    def __iter__(self):
+        if self.size == 0:
+            # Still authenticates the header
+            self.read_segment(0)
+        return self.iter_range(0, self.size - 1)
+
+    def close(self):
+        self.f.close()
+
+
+def segmented_stream(reader, start=0, end=None):
+    """Yield a range of a SegmentedReader's plaintext, closing it afterwards"""
+    try:
+        if end is None:
+            yield from reader
+        else:
+            yield from reader.iter_range(start, end)
+    finally:
+        reader.close()
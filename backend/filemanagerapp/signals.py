@@ -0,0 +1,34 @@
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from .decorators import auth_cache
+from .metrics import install_query_recorder
+from .models import User
+from .search import ensure_search_index
+
+# Migration that first creates the filename search index
+SEARCH_INDEX_MIGRATION = '0026_filename_search_index'
+
+# Count every query towards the request being handled (see metrics.py)
+connection_created.connect(install_query_recorder)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop cached logins for a user whose row changed or was removed"""
+    auth_cache.invalidate_user(instance.id)
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, using, **kwargs):
+    """Recreate filename index triggers lost when a migration rebuilt the table"""
+    if sender.name != 'filemanagerapp':
+        return
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('filemanagerapp', SEARCH_INDEX_MIGRATION) in applied:
+        ensure_search_index(connection)
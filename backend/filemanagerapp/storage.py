@@ -0,0 +1,100 @@
+import os
+import uuid
+import hashlib
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+# Ensure uploads directory exists
+UPLOAD_ROOT = os.path.join(settings.BASE_DIR, 'uploads')
+os.makedirs(UPLOAD_ROOT, exist_ok=True)
+os.chmod(UPLOAD_ROOT, 0o755)
+
+
+class EncryptedFileStorage(FileSystemStorage):
+    """
+    Blob storage for encrypted uploads.
+
+    Blobs live under a two-level hash prefix, ``ab/cd/<stored_filename>``,
+    so no single directory grows past a few thousand entries. Files written
+    before sharding sit directly in UPLOAD_ROOT; they are still found there
+    until the ``shard_uploads`` command has moved them.
+    """
+
+    def __init__(self, location=UPLOAD_ROOT, *args, **kwargs):
+        super().__init__(location=location, *args, **kwargs)
+
+    def generate_name(self):
+        return str(uuid.uuid4())
+
+    def shard_name(self, name):
+        digest = hashlib.sha256(name.encode()).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], name)
+
+    def path(self, name):
+        return super().path(self.shard_name(name))
+
+    def legacy_path(self, name):
+        return super().path(name)
+
+    def preview_path(self, name):
+        """Path of the encrypted preview rendition kept beside a blob"""
+        return f"{self.path(name)}.preview"
+
+    def prepare_path(self, name):
+        """Create the shard directory for ``name`` and return its full path"""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def locate(self, name):
+        """Return the path currently holding ``name``, or None"""
+        for path in (self.path(name), self.legacy_path(name)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def open_blob(self, name):
+        # The sharded path is tried again last in case the migration moved
+        # the blob between the two earlier attempts
+        for path in (self.path(name), self.legacy_path(name), self.path(name)):
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(name)
+
+    def exists(self, name):
+        return self.locate(name) is not None
+
+    def delete(self, name):
+        for path in (self.path(name), self.legacy_path(name),
+                     self.preview_path(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+encrypted_storage = EncryptedFileStorage()
+
+
+def checkpoint_path(name):
+    return os.path.join(encrypted_storage.location, f'.{name}_checkpoint')
+
+
+def read_checkpoint(name):
+    """Last file id saved by the resumable command ``name``, or 0"""
+    try:
+        with open(checkpoint_path(name)) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_checkpoint(name, last_id):
+    """Save the last file id ``name`` has processed; replaced atomically"""
+    path = checkpoint_path(name)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(str(last_id))
+    os.replace(temp_path, path)
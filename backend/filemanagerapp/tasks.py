@@ -0,0 +1,28 @@
+"""Background jobs run by ``manage.py runworker`` (see jobs.py)"""
+from .jobs import task
+from .models import EncryptedFile
+from .previews import generate_preview
+from .storage import encrypted_storage
+
+
+@task(max_attempts=5)
+def delete_blob(stored_filename):
+    """Unlink a deleted file's blob and preview from storage"""
+    encrypted_storage.delete(stored_filename)
+
+
+@task(max_attempts=5)
+def delete_blobs(stored_filenames):
+    """delete_blob for a whole batch of deleted files"""
+    for stored_filename in stored_filenames:
+        encrypted_storage.delete(stored_filename)
+
+
+@task(max_attempts=2)
+def build_preview(file_id):
+    """Create the preview rendition for a freshly uploaded file"""
+    db_file = EncryptedFile.objects.filter(id=file_id).first()
+    if db_file is None:
+        # Deleted before the worker got to it
+        return
+    generate_preview(db_file)
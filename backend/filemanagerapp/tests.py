@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+from django.utils.http import http_date
+
+from . import decorators, jobs, search, views
+from .decorators import AuthCache, auth_cache
+from .models import (
+    EncryptedFile, Job, ShareableLink, StorageUsage, UploadSession, User, UserPermissions
+)
+from .segmented import (
+    HEADER, TAG_SIZE, InvalidContainer, SegmentedReader, container_size,
+    encrypt_segmented, parse_header, read_container_header
+)
+from .storage import encrypted_storage, read_checkpoint, write_checkpoint
+from .Util import (
+    DECRYPT_CHUNK_SIZE, adecrypt_file_stream, decrypt_file_stream, merge_ranges,
+    parse_key_material, parse_range_header
+)
+from .views import MAX_DOWNLOAD_RANGES, requested_ranges, segmented_plaintext_response
+
+
+SEGMENT = 16
+
+
+def encrypt(data):
+    """Encrypt ``data`` as a format 1 upload; returns (ciphertext, iv, key, tag)"""
+    key = os.urandom(32)
+    iv = os.urandom(12)
+    sealed = AESGCM(key).encrypt(iv, data, None)
+    return sealed[:-TAG_SIZE], iv, key, sealed[-TAG_SIZE:]
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class StorageTestCase(TestCase):
+    """TestCase with blob storage and staged parts in a temporary directory"""
+
+    def setUp(self):
+        super().setUp()
+        auth_cache.clear()
+        self.upload_root = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(mock.patch.dict(encrypted_storage.__dict__, {
+            'base_location': self.upload_root, 'location': self.upload_root}))
+        self.enterContext(mock.patch.object(
+            views, 'UPLOAD_PARTS_ROOT', os.path.join(self.upload_root, '.parts')))
+
+    def make_user(self, name, role='user'):
+        user = User(name=name, email=f'{name}@example.com', role=role)
+        user.set_password('password')
+        user.save()
+        return user
+
+    def client_for(self, user):
+        client = Client()
+        client.cookies['jwt_token'] = views.generate_jwt_token(user)
+        return client
+
+    def store_file(self, user, data=b'hello world', name='hello.txt'):
+        """Write an encrypted blob for ``data`` and create its record"""
+        ciphertext, iv, key, tag = encrypt(data)
+        stored_filename = encrypted_storage.generate_name()
+        with open(encrypted_storage.prepare_path(stored_filename), 'wb') as f:
+            f.write(ciphertext)
+        return EncryptedFile.objects.create(
+            original_filename=name, stored_filename=stored_filename,
+            file_size=len(data), encryption_iv=iv, encryption_key=key,
+            authTag=tag, file_type='text/plain',
+            user_id=user.id if user else None)
+
+    def key_material(self):
+        return {name: base64.b64encode(os.urandom(size)).decode()
+                for name, size in (('key', 32), ('iv', 12), ('authTag', 16))}
+
+    def upload(self, client, data, name='upload.bin'):
+        """POST ``data`` as a single-request upload"""
+        return client.post('/api/upload/', {
+            'file': SimpleUploadedFile(name, data), **self.key_material()})
+
+    def start_session(self, client, name='upload.bin', **fields):
+        response = client.post('/api/uploads/', json.dumps({
+            'filename': name, **self.key_material(), **fields}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['upload_id']
+
+    def put_part(self, client, upload_id, number, data):
+        return client.put(f'/api/uploads/{upload_id}/parts/{number}/', data,
+                          content_type='application/octet-stream')
+
+    def commit(self, client, upload_id, **fields):
+        return client.post(f'/api/uploads/{upload_id}/commit/', json.dumps(fields),
+                           content_type='application/json')
+
+    def usage(self, user):
+        return StorageUsage.objects.filter(user_id=user.id).values_list(
+            'bytes_used', 'file_count').first()
+
+    def stored_blobs(self):
+        """Names of every file under the upload root except staged parts"""
+        return [name for root, dirs, names in os.walk(self.upload_root)
+                if '.parts' not in root for name in names]
+
+    def tamper(self, db_file, offset=0):
+        """Flip one ciphertext byte of a stored blob"""
+        with open(encrypted_storage.path(db_file.stored_filename), 'r+b') as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(bytes([byte[0] ^ 1]))
+
+
+class SegmentedContainerTests(SimpleTestCase):
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.iv = os.urandom(12)
+        self.plaintext = os.urandom(SEGMENT * 3 + 5)
+        self.blob = encrypt_segmented(self.plaintext, self.key, self.iv,
+                                      segment_size=SEGMENT)
+
+    def reader(self, blob=None):
+        return SegmentedReader(io.BytesIO(self.blob if blob is None else blob),
+                               self.key, self.iv)
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.blob), container_size(parse_header(self.blob)))
+        self.assertEqual(b''.join(self.reader()), self.plaintext)
+
+    def test_range_reads_across_segment_boundaries(self):
+        reader = self.reader()
+        for start, end in [(0, 0), (SEGMENT - 1, SEGMENT), (5, SEGMENT * 2 + 3),
+                           (SEGMENT * 3, len(self.plaintext) - 1),
+                           (SEGMENT * 2 + 7, len(self.plaintext) + 100)]:
+            self.assertEqual(reader.read_range(start, end),
+                             self.plaintext[start:end + 1])
+
+    def test_empty_file(self):
+        blob = encrypt_segmented(b'', self.key, self.iv, segment_size=SEGMENT)
+        self.assertEqual(len(blob), HEADER.size + TAG_SIZE)
+        reader = self.reader(blob)
+        self.assertEqual(reader.size, 0)
+        self.assertEqual(b''.join(reader), b'')
+
+    def test_empty_file_still_authenticates(self):
+        blob = encrypt_segmented(b'', self.key, self.iv, segment_size=SEGMENT)
+        with self.assertRaises(InvalidTag):
+            b''.join(self.reader(blob[:-1] + bytes([blob[-1] ^ 1])))
+
+    def test_truncation_is_detected(self):
+        truncated = self.blob[:-TAG_SIZE - 1]
+        with self.assertRaises((InvalidContainer, InvalidTag)):
+            b''.join(self.reader(truncated))
+
+        # A whole missing segment
+        with self.assertRaises(InvalidContainer):
+            b''.join(self.reader(self.blob[:HEADER.size + 3 * (SEGMENT + TAG_SIZE)]))
+
+    def test_truncated_blob_fails_size_check(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'blob')
+        with open(path, 'wb') as f:
+            f.write(self.blob[:-1])
+        with self.assertRaises(InvalidContainer):
+            read_container_header(path)
+
+    def test_swapped_segments_fail(self):
+        sealed = SEGMENT + TAG_SIZE
+        first = self.blob[HEADER.size:HEADER.size + sealed]
+        second = self.blob[HEADER.size + sealed:HEADER.size + 2 * sealed]
+        swapped = (self.blob[:HEADER.size] + second + first
+                   + self.blob[HEADER.size + 2 * sealed:])
+        with self.assertRaises(InvalidTag):
+            self.reader(swapped).read_segment(0)
+
+    def test_header_tampering_fails(self):
+        # The padding bytes are not parsed, but they are authenticated
+        tampered = bytearray(self.blob)
+        tampered[5] ^= 1
+        with self.assertRaises(InvalidTag):
+            self.reader(bytes(tampered)).read_segment(0)
+
+    def test_bad_magic_is_rejected(self):
+        with self.assertRaises(InvalidContainer):
+            self.reader(b'XXXX' + self.blob[4:])
+
+
+class SegmentedResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.iv = os.urandom(12)
+        self.plaintext = os.urandom(SEGMENT * 2 + 3)
+        self.blob = encrypt_segmented(self.plaintext, self.key, self.iv,
+                                      segment_size=SEGMENT)
+        self.db_file = SimpleNamespace(file_type='application/octet-stream',
+                                       original_filename='data.bin')
+
+    def respond(self, blob, range_header=None):
+        headers = {'Range': range_header} if range_header else {}
+        request = RequestFactory().get('/', headers=headers)
+        return segmented_plaintext_response(request, self.db_file, io.BytesIO(blob),
+                                            self.key, self.iv)
+
+    def test_whole_file(self):
+        response = self.respond(self.blob)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.plaintext)
+        self.assertEqual(int(response['Content-Length']), len(self.plaintext))
+
+    def test_single_range(self):
+        response = self.respond(self.blob, f'bytes=10-{SEGMENT + 5}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'],
+                         f'bytes 10-{SEGMENT + 5}/{len(self.plaintext)}')
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.plaintext[10:SEGMENT + 6])
+
+    def test_unsatisfiable_range(self):
+        response = self.respond(self.blob, f'bytes={len(self.plaintext)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.plaintext)}')
+
+    def test_invalid_container(self):
+        blob = io.BytesIO(b'not a container')
+        request = RequestFactory().get('/')
+        response = segmented_plaintext_response(request, self.db_file, blob,
+                                                self.key, self.iv)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn(b'damaged', response.content)
+        self.assertTrue(blob.closed)
+
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_absent_or_not_bytes(self):
+        self.assertIsNone(parse_range_header(None, 100))
+        self.assertIsNone(parse_range_header('items=0-5', 100))
+        self.assertIsNone(parse_range_header('bytes=5', 100))
+        self.assertIsNone(parse_range_header('bytes=a-b', 100))
+        self.assertIsNone(parse_range_header('bytes=9-3', 100))
+
+    def test_closed_range(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-500', 100), [(90, 99)])
+
+    def test_open_ended_range(self):
+        self.assertEqual(parse_range_header('bytes=40-', 100), [(40, 99)])
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=100-', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+        self.assertEqual(parse_range_header('bytes=0-5', 0), [])
+
+    def test_several_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-1, 200-300, 5-6', 100),
+                         [(0, 1), (5, 6)])
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([(50, 60), (0, 10), (5, 20), (21, 30)]),
+                         [(0, 30), (50, 60)])
+        self.assertEqual(merge_ranges([(0, 99)] * 16), [(0, 99)])
+
+
+class RequestedRangesTests(SimpleTestCase):
+    def setUp(self):
+        self.db_file = SimpleNamespace(
+            uploaded_at=datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            sha256='ab' * 32)
+
+    def ranges(self, range_header, if_range=None, size=1000):
+        headers = {'Range': range_header}
+        if if_range:
+            headers['If-Range'] = if_range
+        request = RequestFactory().get('/', headers=headers)
+        return requested_ranges(request, size, self.db_file)
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(self.ranges('bytes=0-99,50-149,0-99,300-'),
+                         [(0, 149), (300, 999)])
+
+    def test_too_many_ranges_fall_back_to_whole_file(self):
+        spec = ','.join(f'{i * 10}-{i * 10 + 1}'
+                        for i in range(MAX_DOWNLOAD_RANGES + 1))
+        self.assertIsNone(self.ranges(f'bytes={spec}'))
+
+    def test_repeated_ranges_do_not_count_against_the_limit(self):
+        spec = ','.join(['0-9'] * (MAX_DOWNLOAD_RANGES + 1))
+        self.assertEqual(self.ranges(f'bytes={spec}'), [(0, 9)])
+
+    def test_if_range_etag(self):
+        etag = '"%s"' % self.db_file.sha256
+        self.assertEqual(self.ranges('bytes=0-9', etag), [(0, 9)])
+        self.assertIsNone(self.ranges('bytes=0-9', '"stale"'))
+
+    def test_if_range_date(self):
+        date = http_date(self.db_file.uploaded_at.timestamp())
+        self.assertEqual(self.ranges('bytes=0-9', date), [(0, 9)])
+        self.assertIsNone(self.ranges('bytes=0-9', 'Mon, 01 Jan 2024 00:00:00 GMT'))
+
+
+class DecryptStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.plaintext = os.urandom(100)
+        self.ciphertext, self.iv, self.key, self.tag = encrypt(self.plaintext)
+
+    def decrypt(self, ciphertext):
+        return decrypt_file_stream(io.BytesIO(ciphertext), self.iv, self.key,
+                                   self.tag, chunk_size=SEGMENT)
+
+    def test_round_trip(self):
+        self.assertEqual(b''.join(self.decrypt(self.ciphertext)), self.plaintext)
+
+    def test_tampered_stream_is_truncated(self):
+        tampered = self.ciphertext[:-1] + bytes([self.ciphertext[-1] ^ 1])
+        received = []
+        with self.assertRaises(InvalidTag):
+            for chunk in self.decrypt(tampered):
+                received.append(chunk)
+        # The unverified last chunk is never sent
+        self.assertEqual(b''.join(received),
+                         self.plaintext[:len(self.plaintext) // SEGMENT * SEGMENT])
+
+    async def test_async_tampered_stream_is_truncated(self):
+        tampered = self.ciphertext[:-1] + bytes([self.ciphertext[-1] ^ 1])
+        received = []
+        with self.assertRaises(InvalidTag):
+            async for chunk in adecrypt_file_stream(io.BytesIO(tampered), self.iv,
+                                                    self.key, self.tag,
+                                                    chunk_size=SEGMENT):
+                received.append(chunk)
+        self.assertEqual(b''.join(received),
+                         self.plaintext[:len(self.plaintext) // SEGMENT * SEGMENT])
+
+
+class ShareAccessTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.plaintext = os.urandom(DECRYPT_CHUNK_SIZE * 2 + 10)
+        self.db_file = self.store_file(self.make_user('owner'), self.plaintext)
+        self.link = ShareableLink.create_share_link(self.db_file, 3600)
+
+    def url(self):
+        return f'/api/access/{self.link.share_token}/'
+
+    def test_stream(self):
+        response = Client().get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.plaintext)
+
+    def test_tampered_stream_is_truncated(self):
+        self.tamper(self.db_file, offset=len(self.plaintext) - 1)
+        response = Client().get(self.url())
+        received = []
+        with self.assertRaises(InvalidTag):
+            for chunk in response.streaming_content:
+                received.append(chunk)
+        self.assertLess(len(b''.join(received)), int(response['Content-Length']))
+
+    def test_tampered_json_is_a_json_error(self):
+        self.tamper(self.db_file)
+        response = Client().get(self.url(), {'format': 'json'})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'error': 'Stored file is damaged'})
+
+
+class PreviewAccessTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.db_file = self.store_file(self.owner)
+        self.db_file.preview_type = 'image/webp'
+        self.db_file.preview_iv = os.urandom(12)
+        self.db_file.preview_authTag = os.urandom(16)
+        self.db_file.save()
+        with open(encrypted_storage.preview_path(self.db_file.stored_filename), 'wb') as f:
+            f.write(b'preview')
+
+    def get(self, user):
+        return self.client_for(user).get(f'/api/preview/{self.db_file.id}/')
+
+    def test_owner_and_admin(self):
+        for user in (self.owner, self.make_user('admin', role='admin')):
+            response = self.get(user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'preview')
+
+    def test_shared_user(self):
+        viewer = self.make_user('viewer')
+        UserPermissions.objects.create(file_id=self.db_file.id,
+                                       file_user_id=self.owner.id,
+                                       file_assigned_id=viewer.id)
+        self.assertEqual(self.get(viewer).status_code, 200)
+
+    def test_other_user_is_refused(self):
+        response = self.get(self.make_user('stranger'))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Encryption-key', response)
+
+
+class FilePermissionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.alice = self.make_user('alice')
+        self.bob = self.make_user('bob')
+        self.db_file = self.store_file(self.owner)
+        self.client = self.client_for(self.owner)
+
+    def post(self, url, body):
+        return self.client.post(url, json.dumps(body), content_type='application/json')
+
+    def set_acl(self, permissions):
+        return self.post('/api/uploadpermissions/', {
+            'fileId': self.db_file.id, 'permissions': permissions})
+
+    def acl(self):
+        return dict(UserPermissions.objects.filter(file_id=self.db_file.id)
+                    .values_list('file_assigned_id', 'permission_Type'))
+
+    def test_resending_the_same_acl_writes_nothing(self):
+        permissions = [{'userId': self.alice.id, 'accessType': 'view'},
+                       {'userId': self.bob.id, 'accessType': 'edit'}]
+        self.assertEqual(self.set_acl(permissions).json()['created'], 2)
+        ids = set(UserPermissions.objects.values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.set_acl(permissions)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([response.json()[k] for k in ('created', 'updated', 'deleted')],
+                         [0, 0, 0])
+        writes = [q['sql'] for q in queries
+                  if q['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(writes, [])
+        self.assertEqual(set(UserPermissions.objects.values_list('id', flat=True)), ids)
+
+    def test_removed_users_are_revoked(self):
+        self.set_acl([{'userId': self.alice.id, 'accessType': 'view'},
+                      {'userId': self.bob.id, 'accessType': 'view'}])
+        response = self.set_acl([{'userId': self.bob.id, 'accessType': 'edit'}])
+        self.assertEqual([response.json()[k] for k in ('created', 'updated', 'deleted')],
+                         [0, 1, 1])
+        self.assertEqual(self.acl(), {self.bob.id: 'edit'})
+
+    def test_only_owner_or_admin_may_change_acl(self):
+        response = self.client_for(self.alice).post(
+            '/api/uploadpermissions/batch/',
+            json.dumps({'files': [{'fileId': self.db_file.id,
+                                   'permissions': [{'userId': self.alice.id}]}]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.acl(), {})
+
+    def test_batch_rejects_malformed_entries_by_index(self):
+        good = {'fileId': self.db_file.id, 'permissions': [{'userId': self.alice.id}]}
+        for bad, index in ((['not an entry'], 1),
+                           ([{'fileId': 'abc'}], 1),
+                           ([{'fileId': self.db_file.id,
+                              'permissions': [{'userId': None}]}], 1),
+                           ([{'fileId': self.db_file.id, 'permissions': 'all'}], 1)):
+            response = self.post('/api/uploadpermissions/batch/', {'files': [good] + bad})
+            self.assertEqual(response.status_code, 400, bad)
+            self.assertEqual(response.json()['index'], index)
+        self.assertEqual(self.acl(), {})
+
+    def test_batch_updates_several_files(self):
+        other = self.store_file(self.owner, name='other.txt')
+        response = self.post('/api/uploadpermissions/batch/', {'files': [
+            {'fileId': self.db_file.id, 'permissions': [{'userId': self.alice.id}]},
+            {'fileId': other.id, 'permissions': [{'userId': self.bob.id}]},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(self.acl(), {self.alice.id: 'view'})
+
+
+class StorageUsageTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.client = self.client_for(self.owner)
+
+    def test_upload_is_charged(self):
+        response = self.upload(self.client, b'x' * 100)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.usage(self.owner), (100, 1))
+        self.assertEqual(EncryptedFile.objects.get().user_id, self.owner.id)
+
+    def test_upload_is_charged_to_the_signed_in_user(self):
+        other = self.make_user('other')
+        response = self.client.post('/api/upload/', {
+            'file': SimpleUploadedFile('a.bin', b'x' * 10), 'user_id': other.id,
+            **self.key_material()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage(self.owner), (10, 1))
+        self.assertIsNone(self.usage(other))
+
+    def test_commit_is_charged(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, b'a' * 30)
+        self.put_part(self.client, upload_id, 2, b'b' * 20)
+        response = self.commit(self.client, upload_id)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.usage(self.owner), (50, 1))
+
+    def test_single_delete_releases(self):
+        file_id = self.upload(self.client, b'x' * 100).json()['file_id']
+        self.upload(self.client, b'y' * 40)
+        response = self.client.delete(f'/api/delete/{file_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage(self.owner), (40, 1))
+
+    def test_batch_delete_releases(self):
+        file_ids = [self.upload(self.client, b'x' * size).json()['file_id']
+                    for size in (10, 20, 30)]
+        response = self.client.post('/api/delete/batch/', json.dumps({
+            'file_ids': file_ids[:2]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.usage(self.owner), (30, 1))
+
+    def test_over_quota_upload_is_refused(self):
+        StorageUsage.objects.create(user_id=self.owner.id, quota_bytes=50)
+        response = self.upload(self.client, b'x' * 100)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()['quota_bytes'], 50)
+        self.assertEqual(self.usage(self.owner), (0, 0))
+        self.assertFalse(EncryptedFile.objects.exists())
+        self.assertEqual(self.stored_blobs(), [])
+
+    def test_over_quota_commit_is_refused_and_keeps_parts(self):
+        StorageUsage.objects.create(user_id=self.owner.id, quota_bytes=50)
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, b'x' * 100)
+        self.assertEqual(self.commit(self.client, upload_id).status_code, 413)
+        self.assertEqual(self.usage(self.owner), (0, 0))
+        self.assertEqual(self.stored_blobs(), [])
+
+        # Committing again after the quota is raised succeeds
+        StorageUsage.objects.filter(user_id=self.owner.id).update(quota_bytes=None)
+        self.assertEqual(self.commit(self.client, upload_id).status_code, 200)
+        self.assertEqual(self.usage(self.owner), (100, 1))
+
+
+class UploadSessionTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.client = self.client_for(self.owner)
+        self.parts = [os.urandom(size) for size in (40, 25, 7)]
+
+    def read_blob(self, db_file):
+        with open(encrypted_storage.path(db_file.stored_filename), 'rb') as f:
+            return f.read()
+
+    def test_parts_out_of_order(self):
+        upload_id = self.start_session(self.client)
+        for number in (3, 1, 2):
+            response = self.put_part(self.client, upload_id, number, self.parts[number - 1])
+            self.assertEqual(response.status_code, 200)
+
+        response = self.commit(self.client, upload_id)
+        self.assertEqual(response.status_code, 200, response.content)
+        db_file = EncryptedFile.objects.get(id=response.json()['file_id'])
+        data = b''.join(self.parts)
+        self.assertEqual(self.read_blob(db_file), data)
+        self.assertEqual(db_file.file_size, len(data))
+        self.assertEqual(db_file.sha256, hashlib.sha256(data).hexdigest())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(views.upload_session_dir(upload_id)))
+
+    def test_size_is_what_was_assembled(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        with mock.patch.object(views, 'list_upload_parts', return_value={1: 999}):
+            response = self.commit(self.client, upload_id)
+        db_file = EncryptedFile.objects.get(id=response.json()['file_id'])
+        self.assertEqual(db_file.file_size, len(self.parts[0]))
+
+    def test_wrong_part_count(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        self.put_part(self.client, upload_id, 2, self.parts[1])
+
+        response = self.commit(self.client, upload_id, parts=3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_parts'], [3])
+        for parts in ('many', -1):
+            self.assertEqual(self.commit(self.client, upload_id, parts=parts).status_code, 400)
+
+        # The session is still open and commits once the count is right
+        self.assertEqual(self.commit(self.client, upload_id, parts=2).status_code, 200)
+
+    def test_missing_middle_part(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        self.put_part(self.client, upload_id, 3, self.parts[2])
+        response = self.commit(self.client, upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['missing_parts'], [2])
+
+    def test_other_users_session_is_not_found(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        other = self.client_for(self.make_user('other'))
+
+        self.assertEqual(other.get(f'/api/uploads/{upload_id}/').status_code, 404)
+        self.assertEqual(self.put_part(other, upload_id, 2, b'x').status_code, 404)
+        self.assertEqual(self.commit(other, upload_id).status_code, 404)
+        self.assertEqual(other.delete(f'/api/uploads/{upload_id}/').status_code, 404)
+        self.assertTrue(UploadSession.objects.filter(upload_id=upload_id).exists())
+
+    def test_guest_may_not_start_a_session(self):
+        guest = self.client_for(self.make_user('guest', role='guest'))
+        response = guest.post('/api/uploads/', json.dumps({'filename': 'a.bin'}),
+                              content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_file_size(self):
+        for file_size in ('big', -5, [1]):
+            response = self.client.post('/api/uploads/', json.dumps({
+                'filename': 'a.bin', 'file_size': file_size}),
+                content_type='application/json')
+            self.assertEqual(response.status_code, 400, file_size)
+
+    def test_expired_session_is_refused_and_purged(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        UploadSession.objects.filter(upload_id=upload_id).update(
+            expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+        self.assertEqual(self.put_part(self.client, upload_id, 2, b'x').status_code, 404)
+        self.assertEqual(self.commit(self.client, upload_id).status_code, 404)
+
+        # Starting another session clears the expired one and its parts
+        self.start_session(self.client)
+        self.assertFalse(UploadSession.objects.filter(upload_id=upload_id).exists())
+        self.assertFalse(os.path.exists(views.upload_session_dir(upload_id)))
+
+    def test_abort(self):
+        upload_id = self.start_session(self.client)
+        self.put_part(self.client, upload_id, 1, self.parts[0])
+        response = self.client.delete(f'/api/uploads/{upload_id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(views.upload_session_dir(upload_id)))
+
+
+class BlobCommandTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+
+    def store_flat(self, data=b'flat'):
+        """A file whose blob is still in the pre-sharding layout"""
+        db_file = self.store_file(self.owner, data)
+        os.replace(encrypted_storage.path(db_file.stored_filename),
+                   encrypted_storage.legacy_path(db_file.stored_filename))
+        return db_file
+
+    def run_command(self, *args, **options):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(*args, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_checkpoint_round_trip(self):
+        self.assertEqual(read_checkpoint('test'), 0)
+        write_checkpoint('test', 42)
+        self.assertEqual(read_checkpoint('test'), 42)
+        self.assertTrue(os.path.exists(os.path.join(self.upload_root, '.test_checkpoint')))
+
+    def test_shard_uploads_moves_flat_blobs(self):
+        flat = self.store_flat()
+        sharded = self.store_file(self.owner)
+        stdout, _ = self.run_command('shard_uploads')
+        self.assertIn('Moved 1, already sharded 1', stdout)
+        self.assertTrue(os.path.exists(encrypted_storage.path(flat.stored_filename)))
+        self.assertEqual(read_checkpoint('shard'), sharded.id)
+
+    def test_shard_uploads_skips_blob_deleted_mid_move(self):
+        flat = self.store_flat()
+        prepare_path = encrypted_storage.prepare_path
+
+        def delete_then_prepare(name):
+            os.remove(encrypted_storage.legacy_path(name))
+            return prepare_path(name)
+
+        with mock.patch.object(encrypted_storage, 'prepare_path',
+                               side_effect=delete_then_prepare):
+            stdout, _ = self.run_command('shard_uploads')
+        self.assertIn('Moved 0', stdout)
+        self.assertIn('deleted while running 1', stdout)
+        self.assertEqual(read_checkpoint('shard'), flat.id)
+
+    def test_scrub_blobs_reports_corruption(self):
+        data = os.urandom(64)
+        good = self.store_file(self.owner, data)
+        with open(encrypted_storage.path(good.stored_filename), 'rb') as f:
+            good.sha256 = hashlib.sha256(f.read()).hexdigest()
+        good.save()
+        bad = self.store_file(self.owner, data)
+        bad.sha256 = '0' * 64
+        bad.save()
+        unhashed = self.store_file(self.owner, data)
+
+        stdout, stderr = self.run_command('scrub_blobs', rate=0)
+        self.assertIn('1 ok, 1 newly hashed, 0 missing, 1 corrupt', stdout)
+        self.assertIn(f'Checksum mismatch for file {bad.id}', stderr)
+        self.assertIsNotNone(EncryptedFile.objects.get(id=unhashed.id).sha256)
+        # A finished pass starts over next time
+        self.assertEqual(read_checkpoint('scrub'), 0)
+
+
+class BatchDeleteTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.other = self.make_user('other')
+        self.client = self.client_for(self.owner)
+        self.mine = [self.stored(self.owner, size) for size in (10, 20, 30)]
+        self.theirs = self.stored(self.other, 40)
+
+    def stored(self, user, size):
+        file_id = self.upload(self.client_for(user), b'x' * size).json()['file_id']
+        return EncryptedFile.objects.get(id=file_id)
+
+    def delete(self, client, file_ids):
+        return client.post('/api/delete/batch/', json.dumps({'file_ids': file_ids}),
+                           content_type='application/json')
+
+    def blob_exists(self, db_file):
+        return encrypted_storage.exists(db_file.stored_filename)
+
+    def test_partial_ownership(self):
+        first, second, _ = self.mine
+        UserPermissions.objects.create(file_id=first.id, file_user_id=self.owner.id,
+                                       file_assigned_id=self.other.id)
+        ShareableLink.create_share_link(first, 3600)
+
+        response = self.delete(self.client, [first.id, self.theirs.id, 9999, second.id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['deleted'], 2)
+        self.assertEqual(
+            {r['file_id']: r['status'] for r in response.json()['results']},
+            {first.id: 'deleted', self.theirs.id: 'forbidden', 9999: 'not_found',
+             second.id: 'deleted'})
+        self.assertEqual(set(EncryptedFile.objects.values_list('id', flat=True)),
+                         {self.mine[2].id, self.theirs.id})
+        self.assertFalse(UserPermissions.objects.filter(file_id=first.id).exists())
+        self.assertFalse(ShareableLink.objects.filter(file_id=first.id).exists())
+
+    def test_admin_may_delete_any_file(self):
+        admin = self.client_for(self.make_user('admin', role='admin'))
+        response = self.delete(admin, [self.mine[0].id, self.theirs.id])
+        self.assertEqual(response.json()['deleted'], 2)
+        self.assertEqual(self.usage(self.other), (0, 0))
+
+    def test_usage_is_released(self):
+        self.delete(self.client, [self.mine[0].id, self.mine[2].id, self.theirs.id])
+        self.assertEqual(self.usage(self.owner), (20, 1))
+        self.assertEqual(self.usage(self.other), (40, 1))
+
+    def test_blobs_are_queued_for_deletion(self):
+        first, second, kept = self.mine
+        self.delete(self.client, [first.id, second.id])
+
+        job = Job.objects.get(name='delete_blobs')
+        self.assertEqual(sorted(job.payload['stored_filenames']),
+                         sorted([first.stored_filename, second.stored_filename]))
+        # Blobs stay until the job runs
+        self.assertTrue(self.blob_exists(first))
+
+        jobs.run_job(job.id)
+        self.assertFalse(self.blob_exists(first))
+        self.assertFalse(self.blob_exists(second))
+        self.assertTrue(self.blob_exists(kept))
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_blobs_are_removed_after_commit_when_inline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.delete(self.client, [self.mine[0].id])
+        self.assertFalse(self.blob_exists(self.mine[0]))
+        self.assertEqual(Job.objects.get(name='delete_blobs').status, 'done')
+
+    def test_malformed_ids(self):
+        for body in ({'file_ids': ['a']}, {'file_ids': []}, {'file_ids': 5}):
+            response = self.client.post('/api/delete/batch/', json.dumps(body),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        self.assertEqual(EncryptedFile.objects.count(), 4)
+
+
+class ArchiveDownloadTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.other = self.make_user('other')
+        self.plaintexts = {}
+        self.mine = [self.stored(self.owner, name) for name in ('a.txt', 'b.txt')]
+        self.theirs = self.stored(self.other, 'c.txt')
+
+    def stored(self, user, name):
+        data = os.urandom(1000)
+        db_file = self.store_file(user, data, name=name)
+        self.plaintexts[db_file.id] = data
+        return db_file
+
+    def download(self, user, file_ids):
+        return self.client_for(user).post(
+            '/api/download/archive/', json.dumps({'file_ids': file_ids}),
+            content_type='application/json')
+
+    def test_archive_is_a_valid_zip(self):
+        UserPermissions.objects.create(file_id=self.theirs.id, file_user_id=self.other.id,
+                                       file_assigned_id=self.owner.id)
+        file_ids = [db_file.id for db_file in self.mine] + [self.theirs.id]
+        response = self.download(self.owner, file_ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual([entry['file_id'] for entry in manifest['files']], file_ids)
+        for entry in manifest['files']:
+            key, iv, tag = (base64.b64decode(entry[name]) for name in ('key', 'iv', 'authTag'))
+            plaintext = AESGCM(key).decrypt(iv, archive.read(entry['path']) + tag, None)
+            self.assertEqual(plaintext, self.plaintexts[entry['file_id']])
+
+    def test_files_the_caller_cannot_see_are_refused(self):
+        response = self.download(self.owner, [self.mine[0].id, self.theirs.id, 9999])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['file_ids'], [self.theirs.id, 9999])
+
+    def test_admin_may_download_any_file(self):
+        admin = self.make_user('admin', role='admin')
+        response = self.download(admin, [self.theirs.id])
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(len(archive.namelist()), 2)
+
+    def test_missing_blob(self):
+        os.remove(encrypted_storage.path(self.mine[1].stored_filename))
+        response = self.download(self.owner, [db_file.id for db_file in self.mine])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['file_ids'], [self.mine[1].id])
+
+
+class SearchTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+        self.other = self.make_user('other')
+        self.client = self.client_for(self.owner)
+        self.names = {}
+        for user, name in ((self.owner, 'Quarterly Report.pdf'),
+                           (self.owner, 'ab notes.txt'),
+                           (self.owner, 'holiday.jpg'),
+                           (self.other, 'report draft.docx'),
+                           (self.other, 'ab secret.txt'),
+                           (self.other, 'shared report.xlsx')):
+            self.names[name] = EncryptedFile.objects.create(
+                original_filename=name, stored_filename=encrypted_storage.generate_name(),
+                file_size=1, encryption_iv=os.urandom(12), user_id=user.id).id
+        UserPermissions.objects.create(
+            file_id=self.names['shared report.xlsx'], file_user_id=self.other.id,
+            file_assigned_id=self.owner.id)
+
+    def search(self, q, **params):
+        response = self.client.get('/api/files/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(f['filename'] for f in response.json()['files'])
+
+    def search_both_ways(self, q, **params):
+        """Results from the recent-files scan and from the index must agree"""
+        scanned = self.search(q, **params)
+        with mock.patch.object(search, 'SEARCH_SCAN_ROWS', 1):
+            indexed = self.search(q, **params)
+        self.assertEqual(scanned, indexed)
+        return scanned
+
+    def test_only_visible_files_match(self):
+        self.assertEqual(self.search_both_ways('report'),
+                         ['Quarterly Report.pdf', 'shared report.xlsx'])
+        self.assertEqual(self.search_both_ways('report', scope='owned'),
+                         ['Quarterly Report.pdf'])
+        self.assertEqual(self.search_both_ways('report', scope='shared'),
+                         ['shared report.xlsx'])
+        self.assertEqual(self.search_both_ways('secret'), [])
+
+    def test_short_terms_skip_the_index(self):
+        self.assertEqual(search.index_filter('ab', 'tokens'), Q())
+        self.assertNotEqual(search.index_filter('abc', 'tokens'), Q())
+        self.assertEqual(self.search_both_ways('ab'), ['ab notes.txt'])
+        self.assertEqual(self.search_both_ways('ab not'), ['ab notes.txt'])
+
+    def test_trigram_terms(self):
+        self.assertEqual(self.search_both_ways('QUARTERLY rep'), ['Quarterly Report.pdf'])
+        self.assertEqual(self.search_both_ways('uarterly'), ['Quarterly Report.pdf'])
+
+    def test_modes(self):
+        self.assertEqual(self.search_both_ways('report quarterly', mode='tokens'),
+                         ['Quarterly Report.pdf'])
+        self.assertEqual(self.search_both_ways('report quarterly', mode='substring'), [])
+        self.assertEqual(self.search_both_ways('y rep', mode='substring'),
+                         ['Quarterly Report.pdf'])
+        self.assertEqual(self.search_both_ways('quar', mode='prefix'),
+                         ['Quarterly Report.pdf'])
+        self.assertEqual(self.search_both_ways('report', mode='prefix'), [])
+
+    def test_index_follows_renames(self):
+        EncryptedFile.objects.filter(id=self.names['holiday.jpg']).update(
+            original_filename='beach report.jpg')
+        with mock.patch.object(search, 'SEARCH_SCAN_ROWS', 1):
+            self.assertEqual(self.search('beach'), ['beach report.jpg'])
+            self.assertEqual(self.search('holiday'), [])
+
+    def test_invalid_requests(self):
+        for params in ({'q': ' '}, {'q': 'x', 'mode': 'regex'}):
+            response = self.client.get('/api/files/search/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class UserDirectoryTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        names = ['bob', 'Alice', 'alan', 'Carol', 'alice', 'Dave', 'sal']
+        self.users = [self.make_user(name) for name in names]
+        self.client = self.client_for(self.users[0])
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_cursor_walks_every_user_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            page = self.get('/api/users/', **params)
+            seen.extend((user['name'], user['id']) for user in page['users'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        expected = sorted(((u.name, u.id) for u in self.users),
+                          key=lambda user: (user[0].lower(), user[1]))
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_is_rejected(self):
+        def encode(raw):
+            return base64.urlsafe_b64encode(raw.encode()).decode()
+
+        for cursor in ('not base64!', encode('not json'), encode('5'), encode('{}'),
+                       encode('["alice"]'), encode('[1, 2]'), encode('["alice", "x"]'),
+                       encode('["alice", null]')):
+            response = self.client.get('/api/users/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'error': 'Invalid cursor'})
+
+    def test_prefix_matches_name_or_email_ignoring_case(self):
+        names = [user['name'] for user in self.get('/api/users/', q='AL')['users']]
+        self.assertEqual(names, ['alan', 'Alice', 'alice'])
+        names = [user['name'] for user in self.get('/api/users/', q='dave@')['users']]
+        self.assertEqual(names, ['Dave'])
+        self.assertEqual(self.get('/api/users/', q='zz')['users'], [])
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get('/api/users/')
+        again = self.client.get('/api/users/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        User.objects.filter(id=self.users[1].id).update(name='Alicia')
+        changed = self.client.get('/api/users/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+    def test_lookup_by_id(self):
+        ids = f'{self.users[3].id},{self.users[1].id},9999'
+        users = self.get('/api/users/lookup/', ids=ids)['users']
+        self.assertEqual([user['id'] for user in users],
+                         sorted([self.users[1].id, self.users[3].id]))
+        response = self.client.get('/api/users/lookup/', {'ids': '1,x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AuthCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AuthCache(max_entries=2, ttl=30)
+        self.user = SimpleNamespace(id=1)
+        self.far = time.time() + 3600
+
+    def at(self, seconds):
+        return mock.patch.object(decorators.time, 'monotonic', return_value=seconds)
+
+    def test_entries_expire_after_ttl(self):
+        with self.at(1000):
+            self.cache.set('token', self.user, self.far)
+        with self.at(1029):
+            self.assertIs(self.cache.get('token'), self.user)
+        with self.at(1030):
+            self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_entries_expire_with_their_token(self):
+        with self.at(1000):
+            self.cache.set('token', self.user, time.time() + 5)
+        with self.at(1006):
+            self.assertIsNone(self.cache.get('token'))
+
+    def test_least_recently_used_is_evicted(self):
+        for token in ('a', 'b'):
+            self.cache.set(token, self.user, self.far)
+        self.cache.get('a')
+        self.cache.set('c', self.user, self.far)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_invalidate_user(self):
+        self.cache.set('a', self.user, self.far)
+        self.cache.set('b', SimpleNamespace(id=2), self.far)
+        self.cache.invalidate_user(1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+
+
+class AuthCacheInvalidationTests(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.make_user('admin', role='admin')
+        self.client = self.client_for(self.admin)
+
+    def stats(self):
+        return self.client.get('/api/stats/auth-cache/')
+
+    def test_repeat_requests_are_served_from_the_cache(self):
+        self.stats()
+        with self.assertNumQueries(0):
+            response = self.stats()
+        self.assertEqual(response.json()['hits'], 1)
+
+    def test_saving_the_user_evicts_it(self):
+        self.assertEqual(self.stats().status_code, 200)
+        self.admin.role = 'user'
+        self.admin.save()
+        self.assertEqual(self.stats().status_code, 403)
+
+    def test_deleting_the_user_evicts_it(self):
+        self.assertEqual(self.stats().status_code, 200)
+        self.admin.delete()
+        self.assertEqual(self.stats().status_code, 401)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.enterContext(mock.patch.dict(jobs.TASKS, {
+            'record': lambda **payload: self.calls.append(payload),
+            'explode': self.explode,
+        }))
+
+    def explode(self, **payload):
+        raise RuntimeError('boom')
+
+    def expire_lock(self, job_id):
+        Job.objects.filter(id=job_id).update(
+            locked_until=django_timezone.now() - timedelta(seconds=1))
+
+    def test_claimed_jobs_are_invisible_to_other_workers(self):
+        first = jobs.enqueue('record', {'n': 1})
+        second = jobs.enqueue('record', {'n': 2})
+        jobs.enqueue('record', {'n': 3}, delay_seconds=60)
+
+        self.assertEqual(jobs.claim_jobs(10, 60), [first.id, second.id])
+        self.assertEqual(jobs.claim_jobs(10, 60), [])
+        job = Job.objects.get(id=first.id)
+        self.assertEqual((job.status, job.attempts), ('running', 1))
+
+    def test_expired_claim_is_retried(self):
+        job = jobs.enqueue('record', max_attempts=2)
+        jobs.claim_jobs(10, 60)
+        self.expire_lock(job.id)
+
+        self.assertEqual(jobs.claim_jobs(10, 60), [job.id])
+        self.assertEqual(Job.objects.get(id=job.id).attempts, 2)
+
+        # Out of attempts: not claimed again, and given up on
+        self.expire_lock(job.id)
+        self.assertEqual(jobs.claim_jobs(10, 60), [])
+        self.assertEqual(jobs.fail_expired_jobs(), 1)
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.last_error, 'Visibility timeout exceeded')
+
+    def test_success(self):
+        job = jobs.enqueue('record', {'n': 1})
+        jobs.claim_jobs(10, 60)
+        self.assertTrue(jobs.run_job(job.id))
+        self.assertEqual(self.calls, [{'n': 1}])
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, 'done')
+        self.assertIsNone(job.locked_until)
+
+    @override_settings(JOBS_RETRY_BASE_DELAY=5)
+    def test_failures_are_retried_with_backoff(self):
+        job = jobs.enqueue('explode', max_attempts=2)
+        jobs.claim_jobs(10, 60)
+        self.assertFalse(jobs.run_job(job.id))
+
+        job = Job.objects.get(id=job.id)
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertGreater(job.run_after, django_timezone.now() + timedelta(seconds=9))
+        self.assertEqual(jobs.claim_jobs(10, 60), [])
+
+        Job.objects.filter(id=job.id).update(run_after=django_timezone.now())
+        self.assertEqual(jobs.claim_jobs(10, 60), [job.id])
+        self.assertFalse(jobs.run_job(job.id))
+        self.assertEqual(Job.objects.get(id=job.id).status, 'failed')
+
+    @override_settings(JOBS_RUN_INLINE=True)
+    def test_inline_jobs_wait_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = jobs.enqueue('record', {'n': 1})
+        self.assertEqual(self.calls, [])
+        self.assertEqual(Job.objects.get(id=job.id).status, 'queued')
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertEqual(Job.objects.get(id=job.id).status, 'done')
+
+    def test_unknown_task_is_refused(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('no_such_task')
+
+
+class BrokenStream(io.BytesIO):
+    """Request body whose connection drops once its bytes are read"""
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if not data:
+            raise OSError('Connection reset by peer')
+        return data
+
+
+class UploadHandlerTests(StorageTestCase):
+    BOUNDARY = 'BoUnDaRy'
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('owner')
+
+    def multipart(self, data):
+        """A form with key material and a file part that is never closed"""
+        fields = ''.join(
+            f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"'
+            f'\r\n\r\n{value}\r\n'
+            for name, value in self.key_material().items())
+        return (fields.encode() + (
+            f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="big.bin"\r\nContent-Type: application/octet-stream\r\n\r\n'
+        ).encode() + data)
+
+    def leftovers(self):
+        return [name for name in self.stored_blobs() if name.endswith('.uploading')]
+
+    def test_truncated_body_leaves_nothing(self):
+        response = self.client_for(self.owner).generic(
+            'POST', '/api/upload/', self.multipart(os.urandom(200 * 1024)),
+            content_type=f'multipart/form-data; boundary={self.BOUNDARY}')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_blobs(), [])
+
+    def test_dropped_connection_leaves_nothing(self):
+        body = self.multipart(os.urandom(200 * 1024))
+        factory = RequestFactory()
+        factory.cookies['jwt_token'] = views.generate_jwt_token(self.owner)
+        request = factory.generic(
+            'POST', '/api/upload/', body,
+            content_type=f'multipart/form-data; boundary={self.BOUNDARY}',
+            CONTENT_LENGTH=str(len(body) + 1024))
+        request._stream = BrokenStream(body)
+
+        response = views.upload_file(request)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.leftovers(), [])
+        self.assertEqual(self.stored_blobs(), [])
+
+    def test_rejected_upload_leaves_nothing(self):
+        response = self.client_for(self.owner).post('/api/upload/', {
+            'file': SimpleUploadedFile('a.bin', b'x' * 100),
+            'key': 'short', 'iv': 'short'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.stored_blobs(), [])
+
+    def test_completed_upload_is_renamed_into_place(self):
+        response = self.upload(self.client_for(self.owner), b'x' * 100)
+        db_file = EncryptedFile.objects.get(id=response.json()['file_id'])
+        self.assertEqual(self.leftovers(), [])
+        with open(encrypted_storage.path(db_file.stored_filename), 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+
+class KeyMaterialTests(SimpleTestCase):
+    def test_base64_and_byte_list(self):
+        iv = os.urandom(12)
+        self.assertEqual(parse_key_material(base64.b64encode(iv).decode(), 12), iv)
+        self.assertEqual(parse_key_material(str(list(iv)), 12), iv)
+        self.assertIsNone(parse_key_material(None, 12))
+
+    def test_wrong_length(self):
+        with self.assertRaises(ValueError):
+            parse_key_material(base64.b64encode(os.urandom(16)).decode(), 32)
+        with self.assertRaises(ValueError):
+            parse_key_material(str(list(os.urandom(11))), 12)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from .storage import encrypted_storage
+
+
+class StoredUpload(UploadedFile):
+    """
+    An uploaded file already written into blob storage under a temporary
+    name. ``commit()`` renames it to its final path; if the request ends
+    without a commit the temporary file is removed.
+    """
+
+    def __init__(self, stored_filename, temp_path, sha256, name, content_type,
+                 size, charset, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset,
+                         content_type_extra)
+        self.stored_filename = stored_filename
+        self.temp_path = temp_path
+        self.sha256 = sha256
+        self.committed = False
+
+    def commit(self):
+        os.replace(self.temp_path, encrypted_storage.path(self.stored_filename))
+        self.committed = True
+
+    def close(self):
+        # Called by Django for every uploaded file when the request ends
+        if not self.committed:
+            try:
+                os.remove(self.temp_path)
+            except FileNotFoundError:
+                pass
+
+
+class StorageUploadHandler(FileUploadHandler):
+    """
+    Stream uploaded files straight into their sharded blob location.
+
+    Django's default handlers spool large files to a temp file that the
+    view then copies into storage, writing every byte twice. This handler
+    writes each chunk once, next to its final path, hashing and counting
+    as it goes. Interrupted uploads leave nothing behind.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.stored_filename = encrypted_storage.generate_name()
+        self.temp_path = f"{encrypted_storage.prepare_path(self.stored_filename)}.uploading"
+        self.destination = open(self.temp_path, 'wb')
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.destination.write(raw_data)
+        self.digest.update(raw_data)
+        self.size += len(raw_data)
+
+    def file_complete(self, file_size):
+        self.destination.close()
+        self.destination = None
+        return StoredUpload(
+            stored_filename=self.stored_filename,
+            temp_path=self.temp_path,
+            sha256=self.digest.hexdigest(),
+            name=self.file_name,
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def discard(self):
+        """Remove a file that was still being written"""
+        destination = getattr(self, 'destination', None)
+        if destination is None:
+            return
+        destination.close()
+        self.destination = None
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
@@ -1,21 +1,47 @@
+from django.conf import settings
 from django.urls import path
 from .views import deleteUser, updateUser, generate_share_link, access, upload_file, list_files, download_file, delete_file, register_user, login_user, list_users, upload_permissions, list_permission
 from .views import login_user, totp_setup, totp_verify
+from .views import create_upload_session, upload_session, upload_part, commit_upload_session
+from .views import auth_cache_stats, bulk_upload_permissions, preview_file, job_queue_stats, metrics, delete_files, download_archive
+from .views import storage_usage_stats, search_files, lookup_users
+
+if settings.ASYNC_VIEWS:
+    from .async_views import download_file_async as download_file
+    from .async_views import upload_part_async as upload_part
+    from .async_views import access_async as access
 
 urlpatterns = [
     path('upload/', upload_file, name='upload_file'),
+    path('uploads/', create_upload_session, name='create_upload_session'),
+    path('uploads/<str:upload_id>/', upload_session, name='upload_session'),
+    path('uploads/<str:upload_id>/parts/<int:part_number>/',
+         upload_part, name='upload_part'),
+    path('uploads/<str:upload_id>/commit/',
+         commit_upload_session, name='commit_upload_session'),
     path('files/<int:user_id>/', list_files, name='list_files'),
+    path('files/search/', search_files, name='search_files'),
     path('download/<int:file_id>/', download_file, name='download_file'),
+    path('download/archive/', download_archive, name='download_archive'),
+    path('preview/<int:file_id>/', preview_file, name='preview_file'),
     path('delete/<int:file_id>/', delete_file, name='delete_file'),
+    path('delete/batch/', delete_files, name='delete_files'),
     path('register/', register_user, name='register_user'),
     path('login/', login_user, name='login_user'),
     path('totp/setup/', totp_setup, name='totp_setup'),
     path('totp/verify/', totp_verify, name='totp_verify'),
     path('users/', list_users, name='list_users'),
+    path('users/lookup/', lookup_users, name='lookup_users'),
     path('uploadpermissions/', upload_permissions, name='upload_permissions'),
+    path('uploadpermissions/batch/', bulk_upload_permissions,
+         name='bulk_upload_permissions'),
     path('permissions/<int:file_id>/', list_permission, name='list_permission'),
     path('generate/', generate_share_link, name='generate_share_link'),
     path('access/<str:share_token>/', access, name='access'),
     path('updateUser/', updateUser, name='updateUser'),
-    path('deleteUser/<int:userid>/', deleteUser, name='deleteUser')
+    path('deleteUser/<int:userid>/', deleteUser, name='deleteUser'),
+    path('stats/auth-cache/', auth_cache_stats, name='auth_cache_stats'),
+    path('stats/jobs/', job_queue_stats, name='job_queue_stats'),
+    path('stats/usage/', storage_usage_stats, name='storage_usage_stats'),
+    path('metrics/', metrics, name='metrics'),
 ]
@@ -0,0 +1,61 @@
+"""
+Per-user storage counters (StorageUsage) and quota enforcement.
+
+Counters change through F() expressions in the same transaction as the
+file rows they describe, so checking a quota never sums EncryptedFile.
+``manage.py reconcile_usage`` repairs any drift.
+"""
+from django.conf import settings
+from django.db.models import F, Q
+
+from .models import StorageUsage
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def effective_quota(usage):
+    """The quota in bytes that applies to a StorageUsage row, or None"""
+    if usage is not None and usage.quota_bytes is not None:
+        return usage.quota_bytes
+    return settings.STORAGE_QUOTA_BYTES
+
+
+def remaining_quota(user_id):
+    """Bytes the user may still store, or None if unlimited"""
+    usage = StorageUsage.objects.filter(user_id=user_id).first()
+    quota = effective_quota(usage)
+    if quota is None:
+        return None
+    return max(quota - (usage.bytes_used if usage else 0), 0)
+
+
+def charge_storage(user_id, size):
+    """
+    Count a new file of ``size`` bytes against the user.
+
+    The quota check and the increment are one conditional UPDATE, so
+    concurrent uploads can't overshoot. Raises QuotaExceeded instead of
+    counting a file that doesn't fit; call it inside the transaction that
+    creates the file row.
+    """
+    StorageUsage.objects.get_or_create(user_id=user_id)
+
+    fits = Q(quota_bytes__isnull=False, bytes_used__lte=F('quota_bytes') - size)
+    if settings.STORAGE_QUOTA_BYTES is None:
+        fits |= Q(quota_bytes__isnull=True)
+    else:
+        fits |= Q(quota_bytes__isnull=True,
+                  bytes_used__lte=settings.STORAGE_QUOTA_BYTES - size)
+
+    charged = StorageUsage.objects.filter(fits, user_id=user_id).update(
+        bytes_used=F('bytes_used') + size, file_count=F('file_count') + 1)
+    if not charged:
+        raise QuotaExceeded()
+
+
+def release_storage(user_id, size, count=1):
+    """Take deleted files off the user's totals"""
+    StorageUsage.objects.filter(user_id=user_id).update(
+        bytes_used=F('bytes_used') - size, file_count=F('file_count') - count)
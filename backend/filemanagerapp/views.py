@@ -1,31 +1,113 @@
 import os
 import uuid
 import json
-from django.http import JsonResponse, FileResponse
+import shutil
+import re
+import secrets
+import hashlib
+import string
+import sys
+from cryptography.exceptions import InvalidTag
+from django.http import JsonResponse, FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_etags, quote_etag
+from urllib.parse import quote
 from django.views.decorators.csrf import csrf_exempt
-from django.core.files.storage import FileSystemStorage
 from django.conf import settings
-from .models import TOTPDevice, EncryptedFile, UserPermissions, User, ShareableLink
-from django.db.models import Q
+from django.core.cache import cache
+from .models import TOTPDevice, EncryptedFile, UserPermissions, User, ShareableLink, UploadSession, StorageUsage
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Collate, Lower
+from django.utils import timezone as django_timezone
 import base64
-from filemanagerapp.Util import decrypt_file, import_key, format_bytes
+from filemanagerapp.Util import decrypt_file, decrypt_file_stream, import_key, format_bytes, merge_ranges, parse_range_header, read_file_range
+from filemanagerapp.Util import parse_key_material, encode_key_material, aiterate
+from filemanagerapp.Util import IV_SIZE, KEY_SIZE, TAG_SIZE
 import pyotp
 import qrcode
 import io
 import jwt
 from datetime import datetime, timedelta, timezone
 from django.conf import settings
-from .decorators import jwt_token_required
-
-# Ensure uploads directory exists
-UPLOAD_ROOT = os.path.join(settings.BASE_DIR, 'uploads')
-os.makedirs(UPLOAD_ROOT, exist_ok=True)
-os.chmod(UPLOAD_ROOT, 0o755)
-
-
-class EncryptedFileStorage(FileSystemStorage):
-    def __init__(self, location=UPLOAD_ROOT, *args, **kwargs):
-        super().__init__(location=location, *args, **kwargs)
+from .decorators import jwt_token_required, auth_cache
+from .storage import UPLOAD_ROOT, encrypted_storage
+from .tasks import build_preview, delete_blobs
+from .archives import archive_stream
+from .upload_handlers import StorageUploadHandler
+from .jobs import queue_stats
+from .metrics import export as export_metrics
+from .search import SEARCH_MODES, search_rows
+from .segmented import (
+    FORMAT_SEGMENTED, FORMAT_SINGLE_STREAM, FORMAT_VERSIONS, InvalidContainer,
+    SegmentedReader, read_container_header, segmented_stream
+)
+from .usage import QuotaExceeded, charge_storage, effective_quota, release_storage, remaining_quota
+
+# Parts of resumable uploads are staged here, on the same filesystem as
+# UPLOAD_ROOT so the assembled file can be renamed into place
+UPLOAD_PARTS_ROOT = os.path.join(UPLOAD_ROOT, '.parts')
+os.makedirs(UPLOAD_PARTS_ROOT, exist_ok=True)
+
+# Share tokens are 32 lowercase hex characters
+SHARE_TOKEN_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Page sizes for list_files
+LIST_FILES_PAGE_SIZE = 100
+LIST_FILES_MAX_PAGE_SIZE = 500
+LIST_FILES_COLUMNS = ('id', 'original_filename', 'uploaded_at',
+                      'file_size', 'file_type', 'user_id', 'preview_type')
+LIST_FILES_ORDERING = ('-uploaded_at', '-id')
+
+# Longest query search_files accepts
+MAX_SEARCH_QUERY_LENGTH = 255
+
+# User directory pages, ordered by name
+USER_DIRECTORY_PAGE_SIZE = 50
+USER_DIRECTORY_MAX_PAGE_SIZE = 200
+USER_DIRECTORY_COLUMNS = ('id', 'name', 'email', 'role')
+# Most user ids resolved by one lookup_users request
+MAX_USER_LOOKUP = 200
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Requests asking for more byte ranges than this get the full file
+MAX_DOWNLOAD_RANGES = 16
+
+# Most file ids accepted by one batch delete request
+MAX_BATCH_DELETE = 1000
+
+# Most files in one archive download
+MAX_ARCHIVE_FILES = 5000
+
+# Allowance for the multipart framing and key fields that share an upload
+# body with the file, when judging the file's size from Content-Length
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
+# Block size used when streaming request bodies and parts to disk
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def quota_exceeded_response(user_id):
+    usage = StorageUsage.objects.filter(user_id=user_id).first()
+    return JsonResponse({
+        'error': 'Storage quota exceeded',
+        'bytes_used': usage.bytes_used if usage else 0,
+        'quota_bytes': (usage.quota_bytes if usage and usage.quota_bytes is not None
+                        else settings.STORAGE_QUOTA_BYTES)
+    }, status=413)
+
+
+def exceeds_quota(user_id, size):
+    """True if storing ``size`` more bytes would take the user over quota"""
+    remaining = remaining_quota(user_id)
+    return remaining is not None and size > remaining
+
+
+def parse_format_version(value):
+    """Container format a client says it uploaded; 1 if not given"""
+    version = int(value or FORMAT_SINGLE_STREAM)
+    if version not in FORMAT_VERSIONS:
+        raise ValueError(f'Unknown format_version {version}')
+    return version
 
 
 def get_file_type(filename):
@@ -47,13 +129,32 @@ def get_file_type(filename):
 @csrf_exempt
 @jwt_token_required
 def upload_file(request):
-    """Handle encrypted file upload"""
+    """
+    Handle encrypted file upload.
+
+    The file part of the body is streamed straight into blob storage by
+    StorageUploadHandler and only renamed into place once its record has
+    been created. Uploads that can't fit in the user's quota are refused
+    from Content-Length before any of the body is read.
+
+    The file belongs to, and is charged to, the signed-in user; the
+    ``user_id`` form field the client sends is ignored, as in
+    create_upload_session.
+    """
     if request.method == 'POST':
+        user_id = request.user.id
         try:
-            user_id = request.POST.get('user_id')
-
-            if User.objects.get(id=user_id).role == "guest":
-                return JsonResponse({'error': 'Not allowed to upload'})
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid Content-Length'}, status=400)
+        if exceeds_quota(user_id, content_length - UPLOAD_FORM_OVERHEAD):
+            return quota_exceeded_response(user_id)
+
+        upload_handler = StorageUploadHandler(request)
+        request.upload_handlers = [upload_handler]
+        try:
+            if request.user.role == "guest":
+                return JsonResponse({'error': 'Not allowed to upload'}, status=403)
 
             # Get uploaded file
             uploaded_file = request.FILES.get('file')
@@ -69,101 +170,883 @@ def upload_file(request):
             if not encryption_iv or not encryption_key:
                 return JsonResponse({'error': 'Encryption details missing'}, status=400)
 
-            # Generate unique filename
-            unique_filename = f"{uuid.uuid4()}_{uploaded_file.name}"
+            try:
+                encryption_iv = parse_key_material(encryption_iv, IV_SIZE)
+                encryption_key = parse_key_material(encryption_key, KEY_SIZE)
+                authTag = parse_key_material(authTag, TAG_SIZE)
+            except (ValueError, TypeError) as e:
+                return JsonResponse({'error': f"Invalid encryption details: {e}"}, status=400)
+
+            try:
+                format_version = parse_format_version(request.POST.get('format_version'))
+                if format_version == FORMAT_SEGMENTED:
+                    read_container_header(uploaded_file.temp_path)
+            except ValueError as e:
+                # InvalidContainer is a ValueError too
+                return JsonResponse({'error': str(e)}, status=400)
 
             # Determine file type
             file_type = get_file_type(uploaded_file.name)
 
-            # Save encrypted file to specific upload directory
-            file_path = os.path.join(UPLOAD_ROOT, unique_filename)
-            with open(file_path, 'wb') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
-
-            # Create database record
-            encrypted_file = EncryptedFile.objects.create(
-                original_filename=uploaded_file.name,
-                stored_filename=unique_filename,
-                file_size=uploaded_file.size,
-                encryption_iv=encryption_iv,
-                file_type=file_type,
-                user_id=int(user_id),
-                encryption_key=encryption_key,
-                authTag=authTag
-            )
+            # Charge the quota, create the database record and move the blob
+            # into place together; if any step fails all are rolled back
+            with transaction.atomic():
+                charge_storage(user_id, uploaded_file.size)
+                encrypted_file = EncryptedFile.objects.create(
+                    original_filename=uploaded_file.name,
+                    stored_filename=uploaded_file.stored_filename,
+                    file_size=uploaded_file.size,
+                    encryption_iv=encryption_iv,
+                    file_type=file_type,
+                    user_id=user_id,
+                    encryption_key=encryption_key,
+                    authTag=authTag,
+                    sha256=uploaded_file.sha256,
+                    format_version=format_version
+                )
+                uploaded_file.commit()
+            build_preview.delay(file_id=encrypted_file.id)
 
             return JsonResponse({
                 'message': 'Encrypted file uploaded successfully',
                 'filename': uploaded_file.name,
                 'file_id': encrypted_file.id,
-                'file_type': file_type
+                'file_type': file_type,
+                'format_version': format_version,
+                'sha256': uploaded_file.sha256
             }, status=200)
 
+        except QuotaExceeded:
+            return quota_exceeded_response(user_id)
         except Exception as e:
             print(e)
+            # A body that failed part way leaves a half-written file
+            upload_handler.discard()
             return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def upload_session_dir(upload_id):
+    """Directory holding the staged parts of an upload session"""
+    return os.path.join(UPLOAD_PARTS_ROOT, upload_id)
+
+
+def list_upload_parts(upload_id):
+    """Return {part_number: size} for every part that has fully arrived"""
+    parts = {}
+    session_dir = upload_session_dir(upload_id)
+    if not os.path.isdir(session_dir):
+        return parts
+    with os.scandir(session_dir) as entries:
+        for entry in entries:
+            if entry.name.isdigit():
+                parts[int(entry.name)] = entry.stat().st_size
+    return parts
+
+
+def purge_expired_upload_sessions():
+    """Delete expired upload sessions and their staged parts"""
+    expired = UploadSession.objects.filter(expires_at__lte=django_timezone.now())
+    upload_ids = list(expired.values_list('upload_id', flat=True))
+    for upload_id in upload_ids:
+        shutil.rmtree(upload_session_dir(upload_id), ignore_errors=True)
+    UploadSession.objects.filter(upload_id__in=upload_ids).delete()
+    return len(upload_ids)
+
+
+def get_upload_session(request, upload_id):
+    """Fetch an open, unexpired session owned by the requesting user"""
+    session = UploadSession.objects.filter(
+        upload_id=upload_id, user_id=request.user.id).first()
+    if session is None or not session.is_valid():
+        return None
+    return session
+
+
 @csrf_exempt
 @jwt_token_required
-def list_files(request, user_id):
-    """List all uploaded files along with those from UserPermissions"""
-    try:
-        user_files = EncryptedFile.objects.filter(
-            Q(user_id=int(user_id)) | Q(id__in=UserPermissions.objects.filter(
-                file_assigned_id=int(user_id)).values('file_id'))
-        ).distinct()
+def create_upload_session(request):
+    """Start a resumable upload and return its upload_id"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+
+            if request.user.role == "guest":
+                return JsonResponse({'error': 'Not allowed to upload'}, status=403)
+
+            filename = data.get('filename')
+            if not filename:
+                return JsonResponse({'error': 'Filename missing'}, status=400)
+
+            try:
+                file_size = int(data.get('file_size') or 0)
+            except (TypeError, ValueError):
+                return JsonResponse({'error': 'Invalid file size'}, status=400)
+            if file_size < 0:
+                return JsonResponse({'error': 'Invalid file size'}, status=400)
+
+            # Clients that announce the size are turned away before
+            # uploading any parts; the commit enforces the quota regardless
+            if exceeds_quota(request.user.id, file_size):
+                return quota_exceeded_response(request.user.id)
+
+            # Opportunistically clear out abandoned sessions
+            purge_expired_upload_sessions()
+
+            session = UploadSession.objects.create(
+                user_id=request.user.id,
+                original_filename=os.path.basename(filename),
+                encryption_iv=data.get('iv'),
+                encryption_key=data.get('key'),
+                authTag=data.get('authTag')
+            )
+            os.makedirs(upload_session_dir(session.upload_id), exist_ok=True)
 
+            return JsonResponse({
+                'upload_id': session.upload_id,
+                'expires_at': session.expires_at,
+                'max_part_size': settings.UPLOAD_PART_MAX_BYTES
+            }, status=201)
+
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+@csrf_exempt
+@jwt_token_required
+def upload_session(request, upload_id):
+    """Report which parts have arrived (GET) or abort the session (DELETE)"""
+    session = get_upload_session(request, upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+
+    if request.method == 'GET':
+        parts = list_upload_parts(upload_id)
         return JsonResponse({
-            'files': [
-                {
-                    'id': file.id,
-                    'filename': file.original_filename,
-                    'uploaded_at': file.uploaded_at.isoformat(),
-                    'size': file.file_size,
-                    'file_type': file.file_type,
-                    'user_id': file.user_id
-                } for file in user_files
+            'upload_id': session.upload_id,
+            'filename': session.original_filename,
+            'status': session.status,
+            'expires_at': session.expires_at,
+            'parts': [
+                {'part_number': number, 'size': parts[number]}
+                for number in sorted(parts)
             ]
         }, status=200)
+
+    if request.method == 'DELETE':
+        shutil.rmtree(upload_session_dir(upload_id), ignore_errors=True)
+        session.delete()
+        return JsonResponse({'message': 'Upload session aborted'}, status=200)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+def check_upload_part(request, session, part_number):
+    """Return an error response if this part may not be stored, else None"""
+    if session is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+    if session.status != 'open':
+        return JsonResponse({'error': 'Upload session is being committed'}, status=409)
+    if part_number < 1:
+        return JsonResponse({'error': 'Part numbers start at 1'}, status=400)
+
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Content-Length'}, status=400)
+    if content_length > settings.UPLOAD_PART_MAX_BYTES:
+        return JsonResponse({'error': 'Part too large'}, status=413)
+    return None
+
+
+def store_upload_part(request, upload_id, part_number):
+    """
+    Stream the request body into the part file and return its size.
+
+    Raises ValueError if the body exceeds UPLOAD_PART_MAX_BYTES. Nothing is
+    left behind on failure.
+    """
+    session_dir = upload_session_dir(upload_id)
+    part_path = os.path.join(session_dir, str(part_number))
+    temp_path = f"{part_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(session_dir, exist_ok=True)
+        size = 0
+        with open(temp_path, 'wb') as destination:
+            while True:
+                chunk = request.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > settings.UPLOAD_PART_MAX_BYTES:
+                    raise ValueError('Part too large')
+                destination.write(chunk)
+        os.replace(temp_path, part_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return size
+
+
+@csrf_exempt
+@jwt_token_required
+def upload_part(request, upload_id, part_number):
+    """
+    Store one numbered part of an upload session.
+
+    The body is the raw part. It is streamed to a temporary file and renamed
+    into place, so a retried PUT simply replaces the earlier copy and parts
+    can arrive in any order or in parallel.
+    """
+    if request.method != 'PUT':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    session = get_upload_session(request, upload_id)
+    error = check_upload_part(request, session, part_number)
+    if error is not None:
+        return error
+
+    try:
+        size = store_upload_part(request, upload_id, part_number)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=413)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+    session.touch()
+
+    return JsonResponse({
+        'upload_id': upload_id,
+        'part_number': part_number,
+        'size': size
+    }, status=200)
+
+
+@csrf_exempt
+@jwt_token_required
+def commit_upload_session(request, upload_id):
+    """Assemble the staged parts into UPLOAD_ROOT and create the file record"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    session = get_upload_session(request, upload_id)
+    if session is None:
+        return JsonResponse({'error': 'Upload session not found'}, status=404)
+
+    try:
+        data = json.loads(request.body) if request.body else {}
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
+
+    encryption_iv = data.get('iv') or session.encryption_iv
+    encryption_key = data.get('key') or session.encryption_key
+    authTag = data.get('authTag') or session.authTag
+    if not encryption_iv or not encryption_key:
+        return JsonResponse({'error': 'Encryption details missing'}, status=400)
+
+    try:
+        encryption_iv = parse_key_material(encryption_iv, IV_SIZE)
+        encryption_key = parse_key_material(encryption_key, KEY_SIZE)
+        authTag = parse_key_material(authTag, TAG_SIZE)
+    except (ValueError, TypeError) as e:
+        return JsonResponse({'error': f"Invalid encryption details: {e}"}, status=400)
+
+    try:
+        format_version = parse_format_version(data.get('format_version'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    parts = list_upload_parts(upload_id)
+    try:
+        part_count = int(data.get('parts') or len(parts))
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Invalid part count'}, status=400)
+    missing = [n for n in range(1, part_count + 1) if n not in parts]
+    if part_count < 1 or missing:
+        return JsonResponse({
+            'error': 'Upload is incomplete',
+            'missing_parts': missing
+        }, status=400)
+
+    # Only one commit may win, even if the client retries concurrently
+    claimed = UploadSession.objects.filter(
+        id=session.id, status='open').update(status='committing')
+    if not claimed:
+        return JsonResponse({'error': 'Upload session is being committed'}, status=409)
+
+    unique_filename = encrypted_storage.generate_name()
+    file_path = encrypted_storage.prepare_path(unique_filename)
+    temp_path = f"{file_path}.tmp"
+    session_dir = upload_session_dir(upload_id)
+    digest = hashlib.sha256()
+    # Counted while assembling, as a PUT already in flight when the session
+    # was claimed may still replace a part after it was listed
+    file_size = 0
+    try:
+        with open(temp_path, 'wb') as destination:
+            for number in range(1, part_count + 1):
+                with open(os.path.join(session_dir, str(number)), 'rb') as part:
+                    while chunk := part.read(UPLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        destination.write(chunk)
+                        file_size += len(chunk)
+        if format_version == FORMAT_SEGMENTED:
+            read_container_header(temp_path)
+        os.replace(temp_path, file_path)
+
+        file_type = get_file_type(session.original_filename)
+        with transaction.atomic():
+            charge_storage(session.user_id, file_size)
+            encrypted_file = EncryptedFile.objects.create(
+                original_filename=session.original_filename,
+                stored_filename=unique_filename,
+                file_size=file_size,
+                encryption_iv=encryption_iv,
+                file_type=file_type,
+                user_id=session.user_id,
+                encryption_key=encryption_key,
+                authTag=authTag,
+                sha256=digest.hexdigest(),
+                format_version=format_version
+            )
+    except Exception as e:
+        for path in (temp_path, file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        UploadSession.objects.filter(id=session.id).update(status='open')
+        if isinstance(e, QuotaExceeded):
+            # Parts are kept so the upload can be committed once space is freed
+            return quota_exceeded_response(session.user_id)
+        if isinstance(e, InvalidContainer):
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse({'error': str(e)}, status=500)
+
+    shutil.rmtree(session_dir, ignore_errors=True)
+    session.delete()
+    build_preview.delay(file_id=encrypted_file.id)
+
+    return JsonResponse({
+        'message': 'Encrypted file uploaded successfully',
+        'filename': encrypted_file.original_filename,
+        'file_id': encrypted_file.id,
+        'file_type': file_type,
+        'format_version': format_version
+    }, status=200)
+
+
+def directory_key(text):
+    """Lower-case ``text`` the way the database's LOWER() does"""
+    if connection.vendor == 'sqlite':
+        # SQLite's LOWER() only folds ASCII letters
+        return text.translate(ASCII_LOWER)
+    return text.lower()
+
+
+def prefix_key(field):
+    """
+    LOWER(field) for prefix_filter's range, which needs code point order.
+
+    SQLite's default collation already compares that way. PostgreSQL's
+    database collation need not, so there it is compared under "C", which
+    the user_*_lower_c_idx indexes are built with.
+    """
+    if connection.vendor == 'sqlite':
+        return Lower(field)
+    return Collate(Lower(field), 'C')
+
+
+def prefix_filter(field, prefix):
+    """
+    Case-insensitive ``field`` prefix match for the user directory.
+
+    istartswith alone can't use an index on either backend, so it is
+    paired with a range on the ``<field>_prefix_key`` (prefix_key) alias
+    that the user directory indexes serve.
+    """
+    key = directory_key(prefix)
+    condition = Q(**{f'{field}_prefix_key__gte': key,
+                     f'{field}__istartswith': prefix})
+    if ord(key[-1]) < sys.maxunicode:
+        upper = key[:-1] + chr(ord(key[-1]) + 1)
+        condition &= Q(**{f'{field}_prefix_key__lt': upper})
+    return condition
+
+
+def encode_user_cursor(name_key, user_id):
+    raw = json.dumps([name_key, user_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_user_cursor(cursor):
+    """Return (name_key, id) from a cursor produced by encode_user_cursor"""
+    name_key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(name_key, str):
+        raise ValueError('Invalid cursor')
+    return name_key, int(user_id)
+
+
+def user_directory_response(request, payload):
+    """
+    JSON response for a user directory page, validated by an ETag over
+    its contents. The page is cheap to query; a 304 saves serialising and
+    sending it when nothing on it has changed.
+    """
+    body = json.dumps(payload, separators=(',', ':'))
+    etag = quote_etag(hashlib.sha256(body.encode()).hexdigest()[:32])
+    if etag_matches(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Let the browser keep the page but check back every time
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def encode_file_cursor(uploaded_at, file_id):
+    raw = f"{uploaded_at.isoformat()}|{file_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_file_cursor(cursor):
+    """Return (uploaded_at, id) from a cursor produced by encode_file_cursor"""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    uploaded_at, file_id = raw.split('|')
+    return datetime.fromisoformat(uploaded_at), int(file_id)
+
+
+def file_list_options(request):
+    """
+    Parse the paging and filter parameters shared by list_files and
+    search_files. Returns (scope, filters, limit, None) or an error
+    response as the last item.
+    """
+    scope = request.GET.get('scope', 'all')
+    if scope not in ('all', 'owned', 'shared'):
+        return None, None, None, JsonResponse({'error': 'Invalid scope'}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', LIST_FILES_PAGE_SIZE))
+    except ValueError:
+        return None, None, None, JsonResponse({'error': 'Invalid limit'}, status=400)
+    limit = max(1, min(limit, LIST_FILES_MAX_PAGE_SIZE))
+
+    filters = Q()
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            uploaded_at, last_id = decode_file_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return None, None, None, JsonResponse({'error': 'Invalid cursor'}, status=400)
+        filters &= Q(uploaded_at__lt=uploaded_at) | Q(
+            uploaded_at=uploaded_at, id__lt=last_id)
+    if request.GET.get('type'):
+        filters &= Q(file_type=request.GET['type'])
+    return scope, filters, limit, None
+
+
+def visible_file_sources(user_id, scope, filters):
+    """
+    Querysets of the files ``user_id`` owns and has been given access to.
+
+    They are fetched as separate index-backed queries, each limited to one
+    page, and merged by file_list_page instead of OR-ing and de-duplicating
+    over the whole table.
+    """
+    sources = []
+    if scope in ('all', 'owned'):
+        sources.append(EncryptedFile.objects.filter(filters, user_id=user_id))
+    if scope in ('all', 'shared'):
+        shared_ids = UserPermissions.objects.filter(
+            file_assigned_id=user_id).values('file_id')
+        sources.append(EncryptedFile.objects.filter(filters, id__in=shared_ids))
+    return sources
+
+
+def file_list_page(row_lists, limit):
+    """Merge per-source rows into one page; returns (rows, next_cursor)"""
+    merged = {}
+    for rows in row_lists:
+        for row in rows:
+            merged[row[0]] = row
+    rows = sorted(merged.values(), key=lambda row: (row[2], row[0]),
+                  reverse=True)[:limit + 1]
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_file_cursor(rows[-1][2], rows[-1][0])
+    return rows, next_cursor
+
+
+def file_list_response(rows, next_cursor):
+    return JsonResponse({
+        'files': [
+            {
+                'id': file_id,
+                'filename': filename,
+                'uploaded_at': uploaded_at.isoformat(),
+                'size': size,
+                'file_type': file_type,
+                'user_id': owner_id,
+                'preview_type': preview_type
+            } for file_id, filename, uploaded_at, size, file_type, owner_id, preview_type in rows
+        ],
+        'next_cursor': next_cursor
+    }, status=200)
+
+
+@csrf_exempt
+@jwt_token_required
+def list_files(request, user_id):
+    """
+    List a page of the files a user owns or has been given access to.
+
+    Pages are ordered newest first and keyed on (uploaded_at, id); pass the
+    returned ``next_cursor`` back as ``cursor`` to get the following page.
+    Optional filters: ``scope`` (all, owned or shared), ``type`` (exact
+    MIME type), ``q`` (filename prefix) and ``limit``.
+    """
+    try:
+        user_id = int(user_id)
+        scope, filters, limit, error = file_list_options(request)
+        if error is not None:
+            return error
+        if request.GET.get('q'):
+            filters &= Q(original_filename__startswith=request.GET['q'])
+
+        rows, next_cursor = file_list_page([
+            source.order_by(*LIST_FILES_ORDERING)
+            .values_list(*LIST_FILES_COLUMNS)[:limit + 1]
+            for source in visible_file_sources(user_id, scope, filters)
+        ], limit)
+        return file_list_response(rows, next_cursor)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
+@csrf_exempt
+@jwt_token_required
+def search_files(request):
+    """
+    Search the names of the files the requesting user owns or can access.
+
+    ``q`` is required. ``mode`` is ``tokens`` (default: every
+    whitespace-separated term appears somewhere in the name), ``substring``
+    (the whole query appears) or ``prefix`` (the name starts with it);
+    matching ignores case. Takes the same ``scope``, ``type``, ``limit``
+    and ``cursor`` parameters and returns the same page format as
+    list_files.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JsonResponse({'error': 'Search query missing'}, status=400)
+    if len(query) > MAX_SEARCH_QUERY_LENGTH:
+        return JsonResponse({'error': 'Search query too long'}, status=400)
+    mode = request.GET.get('mode', 'tokens')
+    if mode not in SEARCH_MODES:
+        return JsonResponse({'error': 'Invalid mode'}, status=400)
+
+    try:
+        scope, filters, limit, error = file_list_options(request)
+        if error is not None:
+            return error
+
+        rows, next_cursor = file_list_page([
+            search_rows(source, query, mode, LIST_FILES_COLUMNS, limit + 1)
+            for source in visible_file_sources(request.user.id, scope, filters)
+        ], limit)
+        return file_list_response(rows, next_cursor)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def set_encryption_headers(response, db_file):
+    """Attach the values the client needs to decrypt the blob"""
+    response['X-Encryption-IV'] = encode_key_material(db_file.encryption_iv)
+    response['X-Original-Filename'] = db_file.original_filename
+    response['X-Encryption-key'] = encode_key_material(db_file.encryption_key)
+    response['X-authTag'] = encode_key_material(db_file.authTag)
+    response['X-Format-Version'] = db_file.format_version
+    response['Accept-Ranges'] = 'bytes'
+    response['Access-Control-Expose-Headers'] = (
+        'x-encryption-iv, x-original-filename,x-encryption-key,x-authTag,'
+        'x-format-version,accept-ranges,content-range,content-length,'
+        'last-modified,etag'
+    )
+    return response
+
+
+def set_validators(response, db_file):
+    """Attach Last-Modified and, once the blob's hash is known, a strong ETag"""
+    response['Last-Modified'] = http_date(db_file.uploaded_at.timestamp())
+    if db_file.sha256:
+        response['ETag'] = quote_etag(db_file.sha256)
+    return response
+
+
+def etag_matches(request, etag):
+    """Whether If-None-Match names ``etag``"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    # If-None-Match uses the weak comparison
+    return '*' in etags or etag in (tag.removeprefix('W/') for tag in etags)
+
+
+def not_modified_response(request, db_file):
+    """A 304 if If-None-Match names the blob's ETag, else None"""
+    if not db_file.sha256 or not etag_matches(request, quote_etag(db_file.sha256)):
+        return None
+    return set_validators(HttpResponse(status=304), db_file)
+
+
+def file_range_stream(f, start, end):
+    """Yield one byte range of an open file, closing it afterwards"""
+    with f:
+        yield from read_file_range(f, start, end)
+
+
+def multipart_range_stream(f, ranges, size, content_type, boundary):
+    """Yield a multipart/byteranges body for several ranges of one file"""
+    with f:
+        for start, end in ranges:
+            yield (
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            yield from read_file_range(f, start, end)
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def accel_redirect_response(db_file):
+    """
+    Hand the blob transfer to nginx with an X-Accel-Redirect.
+
+    nginx serves the file from its internal DOWNLOAD_ACCEL_PREFIX location
+    (with sendfile and its own Range handling); the encryption headers set
+    here are copied onto the final response by that location.
+    """
+    path = encrypted_storage.locate(db_file.stored_filename)
+    if path is None:
+        return JsonResponse({'error': 'File not found on server'}, status=404)
+
+    relative_path = os.path.relpath(path, UPLOAD_ROOT).replace(os.sep, '/')
+    response = HttpResponse(
+        content_type=db_file.file_type or 'application/octet-stream')
+    response['X-Accel-Redirect'] = quote(
+        settings.DOWNLOAD_ACCEL_PREFIX + relative_path)
+    response['Content-Disposition'] = content_disposition_header(
+        True, db_file.original_filename)
+    set_validators(response, db_file)
+    return set_encryption_headers(response, db_file)
+
+
+def requested_ranges(request, size, db_file):
+    """
+    Work out which byte ranges to send for a download.
+
+    Returns None for the whole file, an empty list if nothing requested is
+    satisfiable, or the sorted list of inclusive (start, end) ranges with
+    overlapping and adjacent ones merged.
+    """
+    ranges = parse_range_header(request.headers.get('Range'), size)
+    if ranges:
+        ranges = merge_ranges(ranges)
+
+    # A stale If-Range validator means the client must start over. It may
+    # be the Last-Modified date or the (strong) ETag.
+    if_range = request.headers.get('If-Range')
+    if ranges is not None and if_range:
+        current = [http_date(db_file.uploaded_at.timestamp())]
+        if db_file.sha256:
+            current.append(quote_etag(db_file.sha256))
+        if if_range not in current:
+            ranges = None
+
+    # Too many pieces is cheaper to answer with the whole file
+    if ranges and len(ranges) > MAX_DOWNLOAD_RANGES:
+        ranges = None
+    return ranges
+
+
 @csrf_exempt
 @jwt_token_required
 def download_file(request, file_id):
-    """Download an encrypted file"""
+    """
+    Download an encrypted file.
+
+    Honours ``Range`` (single or multiple byte ranges) and ``If-Range`` so
+    clients can resume or fetch pieces in parallel. Partial responses carry
+    the same encryption headers as a full download. The ETag is the
+    ciphertext's SHA-256, so ``If-None-Match`` gets a 304 for an unchanged
+    blob.
+    """
     try:
         # Retrieve file metadata
         db_file = EncryptedFile.objects.get(id=file_id)
 
-        # Full path to encrypted file
-        encrypted_path = os.path.join(UPLOAD_ROOT, db_file.stored_filename)
+        not_modified = not_modified_response(request, db_file)
+        if not_modified is not None:
+            return not_modified
+
+        if settings.DOWNLOAD_ACCEL_REDIRECT:
+            return accel_redirect_response(db_file)
 
-        # Check if file exists
-        if not os.path.exists(encrypted_path):
+        # Open the encrypted blob wherever storage currently keeps it
+        try:
+            file = encrypted_storage.open_blob(db_file.stored_filename)
+        except FileNotFoundError:
             return JsonResponse({'error': 'File not found on server'}, status=404)
 
-        # Open file and prepare response
-        file = open(encrypted_path, 'rb')
-        response = FileResponse(
-            file,
-            as_attachment=True,
-            filename=db_file.original_filename,
-            content_type=db_file.file_type
-        )
+        size = os.fstat(file.fileno()).st_size
+        content_type = db_file.file_type or 'application/octet-stream'
+        ranges = requested_ranges(request, size, db_file)
 
-        # Add IV to response headers for client-side decryption
-        response['X-Encryption-IV'] = db_file.encryption_iv
-        response['X-Original-Filename'] = db_file.original_filename
-        response['X-Encryption-key'] = db_file.encryption_key
-        response['X-authTag'] = db_file.authTag
-        response['Access-Control-Expose-Headers'] = 'x-encryption-iv, x-original-filename,x-encryption-key,x-authTag'
+        if ranges is None:
+            response = FileResponse(
+                file,
+                as_attachment=True,
+                filename=db_file.original_filename,
+                content_type=content_type
+            )
+        elif not ranges:
+            file.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(
+                file_range_stream(file, start, end),
+                status=206,
+                content_type=content_type
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+            response['Content-Length'] = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            response = StreamingHttpResponse(
+                multipart_range_stream(
+                    file, ranges, size, content_type, boundary),
+                status=206,
+                content_type=f"multipart/byteranges; boundary={boundary}"
+            )
+
+        set_validators(response, db_file)
+        return set_encryption_headers(response, db_file)
 
+    except EncryptedFile.DoesNotExist:
+        return JsonResponse({'error': 'File record not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_token_required
+def download_archive(request):
+    """
+    Stream a ZIP of several files for download.
+
+    Body: ``{"file_ids": [...]}``. The archive contains each file's
+    ciphertext and a manifest.json with its IV, key and tag (see
+    archives.py). It is built while it is sent, so nothing is written to
+    disk. The caller must own, administer or have a permission on every
+    file.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    file_ids, error = requested_file_ids(request, MAX_ARCHIVE_FILES)
+    if error is not None:
+        return error
+
+    try:
+        files = EncryptedFile.objects.in_bulk(file_ids)
+        if request.user.role == 'admin':
+            shared = set(file_ids)
+        else:
+            shared = set(UserPermissions.objects.filter(
+                file_id__in=file_ids, file_assigned_id=request.user.id
+            ).values_list('file_id', flat=True))
+
+        missing = [file_id for file_id in file_ids
+                   if file_id not in files or (
+                       files[file_id].user_id != request.user.id
+                       and file_id not in shared)]
+        if missing:
+            return JsonResponse({
+                'error': 'Files not found', 'file_ids': missing}, status=404)
+
+        db_files = [files[file_id] for file_id in file_ids]
+        lost = [db_file.id for db_file in db_files
+                if not encrypted_storage.exists(db_file.stored_filename)]
+        if lost:
+            return JsonResponse({
+                'error': 'File not found on server', 'file_ids': lost}, status=404)
+
+        stream = archive_stream(db_files)
+        if settings.ASYNC_VIEWS:
+            stream = aiterate(stream)
+        response = StreamingHttpResponse(stream, content_type='application/zip')
+        response['Content-Disposition'] = content_disposition_header(
+            True, f"files-{django_timezone.now():%Y%m%d-%H%M%S}.zip")
+        # Let nginx pass blocks on as they are produced
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_token_required
+def preview_file(request, file_id):
+    """
+    Return the encrypted preview rendition of a file.
+
+    The body is ciphertext under the file's key; X-Encryption-IV and
+    X-authTag are the rendition's own, so the client decrypts it exactly
+    like a download. Like download_archive, only the owner, admins and users
+    holding a permission on the file can fetch it; anyone else gets a 404.
+    """
+    try:
+        db_file = EncryptedFile.objects.only(
+            'user_id', 'stored_filename', 'original_filename', 'encryption_key',
+            'preview_type', 'preview_iv', 'preview_authTag'
+        ).get(id=file_id)
+
+        if (request.user.role != 'admin' and db_file.user_id != request.user.id
+                and not UserPermissions.objects.filter(
+                    file_id=db_file.id, file_assigned_id=request.user.id).exists()):
+            raise EncryptedFile.DoesNotExist
+
+        if not db_file.preview_type:
+            return JsonResponse({'error': 'No preview available'}, status=404)
+
+        try:
+            preview = open(
+                encrypted_storage.preview_path(db_file.stored_filename), 'rb')
+        except FileNotFoundError:
+            return JsonResponse({'error': 'No preview available'}, status=404)
+
+        response = FileResponse(preview, content_type=db_file.preview_type)
+        response['X-Encryption-IV'] = encode_key_material(db_file.preview_iv)
+        response['X-Original-Filename'] = db_file.original_filename
+        response['X-Encryption-key'] = encode_key_material(db_file.encryption_key)
+        response['X-authTag'] = encode_key_material(db_file.preview_authTag)
+        response['Access-Control-Expose-Headers'] = (
+            'x-encryption-iv, x-original-filename,x-encryption-key,x-authTag')
         return response
 
     except EncryptedFile.DoesNotExist:
@@ -199,6 +1082,198 @@ def delete_file(request, file_id):
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def requested_file_ids(request, limit):
+    """
+    Parse ``{"file_ids": [...]}`` from the request body.
+
+    Returns (ids, None) with duplicates dropped and request order kept, or
+    (None, error response).
+    """
+    try:
+        data = json.loads(request.body)
+        file_ids = list(dict.fromkeys(
+            int(file_id) for file_id in data.get('file_ids') or []))
+    except json.JSONDecodeError:
+        return None, JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
+    except (AttributeError, TypeError, ValueError):
+        return None, JsonResponse({'error': 'file_ids must be a list of integers'}, status=400)
+
+    if not file_ids:
+        return None, JsonResponse({'error': 'No files given'}, status=400)
+    if len(file_ids) > limit:
+        return None, JsonResponse({
+            'error': f'At most {limit} files can be handled at once'
+        }, status=400)
+    return file_ids, None
+
+
+@csrf_exempt
+@jwt_token_required
+def delete_files(request):
+    """
+    Delete many files in one request.
+
+    Body: ``{"file_ids": [1, 2, ...]}``. Only the owner or an admin may
+    delete a file. Allowed files, their permissions and share links are
+    removed in one transaction and their blobs are unlinked by a background
+    job. The response reports ``deleted``, ``not_found`` or ``forbidden``
+    for every id.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    file_ids, error = requested_file_ids(request, MAX_BATCH_DELETE)
+    if error is not None:
+        return error
+
+    try:
+        with transaction.atomic():
+            files = {
+                file_id: (owner_id, stored_filename, file_size)
+                for file_id, owner_id, stored_filename, file_size in
+                EncryptedFile.objects.select_for_update().filter(id__in=file_ids)
+                .values_list('id', 'user_id', 'stored_filename', 'file_size')
+            }
+            is_admin = request.user.role == 'admin'
+            allowed = [file_id for file_id, (owner_id, _, _) in files.items()
+                       if is_admin or owner_id == request.user.id]
+
+            if allowed:
+                UserPermissions.objects.filter(file_id__in=allowed).delete()
+                ShareableLink.objects.filter(file_id__in=allowed).delete()
+                EncryptedFile.objects.filter(id__in=allowed).delete()
+
+                freed = {}
+                for file_id in allowed:
+                    owner_id, _, file_size = files[file_id]
+                    size, count = freed.get(owner_id, (0, 0))
+                    freed[owner_id] = (size + file_size, count + 1)
+                for owner_id, (size, count) in freed.items():
+                    release_storage(owner_id, size, count)
+
+                # Queued in the same transaction, so blobs are only removed
+                # if the rows really are gone
+                delete_blobs.delay(stored_filenames=[
+                    files[file_id][1] for file_id in allowed])
+
+        allowed = set(allowed)
+        results = []
+        for file_id in file_ids:
+            if file_id not in files:
+                status = 'not_found'
+            elif file_id in allowed:
+                status = 'deleted'
+            else:
+                status = 'forbidden'
+            results.append({'file_id': file_id, 'status': status})
+
+        return JsonResponse({
+            'deleted': len(allowed),
+            'results': results
+        }, status=200)
+
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def forbidden_file_ids(user, file_ids):
+    """The ids in ``file_ids`` of files ``user`` may not manage"""
+    if user.role == 'admin':
+        return []
+    return list(EncryptedFile.objects.filter(id__in=file_ids)
+                .exclude(user_id=user.id).values_list('id', flat=True))
+
+
+def check_acl(permissions):
+    """
+    Validate a requested ACL, a list of ``{'userId', 'accessType'}`` dicts.
+
+    Returns it unchanged, or raises ValueError naming the first bad entry.
+    """
+    if not isinstance(permissions, list):
+        raise ValueError('permissions must be a list')
+    for position, permission in enumerate(permissions):
+        try:
+            int(permission.get('userId'))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError(f"permissions[{position}] has no valid userId")
+    return permissions
+
+
+def invalid_acl_entry(index, reason):
+    return JsonResponse({
+        'error': f"Invalid entry at index {index}: {reason}",
+        'index': index
+    }, status=400)
+
+
+def apply_file_permissions(requested):
+    """
+    Bring the ACLs of several files in line with ``requested``.
+
+    ``requested`` maps file id -> list of ``{'userId', 'accessType'}``. Only
+    the difference from what is stored is written: one bulk_create, one
+    bulk_update and one delete, all inside a single transaction. Returns
+    the created/updated/deleted counts, or raises EncryptedFile.DoesNotExist
+    if any file id is unknown.
+    """
+    with transaction.atomic():
+        files = EncryptedFile.objects.select_for_update().in_bulk(
+            list(requested), field_name='id')
+        missing = [file_id for file_id in requested if file_id not in files]
+        if missing:
+            raise EncryptedFile.DoesNotExist(f"Files not found: {missing}")
+
+        existing = {}
+        to_delete = []
+        for permission in UserPermissions.objects.filter(file_id__in=list(requested)):
+            key = (permission.file_id, permission.file_assigned_id)
+            if key in existing:
+                # Older code could leave duplicates behind; keep one
+                to_delete.append(permission.id)
+            else:
+                existing[key] = permission
+
+        to_create = []
+        to_update = {}
+        wanted = set()
+        for file_id, permissions in requested.items():
+            for permission in permissions:
+                assigned_user_id = int(permission.get('userId'))
+                permission_type = permission.get('accessType') or 'view'
+                key = (file_id, assigned_user_id)
+                wanted.add(key)
+
+                current = existing.get(key)
+                if current is None:
+                    to_create.append(UserPermissions(
+                        file_id=file_id,
+                        file_user_id=files[file_id].user_id,
+                        file_assigned_id=assigned_user_id,
+                        permission_Type=permission_type
+                    ))
+                    existing[key] = to_create[-1]
+                elif current.permission_Type != permission_type:
+                    current.permission_Type = permission_type
+                    if current.pk:
+                        to_update[current.pk] = current
+
+        to_delete.extend(permission.id for key, permission in existing.items()
+                         if key not in wanted and permission.pk)
+
+        UserPermissions.objects.bulk_create(to_create)
+        UserPermissions.objects.bulk_update(
+            list(to_update.values()), ['permission_Type'])
+        if to_delete:
+            UserPermissions.objects.filter(id__in=to_delete).delete()
+
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(to_delete)
+    }
+
+
 @csrf_exempt
 @jwt_token_required
 def upload_permissions(request):
@@ -206,37 +1281,32 @@ def upload_permissions(request):
         try:
             data = json.loads(request.body)
 
-            file_id = int(data.get('fileId'))
-            permissions = data.get('permissions')
+            try:
+                file_id = int(data.get('fileId'))
+                permissions = check_acl(data.get('permissions') or [])
+            except (TypeError, ValueError) as e:
+                return JsonResponse({'error': f"Invalid request: {e}"}, status=400)
 
-            permission_to_delete = UserPermissions.objects.filter(
-                file_id=file_id)
-            permission_to_delete.delete()
+            if forbidden_file_ids(request.user, [file_id]):
+                return JsonResponse({'error': 'Permission denied'}, status=403)
 
-            file = EncryptedFile.objects.get(id=file_id)
-
-            for permission in permissions:
-                assigned_user_id = permission.get('userId')
-                permission_type = permission.get('accessType')
-
-                UserPermissions.objects.create(
-                    file_id=file_id,
-                    file_user_id=int(file.user_id),
-                    file_assigned_id=int(assigned_user_id),
-                    permission_Type=permission_type
-                )
+            changes = apply_file_permissions({file_id: permissions})
 
             # Return success message
             return JsonResponse({
                 'message': 'Permissions updated successfully',
                 'file_id': file_id,
-                'permissions': permissions
+                'permissions': permissions,
+                **changes
             }, status=200)
 
         except json.JSONDecodeError:
             # Handle the case where the JSON is malformed
             return JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
 
+        except EncryptedFile.DoesNotExist:
+            return JsonResponse({'error': 'File not found'}, status=404)
+
         except Exception as e:
             # Log the error for debugging
             print(f"Error occurred: {str(e)}")
@@ -246,6 +1316,67 @@ def upload_permissions(request):
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+@csrf_exempt
+@jwt_token_required
+def bulk_upload_permissions(request):
+    """
+    Replace the ACLs of many files in one request.
+
+    Body: ``{"files": [{"fileId": 1, "permissions": [...]}, ...]}``. Only
+    the owner or an admin may change a file's ACL. All files are updated
+    in one transaction; if any file is missing or not the caller's,
+    nothing is changed. A malformed entry is answered with a 400 giving
+    its index in ``files``.
+    """
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+
+            entries = data.get('files') or []
+            if not isinstance(entries, list):
+                return JsonResponse({'error': 'files must be a list'}, status=400)
+
+            requested = {}
+            for index, entry in enumerate(entries):
+                try:
+                    file_id = int(entry.get('fileId'))
+                except (AttributeError, TypeError, ValueError):
+                    return invalid_acl_entry(index, 'fileId is missing or not a number')
+                try:
+                    requested[file_id] = check_acl(entry.get('permissions') or [])
+                except ValueError as e:
+                    return invalid_acl_entry(index, e)
+
+            if not requested:
+                return JsonResponse({'error': 'No files given'}, status=400)
+
+            forbidden = forbidden_file_ids(request.user, list(requested))
+            if forbidden:
+                return JsonResponse(
+                    {'error': f"Permission denied for files: {sorted(forbidden)}"},
+                    status=403)
+
+            changes = apply_file_permissions(requested)
+
+            return JsonResponse({
+                'message': 'Permissions updated successfully',
+                'file_ids': list(requested),
+                **changes
+            }, status=200)
+
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
+
+        except EncryptedFile.DoesNotExist as e:
+            return JsonResponse({'error': str(e)}, status=404)
+
+        except Exception as e:
+            print(f"Error occurred: {str(e)}")
+            return JsonResponse({'error': f"Internal Server Error: {str(e)}"}, status=500)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
 @csrf_exempt
 def register_user(request):
     if request.method == 'POST':
@@ -366,18 +1497,87 @@ def login_user(request):
 @csrf_exempt
 @jwt_token_required
 def list_users(request):
+    """
+    A page of the user directory, ordered by name.
+
+    ``q`` keeps only users whose name or email starts with it, ignoring
+    case. Pages are keyed on (lower-cased name, id); pass the returned
+    ``next_cursor`` back as ``cursor`` for the following page. Responses
+    carry an ETag so an unchanged page is answered with a 304.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
     try:
-        users = User.objects.all()
-        return JsonResponse({
-            'users': [
-                {
-                    'id': user.id,
-                    'name': user.name,
-                    'email': user.email,
-                    'role': user.role
-                } for user in users
-            ]
-        }, status=200)
+        limit = int(request.GET.get('limit', USER_DIRECTORY_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    limit = max(1, min(limit, USER_DIRECTORY_MAX_PAGE_SIZE))
+
+    query = request.GET.get('q', '').strip()
+    if len(query) > MAX_SEARCH_QUERY_LENGTH:
+        return JsonResponse({'error': 'Search query too long'}, status=400)
+
+    try:
+        users = User.objects.annotate(name_key=Lower('name'))
+        if query:
+            users = users.alias(
+                name_prefix_key=prefix_key('name'),
+                email_prefix_key=prefix_key('email')
+            ).filter(prefix_filter('name', query) | prefix_filter('email', query))
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            try:
+                name_key, last_id = decode_user_cursor(cursor)
+            except (ValueError, TypeError, UnicodeDecodeError):
+                return JsonResponse({'error': 'Invalid cursor'}, status=400)
+            users = users.filter(Q(name_key__gt=name_key) | Q(
+                name_key=name_key, id__gt=last_id))
+
+        rows = list(users.order_by('name_key', 'id')
+                    .values_list(*USER_DIRECTORY_COLUMNS, 'name_key')[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_user_cursor(rows[-1][-1], rows[-1][0])
+
+        return user_directory_response(request, {
+            'users': [dict(zip(USER_DIRECTORY_COLUMNS, row)) for row in rows],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@jwt_token_required
+def lookup_users(request):
+    """
+    Resolve the comma-separated user ids in ``ids`` to directory entries,
+    ordered by id. Unknown ids are left out.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        user_ids = {int(value) for value in request.GET.get('ids', '').split(',')
+                    if value.strip()}
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of integers'},
+                            status=400)
+    if not user_ids:
+        return JsonResponse({'error': 'No users given'}, status=400)
+    if len(user_ids) > MAX_USER_LOOKUP:
+        return JsonResponse(
+            {'error': f'At most {MAX_USER_LOOKUP} users per request'}, status=400)
+
+    try:
+        rows = (User.objects.filter(id__in=user_ids).order_by('id')
+                .values_list(*USER_DIRECTORY_COLUMNS))
+        return user_directory_response(request, {
+            'users': [dict(zip(USER_DIRECTORY_COLUMNS, row)) for row in rows]
+        })
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
@@ -416,6 +1616,9 @@ def generate_share_link(request):
                 expiration_seconds=expiration
             )
 
+            # Keep the table from growing between reaper runs
+            ShareableLink.delete_expired(batch_size=100)
+
             return JsonResponse({
                 'success': True,
                 'share_link': share_link.get_share_url(),
@@ -428,38 +1631,135 @@ def generate_share_link(request):
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 
+def segmented_plaintext_response(request, db_file, encrypted_file, key, iv, wrap=iter):
+    """
+    Stream a format 2 file decrypted, honouring a single-range Range header.
+
+    Only the segments covering the requested bytes are read and decrypted.
+    ``wrap`` adapts the body iterator, e.g. Util.aiterate under ASGI.
+    """
+    try:
+        reader = SegmentedReader(encrypted_file, key, iv)
+    except InvalidContainer as e:
+        encrypted_file.close()
+        return JsonResponse({'error': f"Stored file is damaged: {e}"}, status=500)
+    ranges = parse_range_header(request.headers.get('Range'), reader.size)
+    if ranges:
+        ranges = merge_ranges(ranges)
+    if ranges == []:
+        reader.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{reader.size}"
+        return response
+
+    content_type = db_file.file_type or 'application/octet-stream'
+    if ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(
+            wrap(segmented_stream(reader, start, end)),
+            status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{reader.size}"
+        response['Content-Length'] = end - start + 1
+    else:
+        response = StreamingHttpResponse(
+            wrap(segmented_stream(reader)), content_type=content_type)
+        response['Content-Length'] = reader.size
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = content_disposition_header(
+        True, db_file.original_filename)
+    return response
+
+
+def find_share_link(share_token):
+    """
+    Look up an unexpired share link, or return None.
+
+    Malformed tokens are rejected without touching the database, and tokens
+    that matched nothing are remembered for SHARE_LINK_MISS_TTL seconds so
+    repeated guesses are answered from the cache.
+    """
+    if not SHARE_TOKEN_RE.match(share_token):
+        return None
+
+    miss_key = f"share-link-miss:{share_token}"
+    if cache.get(miss_key):
+        return None
+
+    share_link = ShareableLink.get_active(share_token)
+    if share_link is None:
+        cache.set(miss_key, True, settings.SHARE_LINK_MISS_TTL)
+    return share_link
+
+
 @csrf_exempt
 def access(request, share_token):
-    try:
-        share_link = ShareableLink.objects.get(share_token=share_token)
+    """
+    Serve a shared file decrypted.
 
-        if not share_link.is_valid():
-            return JsonResponse({'error': 'Link has expired'}, status=403)
+    The plaintext is streamed back as a raw download by default; segmented
+    (format 2) files also answer single Range requests. Passing
+    ``?format=json`` returns the old base64-in-JSON body instead, which is
+    only allowed for files up to ``settings.SHARE_JSON_MAX_BYTES``.
+    """
+    try:
+        share_link = find_share_link(share_token)
+        if share_link is None:
+            return JsonResponse({'error': 'Invalid or expired share link'}, status=404)
 
-        file = EncryptedFile.objects.get(id=share_link.file.id)
+        file = share_link.file
         iv = import_key(file.encryption_iv)
         key = import_key(file.encryption_key)
-        tag = import_key(file.authTag)
+        # Segmented files carry a tag per segment instead
+        tag = (None if file.format_version == FORMAT_SEGMENTED
+               else import_key(file.authTag))
 
-        encrypted_path = os.path.join(UPLOAD_ROOT, file.stored_filename)
-
-        if not os.path.exists(encrypted_path):
+        try:
+            encrypted_file = encrypted_storage.open_blob(file.stored_filename)
+        except FileNotFoundError:
             return JsonResponse({'error': 'File not found on server'}, status=404)
 
-        with open(encrypted_path, 'rb') as f:
-            encrypted_data = f.read()
+        if request.GET.get('format') == 'json':
+            if file.file_size > settings.SHARE_JSON_MAX_BYTES:
+                encrypted_file.close()
+                return JsonResponse({
+                    'error': 'File too large for JSON response, download it instead'
+                }, status=413)
+
+            with encrypted_file as f:
+                if file.format_version == FORMAT_SEGMENTED:
+                    decrypted_data = b''.join(SegmentedReader(f, key, iv))
+                else:
+                    decrypted_data = decrypt_file(f.read(), iv, key, tag)
+
+            return JsonResponse({
+                'filename': file.original_filename,
+                'file_type': file.file_type,
+                'file_size': format_bytes(file.file_size),
+                'file_content': base64.b64encode(decrypted_data).decode('utf-8')
+            })
 
-        decrypted_data = decrypt_file(encrypted_data, iv, key, tag)
+        if file.format_version == FORMAT_SEGMENTED:
+            return segmented_plaintext_response(
+                request, file, encrypted_file, key, iv)
 
-        return JsonResponse({
-            'filename': file.original_filename,
-            'file_type': file.file_type,
-            'file_size': format_bytes(file.file_size),
-            'file_content': base64.b64encode(decrypted_data).decode('utf-8')
-        })
+        # GCM plaintext is the same length as the ciphertext on disk
+        size = os.fstat(encrypted_file.fileno()).st_size
+        response = StreamingHttpResponse(
+            decrypt_file_stream(encrypted_file, iv, key, tag),
+            content_type=file.file_type or 'application/octet-stream'
+        )
+        response['Content-Length'] = size
+        response['Content-Disposition'] = content_disposition_header(
+            True, file.original_filename)
+
+        return response
 
-    except ShareableLink.DoesNotExist:
-        return JsonResponse({'error': 'Invalid share link'}, status=404)
+    except EncryptedFile.DoesNotExist:
+        return JsonResponse({'error': 'File record not found'}, status=404)
+    except (InvalidTag, InvalidContainer):
+        return JsonResponse({'error': 'Stored file is damaged'}, status=500)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
 
 
 @csrf_exempt
@@ -494,6 +1794,131 @@ def deleteUser(request, userid):
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 
+@csrf_exempt
+@jwt_token_required
+def auth_cache_stats(request):
+    """Report hit/miss counters of this process's authenticated-user cache"""
+    if request.user.role != 'admin':
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    return JsonResponse(auth_cache.stats(), status=200)
+
+
+@csrf_exempt
+def metrics(request):
+    """
+    Prometheus scrape endpoint, aggregated across worker processes. Only
+    served with a METRICS_TOKEN configured, or openly when DEBUG is on.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not secrets.compare_digest(
+                request.headers.get('Authorization', ''), expected):
+            return JsonResponse({'error': 'Not allowed'}, status=403)
+    elif not settings.DEBUG:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    body, content_type = export_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+
+@csrf_exempt
+@jwt_token_required
+def job_queue_stats(request):
+    """Report background job queue depth and latency"""
+    if request.user.role != 'admin':
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+    return JsonResponse(queue_stats(), status=200)
+
+
+@csrf_exempt
+@jwt_token_required
+def storage_usage_stats(request):
+    """
+    Report storage use (GET) or set a user's quota (POST).
+
+    GET returns the heaviest users from the usage counters (``?limit``,
+    default 100), overall totals and totals per file type. POST takes
+    ``{"user_id": ..., "quota_bytes": ...}``; a null quota falls back to
+    STORAGE_QUOTA_BYTES.
+    """
+    if request.user.role != 'admin':
+        return JsonResponse({'error': 'Not allowed'}, status=403)
+
+    if request.method == 'GET':
+        try:
+            limit = min(max(int(request.GET.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+        top = list(StorageUsage.objects.order_by('-bytes_used', 'user_id')[:limit])
+        users = User.objects.in_bulk([usage.user_id for usage in top])
+        totals = StorageUsage.objects.aggregate(
+            bytes_used=Sum('bytes_used'), file_count=Sum('file_count'),
+            users=Count('id'))
+        by_type = (EncryptedFile.objects.values('file_type')
+                   .annotate(bytes_used=Sum('file_size'), file_count=Count('id'))
+                   .order_by('-bytes_used'))
+
+        return JsonResponse({
+            'default_quota_bytes': settings.STORAGE_QUOTA_BYTES,
+            'totals': {
+                'users': totals['users'],
+                'bytes_used': totals['bytes_used'] or 0,
+                'file_count': totals['file_count'] or 0,
+                'formatted_size': format_bytes(totals['bytes_used'] or 0)
+            },
+            'users': [
+                {
+                    'user_id': usage.user_id,
+                    'name': users[usage.user_id].name if usage.user_id in users else None,
+                    'email': users[usage.user_id].email if usage.user_id in users else None,
+                    'bytes_used': usage.bytes_used,
+                    'file_count': usage.file_count,
+                    'quota_bytes': effective_quota(usage),
+                    'formatted_size': format_bytes(usage.bytes_used)
+                }
+                for usage in top
+            ],
+            'file_types': [
+                {
+                    'file_type': row['file_type'],
+                    'bytes_used': row['bytes_used'] or 0,
+                    'file_count': row['file_count'],
+                    'formatted_size': format_bytes(row['bytes_used'] or 0)
+                }
+                for row in by_type
+            ]
+        }, status=200)
+
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            user_id = int(data['user_id'])
+            quota_bytes = data.get('quota_bytes')
+            if quota_bytes is not None:
+                quota_bytes = int(quota_bytes)
+                if quota_bytes < 0:
+                    raise ValueError('quota_bytes must not be negative')
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON format in request body'}, status=400)
+        except (KeyError, TypeError, ValueError) as e:
+            return JsonResponse({'error': f'Invalid quota: {e}'}, status=400)
+
+        if not User.objects.filter(id=user_id).exists():
+            return JsonResponse({'error': 'User not found'}, status=404)
+
+        usage, _ = StorageUsage.objects.get_or_create(user_id=user_id)
+        StorageUsage.objects.filter(id=usage.id).update(quota_bytes=quota_bytes)
+        usage.refresh_from_db()
+        return JsonResponse({
+            'user_id': user_id,
+            'bytes_used': usage.bytes_used,
+            'file_count': usage.file_count,
+            'quota_bytes': effective_quota(usage)
+        }, status=200)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
 @csrf_exempt
 def totp_setup(request):
     if request.method == 'POST':
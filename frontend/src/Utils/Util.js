@@ -15,25 +15,61 @@ export const generateKey = async () => {
   }
 };
 
+// Segmented container (format 2), see backend/filemanagerapp/segmented.py:
+// a 20-byte header, then SEGMENT_SIZE plaintext segments each sealed with
+// its own nonce and tag, so any byte range can be decrypted on its own.
+export const FORMAT_SINGLE_STREAM = 1;
+export const FORMAT_SEGMENTED = 2;
+const SEGMENT_SIZE = 64 * 1024;
+const HEADER_SIZE = 20;
+const TAG_SIZE = 16;
+const CONTAINER_MAGIC = [0x46, 0x4d, 0x53, 0x47]; // "FMSG"
+
+const containerHeader = (segmentSize, plaintextSize) => {
+  const header = new Uint8Array(HEADER_SIZE);
+  const view = new DataView(header.buffer);
+  header.set(CONTAINER_MAGIC);
+  header[4] = FORMAT_SEGMENTED;
+  view.setUint32(8, segmentSize);
+  view.setBigUint64(12, BigInt(plaintextSize));
+  return header;
+};
+
+const segmentNonce = (iv, index) => {
+  const nonce = new Uint8Array(12);
+  nonce.set(iv.subarray(0, 8));
+  new DataView(nonce.buffer).setUint32(8, index);
+  return nonce;
+};
+
 export const encryptFile = async (file, key) => {
   try {
-    const fileBuffer = await file.arrayBuffer();
+    const plaintext = new Uint8Array(await file.arrayBuffer());
     const iv = window.crypto.getRandomValues(new Uint8Array(12));
-    const encryptedContent = await window.crypto.subtle.encrypt(
-      {
-        name: "AES-GCM",
-        iv: iv,
-      },
-      key,
-      fileBuffer
+    const header = containerHeader(SEGMENT_SIZE, plaintext.length);
+    const segments = Math.max(Math.ceil(plaintext.length / SEGMENT_SIZE), 1);
+    const encryptedBuffer = new Uint8Array(
+      HEADER_SIZE + plaintext.length + segments * TAG_SIZE
     );
-    const encryptedBuffer = new Uint8Array(encryptedContent);
-    const authTag = encryptedBuffer.slice(encryptedBuffer.length - 16);
-    const ciphertext = encryptedBuffer.slice(0, encryptedBuffer.length - 16);
+    encryptedBuffer.set(header);
+    let offset = HEADER_SIZE;
+    for (let index = 0; index < segments; index++) {
+      const sealed = await window.crypto.subtle.encrypt(
+        {
+          name: "AES-GCM",
+          iv: segmentNonce(iv, index),
+          additionalData: header,
+        },
+        key,
+        plaintext.subarray(index * SEGMENT_SIZE, (index + 1) * SEGMENT_SIZE)
+      );
+      encryptedBuffer.set(new Uint8Array(sealed), offset);
+      offset += sealed.byteLength;
+    }
     return {
-      encryptedBuffer: ciphertext,
-      authTag: authTag,
+      encryptedBuffer: encryptedBuffer,
       iv: iv,
+      formatVersion: FORMAT_SEGMENTED,
     };
   } catch (error) {
     console.error("Encryption error:", error);
@@ -41,8 +77,53 @@ export const encryptFile = async (file, key) => {
   }
 };
 
-export const decryptFile = async (encryptedBuffer, iv, key, authTag) => {
+const decryptSegmented = async (encryptedBuffer, iv, key) => {
+  const header = encryptedBuffer.subarray(0, HEADER_SIZE);
+  const view = new DataView(
+    header.buffer,
+    header.byteOffset,
+    header.byteLength
+  );
+  if (
+    header.length < HEADER_SIZE ||
+    CONTAINER_MAGIC.some((byte, i) => header[i] !== byte) ||
+    header[4] !== FORMAT_SEGMENTED
+  ) {
+    throw new Error("Not a segmented container");
+  }
+  const segmentSize = view.getUint32(8);
+  const plaintextSize = Number(view.getBigUint64(12));
+  const segments = Math.max(Math.ceil(plaintextSize / segmentSize), 1);
+  const plaintext = new Uint8Array(plaintextSize);
+  for (let index = 0; index < segments; index++) {
+    const start = HEADER_SIZE + index * (segmentSize + TAG_SIZE);
+    const length = Math.min(segmentSize, plaintextSize - index * segmentSize);
+    const segment = await window.crypto.subtle.decrypt(
+      {
+        name: "AES-GCM",
+        iv: segmentNonce(iv, index),
+        additionalData: header,
+        tagLength: 128,
+      },
+      key,
+      encryptedBuffer.subarray(start, start + length + TAG_SIZE)
+    );
+    plaintext.set(new Uint8Array(segment), index * segmentSize);
+  }
+  return plaintext.buffer;
+};
+
+export const decryptFile = async (
+  encryptedBuffer,
+  iv,
+  key,
+  authTag,
+  formatVersion = FORMAT_SINGLE_STREAM
+) => {
   try {
+    if (formatVersion === FORMAT_SEGMENTED) {
+      return await decryptSegmented(encryptedBuffer, iv, key);
+    }
     const combinedBuffer = new Uint8Array([...encryptedBuffer, ...authTag]);
     const decryptedContent = await window.crypto.subtle.decrypt(
       {
@@ -91,6 +172,24 @@ export const importKey = async (exportedKey) => {
   }
 };
 
+// IVs, keys and auth tags travel as base64 of the raw bytes
+export const toBase64 = (bytes) => {
+  let binary = "";
+  for (const byte of new Uint8Array(bytes)) {
+    binary += String.fromCharCode(byte);
+  }
+  return window.btoa(binary);
+};
+
+export const fromBase64 = (encoded) => {
+  const binary = window.atob(encoded);
+  const bytes = new Uint8Array(binary.length);
+  for (let i = 0; i < binary.length; i++) {
+    bytes[i] = binary.charCodeAt(i);
+  }
+  return bytes;
+};
+
 export const formatBytes = (bytes) => {
   if (bytes === 0) return "0 Bytes";
   const k = 1024;
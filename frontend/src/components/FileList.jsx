@@ -49,18 +49,50 @@ const FileList = ({
   const [expirationTime, setExpirationTime] = useState(60);
   const [searchQuery, setSearchQuery] = useState("");
   const [permissions, setPermissions] = useState([]);
-  const [users, setUsers] = useState([]);
+  // Directory entries by id, for the people who already have access
+  const [knownUsers, setKnownUsers] = useState({});
+  const [matchingUsers, setMatchingUsers] = useState([]);
 
   useEffect(() => {
-    fetchUsers();
-  }, []);
+    const query = searchQuery.trim();
+    if (dialogMode !== "permissions" || !query) {
+      setMatchingUsers([]);
+      return;
+    }
+    // Wait for a pause in typing before searching
+    const timer = setTimeout(() => fetchMatchingUsers(query), 250);
+    return () => clearTimeout(timer);
+  }, [searchQuery, dialogMode]);
+
+  const rememberUsers = (list) => {
+    setKnownUsers((prev) => {
+      const next = { ...prev };
+      list.forEach((user) => {
+        next[user.id] = user;
+      });
+      return next;
+    });
+  };
+
+  const fetchMatchingUsers = async (query) => {
+    try {
+      const response = await axiosApi.get("users/", {
+        params: { q: query, limit: 20 },
+      });
+      setMatchingUsers(response.data.users.filter((x) => x.id !== userId));
+    } catch (error) {
+      toast.error("Failed to fetch users");
+    }
+  };
 
-  const fetchUsers = async () => {
+  const lookupUsers = async (ids) => {
+    const missing = ids.filter((id) => !knownUsers[id]);
+    if (missing.length === 0) return;
     try {
-      const response = await axiosApi.get(`users/`);
-      let u = response.data.users;
-      let d = u.filter((x) => x.id !== userId);
-      setUsers(d);
+      const response = await axiosApi.get("users/lookup/", {
+        params: { ids: missing.join(",") },
+      });
+      rememberUsers(response.data.users);
     } catch (error) {
       toast.error("Failed to fetch users");
     }
@@ -71,6 +103,7 @@ const FileList = ({
       const response = await axiosApi.get(`permissions/${fileid}/`);
       let data = response.data.permissions || [];
       setPermissions(data);
+      lookupUsers(data.map((p) => p.userId));
     } catch (error) {
       toast.error("Failed to fetch permissions");
     }
@@ -138,12 +171,6 @@ const FileList = ({
     setPermissions((prev) => prev.filter((p) => p.userId !== userId));
   };
 
-  const filteredUsers = users.filter(
-    (user) =>
-      user.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-      user.email.toLowerCase().includes(searchQuery.toLowerCase())
-  );
-
   return (
     <div className="max-w-4xl mx-auto bg-white rounded-lg shadow-sm border border-gray-200">
       <div className="px-6 py-4 border-b border-gray-200">
@@ -307,7 +334,7 @@ const FileList = ({
               <div className="space-y-4">
                 <h4 className="text-sm font-medium">People with access</h4>
                 {permissions.map((permission) => {
-                  const user = users.find((u) => u.id === permission.userId);
+                  const user = knownUsers[permission.userId];
                   if (!user) return null;
                   return (
                     <div
@@ -358,7 +385,7 @@ const FileList = ({
                 })}
                 {searchQuery && (
                   <div className="border rounded-lg">
-                    {filteredUsers
+                    {matchingUsers
                       .filter(
                         (user) => !permissions.some((p) => p.userId === user.id)
                       )
@@ -366,9 +393,10 @@ const FileList = ({
                         <div
                           key={user.id}
                           className="flex items-center justify-between p-2 hover:bg-accent cursor-pointer"
-                          onClick={() =>
-                            handleAccessLevelChange(user.id, "viewer")
-                          }
+                          onClick={() => {
+                            rememberUsers([user]);
+                            handleAccessLevelChange(user.id, "viewer");
+                          }}
                         >
                           <div className="flex items-center gap-4">
                             <Avatar>
@@ -12,8 +12,10 @@ import {
   decryptFile,
   encryptFile,
   exportKey,
+  fromBase64,
   generateKey,
   importKey,
+  toBase64,
 } from "../Utils/Util";
 import FileList from "./FileList";
 import { toast } from "react-hot-toast";
@@ -29,15 +31,26 @@ export function FileManager() {
   const [uploadProgress, setUploadProgress] = useState(0);
   const [uploadStatus, setUploadStatus] = useState("idle");
   const [files, setFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [fileQuery, setFileQuery] = useState("");
 
   useEffect(() => {
-    fetchFiles();
-  }, []);
+    // Wait for a pause in typing before searching
+    const timer = setTimeout(() => fetchFiles(), fileQuery ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [fileQuery]);
 
-  const fetchFiles = async () => {
+  const fetchFiles = async (cursor = null) => {
     try {
-      const response = await axiosApi.get(`files/${userId}/`);
-      setFiles(response.data.files);
+      const query = fileQuery.trim();
+      const params = cursor ? { cursor } : {};
+      const response = query
+        ? await axiosApi.get("files/search/", { params: { ...params, q: query } })
+        : await axiosApi.get(`files/${userId}/`, { params });
+      setFiles((previous) =>
+        cursor ? [...previous, ...response.data.files] : response.data.files
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       toast.error("Failed to fetch files");
     }
@@ -63,7 +76,7 @@ export function FileManager() {
       setUploadProgress(0);
 
       const encryptionKey = await generateKey();
-      const { encryptedBuffer, iv, authTag } = await encryptFile(
+      const { encryptedBuffer, iv, formatVersion } = await encryptFile(
         file,
         encryptionKey
       );
@@ -71,10 +84,10 @@ export function FileManager() {
 
       const formData = new FormData();
       formData.append("file", new Blob([encryptedBuffer]), file.name);
-      formData.append("iv", JSON.stringify(Array.from(iv)));
-      formData.append("key", JSON.stringify(exportedKey));
+      formData.append("iv", toBase64(iv));
+      formData.append("key", toBase64(exportedKey));
       formData.append("user_id", userId);
-      formData.append("authTag", JSON.stringify(Array.from(authTag)));
+      formData.append("format_version", formatVersion);
 
       const response = await axiosApi.post("upload/", formData, {
         headers: {
@@ -107,17 +120,18 @@ export function FileManager() {
       });
 
       const encryptedContent = new Uint8Array(response.data);
-      const ivArray = JSON.parse(response.headers.get("X-Encryption-IV"));
-      const encKey = JSON.parse(response.headers.get("X-Encryption-key"));
-      const authTag = JSON.parse(response.headers.get("X-authTag"));
-      const iv = new Uint8Array(ivArray);
+      const iv = fromBase64(response.headers.get("X-Encryption-IV"));
+      const encKey = fromBase64(response.headers.get("X-Encryption-key"));
+      const authTag = fromBase64(response.headers.get("X-authTag"));
+      const formatVersion = Number(response.headers.get("X-Format-Version") || 1);
       const key = await importKey(encKey);
 
       const decryptedBuffer = await decryptFile(
         encryptedContent,
         iv,
         key,
-        authTag
+        authTag,
+        formatVersion
       );
 
       const blob = new Blob([decryptedBuffer]);
@@ -254,6 +268,15 @@ export function FileManager() {
       )}
       {/* File List Section */}
       <div className="min-h-screen bg-gray-100 py-12 px-4 sm:px-6 lg:px-8">
+        <div className="max-w-4xl mx-auto mb-4">
+          <input
+            type="search"
+            value={fileQuery}
+            onChange={(e) => setFileQuery(e.target.value)}
+            placeholder="Search files"
+            className="w-full px-4 py-2 border border-gray-300 rounded"
+          />
+        </div>
         <FileList
           files={files}
           onDownload={handleDownload}
@@ -262,6 +285,16 @@ export function FileManager() {
           userId={userId}
           userRole={userRole}
         />
+        {nextCursor && (
+          <div className="flex justify-center mt-4">
+            <button
+              onClick={() => fetchFiles(nextCursor)}
+              className="px-4 py-2 bg-blue-500 text-white rounded hover:bg-blue-600"
+            >
+              Load more
+            </button>
+          </div>
+        )}
         {/* Add UserList Component for Admin */}
         {userRole == "admin" && (
           <UserList userId={userId} userRole={userRole} />
@@ -8,7 +8,12 @@ import {
 } from "@/components/ui/dialog";
 import { Eye } from "lucide-react";
 import { toast } from "react-hot-toast";
-import { decryptFile, formatBytes, importKey } from "../Utils/Util";
+import {
+  decryptFile,
+  formatBytes,
+  fromBase64,
+  importKey,
+} from "../Utils/Util";
 import axiosApi from "@/Utils/AxiosClient";
 
 const FilePreview = ({ file }) => {
@@ -19,8 +24,12 @@ const FilePreview = ({ file }) => {
   const handlePreview = async () => {
     try {
       setDownloadProgress(0);
+      // A server-made rendition is only a few KB; fall back to the full file
+      const contentType = file.preview_type || file.file_type;
       const response = await axiosApi({
-        url: `download/${file.id}/`,
+        url: file.preview_type
+          ? `preview/${file.id}/`
+          : `download/${file.id}/`,
         method: "GET",
         responseType: "arraybuffer",
         onDownloadProgress: (progressEvent) => {
@@ -32,31 +41,33 @@ const FilePreview = ({ file }) => {
       });
 
       const encryptedContent = new Uint8Array(response.data);
-      const ivArray = JSON.parse(response.headers.get("X-Encryption-IV"));
-      const encKey = JSON.parse(response.headers.get("X-Encryption-key"));
-      const authTag = JSON.parse(response.headers.get("X-authTag"));
-      const iv = new Uint8Array(ivArray);
+      const iv = fromBase64(response.headers.get("X-Encryption-IV"));
+      const encKey = fromBase64(response.headers.get("X-Encryption-key"));
+      const authTag = fromBase64(response.headers.get("X-authTag"));
+      // Renditions from preview/ are always a single GCM stream
+      const formatVersion = Number(response.headers.get("X-Format-Version") || 1);
       const key = await importKey(encKey);
 
       const decryptedBuffer = await decryptFile(
         encryptedContent,
         iv,
         key,
-        authTag
+        authTag,
+        formatVersion
       );
 
       const blob = new Blob([decryptedBuffer]);
 
-      if (file.file_type.startsWith("image/")) {
+      if (contentType.startsWith("image/")) {
         const imageUrl = URL.createObjectURL(blob);
         setFileContent({ type: "image", url: imageUrl });
       } else if (
-        file.file_type.startsWith("text/") ||
-        file.file_type === "application/json"
+        contentType.startsWith("text/") ||
+        contentType === "application/json"
       ) {
         const text = await blob.text();
         setFileContent({ type: "text", content: text });
-      } else if (file.file_type === "application/pdf") {
+      } else if (contentType === "application/pdf") {
         const blob2 = new Blob([decryptedBuffer], { type: "application/pdf" });
         const pdfUrl = URL.createObjectURL(blob2);
         setFileContent({ type: "pdf", url: pdfUrl });
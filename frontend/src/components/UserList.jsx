@@ -7,17 +7,27 @@ import axiosApi from "@/Utils/AxiosClient";
 export function UserList({ userId, userRole }) {
   const [users, setUsers] = useState([]);
   const [editingUser, setEditingUser] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [query, setQuery] = useState("");
 
   useEffect(() => {
-    if (userRole == "admin") {
-      fetchUsers();
-    }
-  }, [userRole]);
+    if (userRole != "admin") return;
+    // Wait for a pause in typing before searching
+    const timer = setTimeout(() => fetchUsers(), query ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [userRole, query]);
 
-  const fetchUsers = async () => {
+  // Fetches the first page, or the page after `cursor`
+  const fetchUsers = async (cursor = null) => {
     try {
-      const response = await axiosApi.get("users/");
-      setUsers(response.data.users);
+      const params = { limit: 50 };
+      if (query.trim()) params.q = query.trim();
+      if (cursor) params.cursor = cursor;
+      const response = await axiosApi.get("users/", { params });
+      setUsers((prev) =>
+        cursor ? [...prev, ...response.data.users] : response.data.users
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       toast.error("Failed to fetch users");
     }
@@ -55,6 +65,13 @@ export function UserList({ userId, userRole }) {
   return (
     <div className="bg-white shadow-md rounded-lg p-6 mt-6">
       <h2 className="text-2xl font-bold mb-4">User Management</h2>
+      <input
+        type="search"
+        value={query}
+        onChange={(e) => setQuery(e.target.value)}
+        placeholder="Search by name or email"
+        className="w-full p-2 mb-4 border rounded"
+      />
       <table className="w-full border-collapse">
         <thead>
           <tr className="bg-gray-100">
@@ -134,6 +151,16 @@ export function UserList({ userId, userRole }) {
           ))}
         </tbody>
       </table>
+      {nextCursor && (
+        <div className="mt-4 text-center">
+          <button
+            onClick={() => fetchUsers(nextCursor)}
+            className="bg-gray-100 text-gray-700 px-4 py-2 rounded hover:bg-gray-200"
+          >
+            Load more
+          </button>
+        </div>
+      )}
     </div>
   );
 }